@@ -0,0 +1,83 @@
+# apidocs.py
+# Documentazione dell'API caricata solo quando serve: all'avvio non si importa
+# flasgger (con jsonschema, yaml, mistune, ...) e non si analizzano le
+# docstring delle route.
+# - /apispec_1.json: spec precalcolata al build dell'immagine in APISPEC_PATH
+#     python -m src.backend.apidocs [percorso]
+#   letta e tenuta in memoria alla prima richiesta; se il file manca (sviluppo)
+#   viene generata una sola volta dalle docstring delle route.
+# - /apidocs/ (Swagger UI) e i suoi statici: un'app Flask separata con
+#   flasgger, costruita alla prima richiesta (Flask non accetta nuove route
+#   dopo l'avvio) e chiamata come applicazione WSGI.
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from flask import Flask
+
+APISPEC_PATH = os.environ.get("APISPEC_PATH",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apispec.json'))
+APISPEC_ENDPOINT = 'apispec_1'
+
+
+class ApiDocs:
+    """Spec e Swagger UI di app, inizializzate alla prima richiesta (thread-safe)."""
+    def __init__(self, app: Flask, spec_path: str = APISPEC_PATH):
+        self._app = app
+        self._spec_path = spec_path
+        self._lock = threading.Lock()
+        self._spec: tuple[bytes, str] | None = None
+        self._ui: Flask | None = None
+
+    def spec(self) -> tuple[bytes, str]:
+        """(JSON della spec, ETag)."""
+        if self._spec is None:
+            with self._lock:
+                if self._spec is None:
+                    try:
+                        with open(self._spec_path, 'rb') as fh:
+                            body = fh.read()
+                    except FileNotFoundError:
+                        body = json.dumps(build_spec(self._app), separators=(',', ':')).encode()
+                    self._spec = body, hashlib.blake2b(body, digest_size=16).hexdigest()
+        return self._spec
+
+    def ui(self) -> Flask:
+        """App WSGI con la Swagger UI di flasgger, che legge la spec da /apispec_1.json."""
+        if self._ui is None:
+            with self._lock:
+                if self._ui is None:
+                    from flasgger import Swagger
+
+                    ui = Flask(__name__)
+                    Swagger(ui)
+                    self._ui = ui
+        return self._ui
+
+
+def build_spec(app: Flask) -> dict:
+    """Spec Swagger 2.0 dalle docstring YAML delle route di app (come Swagger(app))."""
+    from flasgger import Swagger
+
+    # Senza init_app: nessun blueprint né hook registrato su app
+    swagger = Swagger()
+    swagger.app = app
+    swagger.load_config(app)
+    with app.app_context():
+        return swagger.get_apispecs(APISPEC_ENDPOINT)
+
+
+def main():
+    from src.backend.app import app
+
+    path = sys.argv[1] if len(sys.argv) > 1 else APISPEC_PATH
+    spec = build_spec(app)
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(spec, fh, separators=(',', ':'))
+    print(f"{path}: {len(spec['paths'])} path")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,119 @@
 # app.py
 
+import atexit
+import json
 import os
+import time
 import uuid
-from flask import Flask, send_from_directory, jsonify, request, redirect, url_for, session
-from flasgger import Swagger  # Importa la libreria Flasgger
+import io
+from flask import Flask, send_file, jsonify, request, redirect, session, stream_with_context, abort
+from werkzeug.wsgi import wrap_file
 
 
 from flask_cors import CORS
 
-from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore
-from src.backend.service.service import TaskServiceSession
+from src.backend.apidocs import ApiDocs
+from src.backend.core.model import TASK_FIELDS
+from src.backend.infrastructure.blobstore import BLOB_STORE
+from src.backend.infrastructure.metrics import METRICS
+from src.backend.infrastructure.profiler import PROFILER
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore, TaskConflict, TaskRepository
+from src.backend.infrastructure.static_assets import StaticAssets
+from src.backend.infrastructure.upload import UploadError, read_multipart_task
+from src.backend.service.admission import Overloaded
+from src.backend.service.service import ADMISSION, FAIR_EXECUTOR, RESPONSE_CACHE, SCHEDULER, TaskServiceSession, \
+    recover_overdue, snapshot_periodically, sweep_sessions
+
+# Backend dello store: "memory" (default, singolo processo) oppure "sqlite"
+# (file condiviso in WAL, necessario con più worker gunicorn)
+TASK_STORE_BACKEND = os.environ.get("TASK_STORE_BACKEND", "memory")
+
+# Limiti dello store in memoria: TTL delle sessioni inattive e budget in byte
+_store_limits = {
+    "session_ttl": float(os.environ.get("SESSION_TTL_SECONDS", 24 * 3600)),
+    "memory_budget": int(os.environ.get("STORE_MEMORY_BUDGET", 1024 * 1024 * 1024)),
+}
+
+if TASK_STORE_BACKEND == "sqlite":
+    from src.backend.infrastructure.sqlite_repository import SqliteTaskRepository, SqliteTaskStore
+
+    TASK_STORE = SqliteTaskStore(os.environ.get("TASK_DB_PATH", "tasks.db"))
+    _repository_class = SqliteTaskRepository
+elif os.environ.get("TASK_JOURNAL_DIR"):
+    # Store in memoria con persistenza: write-ahead log + snapshot, recovery all'avvio
+    from src.backend.infrastructure.journal import TaskJournal
+
+    _journal = TaskJournal(os.environ["TASK_JOURNAL_DIR"])
+    atexit.register(_journal.close)
+    TASK_STORE = InMemoryTaskStore(journal=_journal, **_store_limits)
+    _repository_class = InMemoryTaskRepository
+    # Le task rimaste in sospeso prima del riavvio vengono ripianificate
+    for _client_id, _task_id in TASK_STORE.recover(BLOB_STORE):
+        TaskServiceSession(InMemoryTaskRepository(store=TASK_STORE, client_id=_client_id)).resumeTask(_task_id)
+    SCHEDULER.schedule(60.0, snapshot_periodically, TASK_STORE)
+else:
+    TASK_STORE = InMemoryTaskStore(**_store_limits)
+    _repository_class = InMemoryTaskRepository
 
-TASK_STORE = InMemoryTaskStore()
 try:
-    from flask import g
+    from flask import g, has_app_context
 except Exception:
     g = None  # opzionale, permette di importare questo modulo anche senza Flask
 
-def get_task_repository(client_id: str) -> InMemoryTaskRepository:
+def get_task_repository(client_id: str) -> TaskRepository:
     """
     Ritorna un repository per-request (se in contesto Flask),
     altrimenti una nuova istanza stateless che usa lo store condiviso.
     """
-    if g is not None:
+    if g is not None and has_app_context():
         attr_name = f"_task_repo_{client_id}"
         repo = getattr(g, attr_name, None)
         if repo is None:
-            repo = InMemoryTaskRepository(store=TASK_STORE, client_id=client_id)
+            repo = _repository_class(store=TASK_STORE, client_id=client_id)
             g._task_repo = repo
         return repo
     # Fallback: istanza nuova stateless (stesso store condiviso)
-    return InMemoryTaskRepository(store=TASK_STORE, client_id=client_id)
+    return _repository_class(store=TASK_STORE, client_id=client_id)
+
+
+if TASK_STORE_BACKEND == "sqlite":
+    # Con più processi: ogni worker completa anche le task rimaste orfane
+    SCHEDULER.schedule(0.0, recover_overdue, TASK_STORE,
+                       lambda client_id: _repository_class(store=TASK_STORE, client_id=client_id))
+else:
+    SCHEDULER.schedule(30.0, sweep_sessions, TASK_STORE)
 
 
 #app = Flask(__name__)
 app = Flask(__name__, static_folder='../frontend/chatbot-ai-fe/dist', static_url_path='/static')
 app.secret_key = 'tropp-secret' # Change this to a long, random string!
-swagger = Swagger(app)
+# Swagger (flasgger) e la spec si caricano alla prima richiesta della documentazione
+API_DOCS = ApiDocs(app)
 
 
 
 # Route per reindirizzare automaticamente
 @app.route('/docs')
 def docs():
-    return redirect(url_for('swagger_ui.show_swagger_ui'))
+    return redirect('/apidocs/')
+
+
+@app.route('/apispec_1.json')
+def apispec():
+    # Spec precalcolata al build (python -m src.backend.apidocs) e in memoria dopo la prima lettura
+    body, etag = API_DOCS.spec()
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@app.route('/apidocs/')
+@app.route('/apidocs/index.html')
+@app.route('/oauth2-redirect.html')
+@app.route('/flasgger_static/<path:filename>')
+def apidocs(filename=None):
+    # Swagger UI servita dall'app di flasgger, costruita alla prima richiesta
+    return app.response_class.from_app(API_DOCS.ui(), request.environ)
 
 
 @app.route('/api/newchat', methods=['POST'])
@@ -68,16 +138,42 @@ def new_chat():
     return jsonify({"client_id": session['client_id']})
 
 
+# Statici del frontend da un manifest costruito all'avvio (niente stat per richiesta)
+STATIC_ASSETS = StaticAssets(app.static_folder)
+
+
 @app.route("/")
 def serve_react_app():
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_response(STATIC_ASSETS.fallback)
 
 @app.route("/<path:path>")
 def serve_static_assets(path):
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+    return static_response(path)
+
+
+def static_response(path: str):
+    """
+    File del build con la variante scelta da Accept-Encoding; le route del
+    frontend senza un file corrispondente ricevono index.html (SPA).
+    """
+    asset = STATIC_ASSETS.get(path) or STATIC_ASSETS.get(STATIC_ASSETS.fallback)
+    if asset is None:
+        abort(404)
+    variant = asset.select(request.accept_encodings)
+    if request.if_none_match.contains(variant.etag):
+        # Revalidazione risolta dal manifest, senza aprire il file
+        response = app.response_class(status=304)
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        response = app.response_class(wrap_file(request.environ, open(variant.path, 'rb')),
+                                      mimetype=asset.mimetype, direct_passthrough=True)
+        response.content_length = variant.size
+        if variant.encoding is not None:
+            response.content_encoding = variant.encoding
+    response.set_etag(variant.etag)
+    response.headers['Cache-Control'] = asset.cache_control
+    if asset.negotiated:
+        response.vary.add('Accept-Encoding')
+    return response
 CORS(app)
 
 
@@ -99,18 +195,198 @@ def home():
     client_id = get_or_create_client_id()
     return f"Your client ID is: {client_id}"
 
+
+@app.route('/api/stats')
+def stats():
+    """
+    Statistiche di esercizio
+    Questo endpoint restituisce lo stato del controllo di ammissione (posti
+    occupati e rifiuti), della coda dei completamenti (profondità e ritardo
+    tra scadenza e avvio dei job), del dispatcher equo, della cache delle
+    risposte (hit, miss, richieste accorpate) e dello store.
+    ---
+    tags:
+      - Monitoraggio
+    responses:
+      200:
+        description: Statistiche correnti.
+    """
+    result = {"admission": ADMISSION.stats(), "scheduler": SCHEDULER.stats(), "executor": FAIR_EXECUTOR.stats(),
+              "responseCache": RESPONSE_CACHE.stats()}
+    if hasattr(TASK_STORE, 'stats'):
+        result["store"] = TASK_STORE.stats()
+    return jsonify(result)
+
+
+# Metriche Prometheus: latenza per route, gauge calcolati allo scrape
+REQUEST_LATENCY = METRICS.histogram(
+    'chatbot_http_request_duration_seconds', 'Latenza delle richieste HTTP per metodo e route',
+    labelnames=('method', 'route'))
+# Metodi registrati con il proprio nome, gli altri (scelti dal client) come OTHER
+HTTP_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS', 'CONNECT', 'TRACE'})
+METRICS.gauge('chatbot_sessions', 'Sessioni nello store in memoria', lambda: TASK_STORE.stats()["sessions"])
+METRICS.gauge('chatbot_tasks', 'Task nello store in memoria', lambda: TASK_STORE.stats()["tasks"])
+METRICS.gauge('chatbot_store_resident_bytes', 'Occupazione stimata dello store in memoria, allegati inclusi',
+              lambda: TASK_STORE.resident_bytes())
+METRICS.gauge('chatbot_attachment_bytes', 'Byte degli allegati nel blob store',
+              lambda: {("memory",): BLOB_STORE.stats()["memoryBytes"], ("disk",): BLOB_STORE.stats()["diskBytes"]},
+              labelnames=('location',))
+METRICS.gauge('chatbot_executor_queued', 'Job in attesa nel fair executor',
+              lambda: FAIR_EXECUTOR.stats()["queuedInteractive"] + FAIR_EXECUTOR.stats()["queuedBatch"])
+METRICS.gauge('chatbot_admission_pending', 'Completamenti ammessi e non ancora conclusi',
+              lambda: ADMISSION.stats()["pending"])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response):
+    started = g.get('request_started')
+    if started is not None and METRICS.enabled:
+        # La route è il pattern (es. /api/tasks/<task_id>), non il path: cardinalità limitata
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        method = request.method if request.method in HTTP_METHODS else 'OTHER'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, method, route)
+    return response
+
+
+# Profiling su richiesta: gli hook esistono solo con PROFILE_DIR impostata,
+# altrimenti le richieste non pagano nulla
+if PROFILER is not None:
+    @app.before_request
+    def start_request_profile():
+        if PROFILER.select(request.headers.get('X-Profile')):
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            g.request_profile = PROFILER.start(f'{request.method}-{route}')
+
+    @app.after_request
+    def expose_request_profile(response):
+        if g.get('request_profile') is not None:
+            response.headers['X-Profile-Id'] = g.request_profile.id
+        return response
+
+    @app.teardown_request
+    def finish_request_profile(exc):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            PROFILER.finish(profile)
+
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def profiling_toggle():
+    """
+    Profiling delle richieste
+    Con PROFILE_DIR impostata: GET restituisce lo stato del profiler, POST
+    imposta la quota di richieste da profilare (rate 0 disattiva). Le singole
+    richieste si profilano anche con l'header X-Profile. Richiede PROFILE_TOKEN,
+    da inviare nell'header X-Profile-Token.
+    ---
+    tags:
+      - Monitoraggio
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            rate:
+              type: number
+              example: 0.01
+    responses:
+      200:
+        description: Stato del profiler (rate, richieste profilate, directory).
+      400:
+        description: rate non valido.
+      403:
+        description: Token mancante o errato, oppure PROFILE_TOKEN non impostato.
+      404:
+        description: Profiler non configurato (PROFILE_DIR).
+    """
+    if PROFILER is None:
+        return jsonify({"error": "Profiler non configurato"}), 404
+    if not PROFILER.authorized(request.headers.get('X-Profile-Token')):
+        return jsonify({"error": "Token non valido"}), 403
+    if request.method == 'POST':
+        rate = (request.get_json(silent=True) or {}).get("rate")
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+            return jsonify({"error": "Campo 'rate' deve essere un numero tra 0 e 1"}), 400
+        PROFILER.rate = float(rate)
+    return jsonify(PROFILER.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Metriche Prometheus
+    Questo endpoint espone in formato testo Prometheus gli istogrammi di
+    latenza per route, attesa e possesso dei lock dello store, profondità
+    della coda dell'executor e tempo di completamento delle task, più i
+    gauge di sessioni, task e byte degli allegati.
+    ---
+    tags:
+      - Monitoraggio
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Metriche in formato testo Prometheus 0.0.4.
+    """
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Paginazione di GET /api/tasks: pagina di default con un cursore e massimo consentito
+PAGE_LIMIT_DEFAULT = 50
+PAGE_LIMIT_MAX = 500
+
+
 # Endpoint API per ottenere tutte le attività
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
     """
     Lista delle attività
     Questo endpoint restituisce un elenco di tutte le attività.
+    La risposta ha un ETag (la versione della lista del client) e con
+    If-None-Match invariato risponde 304. Con ?since=<versione> restituisce
+    solo le attività create o modificate e gli uuid cancellati dopo quella versione.
+    Con limit la lista è paginata in ordine di inserimento (senza cursori: la
+    pagina più recente; after/before: le pagine adiacenti a un uuid) e la
+    risposta contiene i cursori before/after delle pagine vicine.
+    fields limita i campi restituiti (es. fields=uuid,done).
     ---
     tags:
       - Attività
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Numero massimo di attività per pagina (1-500).
+      - name: after
+        in: query
+        type: string
+        required: false
+        description: Cursore (uuid); restituisce le attività successive.
+      - name: before
+        in: query
+        type: string
+        required: false
+        description: Cursore (uuid); restituisce le attività precedenti.
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Campi da restituire separati da virgola (uuid, msg, done, msgresponse).
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: Versione (ETag) già nota al client; abilita la risposta incrementale.
     responses:
       200:
-        description: Un elenco di attività.
+        description: Un elenco di attività (o le sole modifiche se è indicato since).
         schema:
           type: object
           properties:
@@ -126,11 +402,75 @@ def get_tasks():
                     type: string
                   done:
                     type: boolean
+            version:
+              type: integer
+              description: Solo con since. Versione da usare nella richiesta successiva.
+            deleted:
+              type: array
+              description: Solo con since. Uuid delle attività cancellate.
+              items:
+                type: string
+            reset:
+              type: boolean
+              description: Solo con since. True se since è troppo vecchia e tasks è la lista completa.
+            before:
+              type: string
+              description: Solo con limit. Cursore della pagina precedente (null se non esiste).
+            after:
+              type: string
+              description: Solo con limit. Cursore della pagina successiva (null se non esiste).
+      304:
+        description: Nessuna modifica rispetto all'ETag indicato.
+      400:
+        description: Parametri non validi o cursore inesistente.
     """
     client_id = get_or_create_client_id()
     repo = get_task_repository(client_id)
 
-    return jsonify(repo.get_all())
+    since = request.args.get('since')
+    limit = request.args.get('limit')
+    try:
+        since = int(since) if since is not None else None
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return jsonify({"error": "since e limit devono essere interi"}), 400
+    if limit is not None and not 1 <= limit <= PAGE_LIMIT_MAX:
+        return jsonify({"error": f"limit deve essere tra 1 e {PAGE_LIMIT_MAX}"}), 400
+    after, before = request.args.get('after'), request.args.get('before')
+    if after is not None and before is not None:
+        return jsonify({"error": "after e before sono alternativi"}), 400
+    if (after is not None or before is not None) and limit is None:
+        limit = PAGE_LIMIT_DEFAULT
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in TASK_FIELDS]
+        if unknown or not fields:
+            return jsonify({"error": f"fields ammessi: {', '.join(TASK_FIELDS)}"}), 400
+
+    # La versione è letta prima dei dati: al peggio l'ETag è più vecchio del
+    # corpo (il client riscaricherà), mai più nuovo
+    version = str(repo.get_version())
+    if request.if_none_match.contains(version):
+        response = app.response_class(status=304)
+    elif since is None and limit is None and fields is None:
+        # Corpo già serializzato dal repository (frammenti JSON in cache per task)
+        response = app.response_class(repo.get_all_json(), mimetype='application/json')
+    elif since is None:
+        page = repo.get_page(limit, after, before, fields)
+        if page is None:
+            return jsonify({"error": "Cursore non trovato"}), 400
+        # Senza limit (solo fields) la risposta resta una lista come quella completa
+        response = jsonify(page if limit is not None else page['tasks'])
+    else:
+        changes = repo.get_changes(since)
+        if changes is None:
+            changes = {"version": int(version), "tasks": repo.get_all(), "deleted": [], "reset": True}
+        response = jsonify(changes)
+    response.set_etag(version)
+    # Il browser rivalida sempre la lista (If-None-Match) invece di usare la copia in cache
+    response.headers['Cache-Control'] = 'no-cache, private'
+    return response
 
 
 # Endpoint API per ottenere una singola attività
@@ -177,15 +517,173 @@ def get_task(task_id):
     return jsonify(task)
 
 
+# Timeout massimo del long-poll: resta ben sotto il --timeout di gunicorn
+WAIT_TIMEOUT_DEFAULT = 25.0
+WAIT_TIMEOUT_MAX = 30.0
+
+
+# Endpoint API long-poll: risponde appena l'attività è completata
+@app.route('/api/tasks/<string:task_id>/wait', methods=['GET'])
+def wait_task(task_id):
+    """
+    Attesa del completamento di un'attività (long-poll)
+    Questo endpoint resta in attesa finché l'attività non è completata (done=true)
+    oppure finché non scade il timeout, e restituisce lo stato corrente.
+    ---
+    tags:
+      - Attività
+    parameters:
+      - name: task_id
+        in: path
+        type: string
+        format: uuid
+        required: true
+        description: UUID dell'attività.
+      - name: timeout
+        in: query
+        type: number
+        required: false
+        description: Secondi massimi di attesa (default 25, massimo 30).
+    responses:
+      200:
+        description: Stato dell'attività al completamento o allo scadere del timeout.
+        schema:
+          type: object
+          properties:
+            uuid:
+              type: string
+              format: uuid
+            msg:
+              type: string
+            done:
+              type: boolean
+      404:
+        description: Attività non trovata.
+    """
+    timeout = request.args.get('timeout', WAIT_TIMEOUT_DEFAULT, type=float)
+    timeout = max(0.0, min(timeout, WAIT_TIMEOUT_MAX))
+    client_id = get_or_create_client_id()
+
+    repo = get_task_repository(client_id)
+    task = repo.wait_done(task_id, timeout)
+    if task is None:
+        return jsonify({"error": "Task non trovata"}), 404
+    return jsonify(task)
+
+
+def task_payload_error(data) -> str | None:
+    """Validazione del corpo JSON di una nuova attività; ritorna il messaggio d'errore o None."""
+    if not isinstance(data, dict):
+        return "Ogni attività deve essere un oggetto"
+    file_structures = data.get("fileStructures") or []
+    blobs = data.get("blobs") or []
+    if not data.get("uuid"):
+        return "Campo 'uuid' obbligatorio"
+    if not data.get("msg"):
+        return "Campo 'msg' obbligatorio"
+    # Validazione correlazione fileStructures/blobs
+    if file_structures and not isinstance(file_structures, list):
+        return "Campo 'fileStructures' deve essere un array"
+    if blobs and not isinstance(blobs, list):
+        return "Campo 'blobs' deve essere un array"
+    if file_structures and len(file_structures) != len(blobs):
+        return "La lunghezza di 'fileStructures' e 'blobs' deve coincidere"
+    return None
+
+
+# Streaming della risposta: durata massima di una connessione (poi il client si
+# riconnette con Last-Event-ID) e intervallo dei commenti keep-alive
+STREAM_MAX_SECONDS = 60.0
+STREAM_KEEPALIVE_SECONDS = 15.0
+
+
+# Endpoint API in streaming (Server-Sent Events) della risposta parziale
+@app.route('/api/tasks/<string:task_id>/stream', methods=['GET'])
+def stream_task(task_id):
+    """
+    Risposta di un'attività in streaming
+    Questo endpoint invia la risposta man mano che viene generata, come
+    Server-Sent Events: un evento per ogni porzione di testo
+    {"delta", "done"} con id pari ai caratteri ricevuti fino a quel punto, e
+    un evento "done" con l'attività completa alla fine. Dopo 60 secondi la
+    connessione si chiude; il client riprende da Last-Event-ID (o ?offset=).
+    ---
+    tags:
+      - Attività
+    produces:
+      - text/event-stream
+    parameters:
+      - name: task_id
+        in: path
+        type: string
+        format: uuid
+        required: true
+        description: UUID dell'attività.
+      - name: offset
+        in: query
+        type: integer
+        required: false
+        description: Caratteri della risposta già ricevuti (alternativa a Last-Event-ID).
+    responses:
+      200:
+        description: Stream di eventi con la risposta parziale.
+      404:
+        description: Attività non trovata.
+    """
+    client_id = get_or_create_client_id()
+    repo = get_task_repository(client_id)
+    if repo.get_by_id(task_id) is None:
+        return jsonify({"error": "Task non trovata"}), 404
+    offset = request.args.get('offset', None, type=int)
+    if offset is None:
+        # Riconnessione di EventSource: l'header è una stringa, va convertita
+        try:
+            offset = int(request.headers.get('Last-Event-ID', 0))
+        except ValueError:
+            offset = 0
+
+    def events(offset):
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            task = repo.wait_response(task_id, offset, min(remaining, STREAM_KEEPALIVE_SECONDS))
+            if task is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            text = task['msgresponse']
+            if len(text) > offset:
+                delta = json.dumps({"delta": text[offset:], "done": task['done']})
+                offset = len(text)
+                yield f'id: {offset}\ndata: {delta}\n\n'
+            elif not task['done']:
+                yield ': keep-alive\n\n'
+            if task['done']:
+                yield f'event: done\ndata: {json.dumps(task)}\n\n'
+                return
+
+    response = app.response_class(stream_with_context(events(offset)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Niente buffering nei reverse proxy (nginx), altrimenti i chunk arrivano tutti insieme
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # Endpoint API per creare una nuova attività
 @app.route('/api/tasks', methods=['POST'])
 def create_task():
     """
     Crea una nuova attività
     Questo endpoint aggiunge una nuova attività all'elenco.
+    In alternativa al JSON accetta multipart/form-data: campi uuid, msg e
+    fileStructures (JSON) seguiti dalle parti file, caricate in streaming.
     ---
     tags:
       - Attività
+    consumes:
+      - application/json
+      - multipart/form-data
     parameters:
       - name: body
         in: body
@@ -235,33 +733,288 @@ def create_task():
                   type: string
                 done:
                   type: boolean
+      200:
+        description: Attività già esistente con lo stesso uuid e contenuto (creazione ripetuta).
       400:
         description: Dati non validi.
+      409:
+        description: uuid già usato da un'attività con un contenuto diverso.
+      413:
+        description: File o richiesta oltre i limiti di dimensione.
+      429:
+        description: Troppe attività in corso per la sessione (header Retry-After).
+      503:
+        description: Coda dei completamenti piena (header Retry-After).
     """
+    if request.mimetype == 'multipart/form-data':
+        return create_task_multipart()
+
     data = request.get_json(silent=True) or {}
+    error = task_payload_error(data)
+    if error:
+        return jsonify({"error": error}), 400
     title = data.get("msg")
     uuid = data.get("uuid")
     file_structures = data.get("fileStructures") or []
     blobs = data.get("blobs") or []
 
-    if not uuid:
-        return jsonify({"error": "Campo 'uuid' obbligatorio"}), 400
-    if not title:
-        return jsonify({"error": "Campo 'msg' obbligatorio"}), 400
-    # Validazione correlazione fileStructures/blobs
-    if file_structures and not isinstance(file_structures, list):
-        return jsonify({"error": "Campo 'fileStructures' deve essere un array"}), 400
-    if blobs and not isinstance(blobs, list):
-        return jsonify({"error": "Campo 'blobs' deve essere un array"}), 400
-    if file_structures and len(file_structures) != len(blobs):
-        return jsonify({"error": "La lunghezza di 'fileStructures' e 'blobs' deve coincidere"}), 400
+    client_id = get_or_create_client_id()
+    repo = get_task_repository(client_id)
+    service = TaskServiceSession(repo, client_id)
+    try:
+        task, created = service.createTask(uuid, title, file_structures=file_structures, blobs=blobs)
+    except ValueError:
+        return jsonify({"error": "Campo 'blobs' deve contenere stringhe base64 valide"}), 400
+    except TaskConflict as exc:
+        return conflict_response(exc)
+    except Overloaded as exc:
+        return overloaded_response(exc)
+
+    return jsonify({"task": task}), 201 if created else 200
+
+
+def conflict_response(exc: TaskConflict):
+    """Risposta 409 per uno uuid già usato da un'attività con un contenuto diverso."""
+    return jsonify({"error": "uuid già usato da un'attività con un contenuto diverso", "uuid": exc.task_id}), 409
 
+
+def overloaded_response(exc: Overloaded):
+    """Risposta 429/503 con Retry-After per una creazione respinta dal controllo di ammissione."""
+    response = jsonify({"error": exc.message})
+    response.status_code = exc.status
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def create_task_multipart():
+    """
+    Variante multipart di create_task: i file vengono scritti nel blob store
+    in streaming, validando prima i metadati e i limiti di dimensione.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        return jsonify({"error": "Boundary multipart mancante"}), 400
     client_id = get_or_create_client_id()
+    # Un servizio saturo respinge la richiesta prima di leggere i file
+    try:
+        ADMISSION.check(client_id)
+    except Overloaded as exc:
+        return overloaded_response(exc)
+    try:
+        data = read_multipart_task(request.stream, boundary, request.content_length, BLOB_STORE)
+    except UploadError as exc:
+        return jsonify({"error": exc.message}), exc.status
+
     repo = get_task_repository(client_id)
-    service = TaskServiceSession(repo)
-    task = service.createTask(uuid, title, file_structures=file_structures, blobs=blobs)
+    service = TaskServiceSession(repo, client_id)
+    try:
+        task, created = service.createTask(data["uuid"], data["msg"], file_structures=data["fileStructures"],
+                                           blobs=data["blobs"])
+    except ValueError as exc:
+        # Allegato scaduto dallo staging prima della creazione (i riferimenti li rilascia il repository)
+        return jsonify({"error": str(exc)}), 400
+    except TaskConflict as exc:
+        return conflict_response(exc)
+    except Overloaded as exc:
+        # Saturazione sopraggiunta durante l'upload: i file caricati non servono più
+        for ref in data["blobs"]:
+            BLOB_STORE.release(ref.digest)
+        return overloaded_response(exc)
+
+    return jsonify({"task": task}), 201 if created else 200
+
+
+# Operazioni batch: massimo numero di elementi per richiesta
+BATCH_MAX_ITEMS = 100
+
+
+def batch_ids():
+    """Lista di id dal corpo {"ids": [...]}; ritorna (ids, None) oppure (None, risposta d'errore)."""
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(task_id, str) for task_id in ids):
+        return None, (jsonify({"error": "Campo 'ids' deve essere un array di stringhe"}), 400)
+    if len(ids) > BATCH_MAX_ITEMS:
+        return None, (jsonify({"error": f"Al massimo {BATCH_MAX_ITEMS} elementi per richiesta"}), 400)
+    return ids, None
+
+
+# Endpoint API per creare più attività in una richiesta
+@app.route('/api/tasks:batch', methods=['POST'])
+def create_tasks_batch():
+    """
+    Crea più attività
+    Questo endpoint crea fino a 100 attività con una sola richiesta (es. replay
+    di una conversazione). Se un elemento non è valido nessuna attività viene creata.
+    ---
+    tags:
+      - Attività
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            tasks:
+              type: array
+              items:
+                type: object
+                properties:
+                  uuid:
+                    type: string
+                    format: uuid
+                  msg:
+                    type: string
+                  fileStructures:
+                    type: array
+                    items:
+                      type: object
+                  blobs:
+                    type: array
+                    items:
+                      type: string
+          required:
+            - tasks
+    responses:
+      201:
+        description: Attività create, nello stesso ordine della richiesta.
+        schema:
+          type: object
+          properties:
+            tasks:
+              type: array
+              items:
+                type: object
+      200:
+        description: Tutte le attività esistevano già (batch ripetuto).
+      400:
+        description: Dati non validi (con l'indice dell'elemento errato).
+      409:
+        description: Un uuid è già usato da un'attività con un contenuto diverso; nessuna attività creata.
+      429:
+        description: Troppe attività in corso per la sessione (header Retry-After).
+      503:
+        description: Coda dei completamenti piena (header Retry-After).
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("tasks")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Campo 'tasks' deve essere un array non vuoto"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Al massimo {BATCH_MAX_ITEMS} elementi per richiesta"}), 400
+    for index, item in enumerate(items):
+        error = task_payload_error(item)
+        if error:
+            return jsonify({"error": error, "index": index}), 400
+
+    client_id = get_or_create_client_id()
+    service = TaskServiceSession(get_task_repository(client_id), client_id)
+    try:
+        results = service.createTasks(items)
+    except ValueError:
+        return jsonify({"error": "Campo 'blobs' deve contenere stringhe base64 valide"}), 400
+    except TaskConflict as exc:
+        return conflict_response(exc)
+    except Overloaded as exc:
+        return overloaded_response(exc)
 
-    return jsonify({"task": task}), 201
+    created = any(is_new for _, is_new in results)
+    return jsonify({"tasks": [task for task, _ in results]}), 201 if created else 200
+
+
+# Endpoint API per lo stato di più attività
+@app.route('/api/tasks:status', methods=['POST'])
+def tasks_status():
+    """
+    Stato di più attività
+    Questo endpoint restituisce lo stato compatto di fino a 100 attività:
+    {"done": false} se in corso, {"done": true, "msgresponse"} se completata,
+    null se non esiste.
+    ---
+    tags:
+      - Attività
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            ids:
+              type: array
+              items:
+                type: string
+                format: uuid
+          required:
+            - ids
+    responses:
+      200:
+        description: Mappa id -> stato.
+        schema:
+          type: object
+          properties:
+            tasks:
+              type: object
+              additionalProperties:
+                type: object
+                properties:
+                  done:
+                    type: boolean
+                  msgresponse:
+                    type: string
+      400:
+        description: Dati non validi.
+    """
+    ids, error = batch_ids()
+    if error:
+        return error
+    client_id = get_or_create_client_id()
+    return jsonify({"tasks": get_task_repository(client_id).get_status(ids)})
+
+
+# Endpoint API per eliminare più attività
+@app.route('/api/tasks:batch', methods=['DELETE'])
+def delete_tasks_batch():
+    """
+    Elimina più attività
+    Questo endpoint elimina fino a 100 attività con una sola richiesta.
+    ---
+    tags:
+      - Attività
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            ids:
+              type: array
+              items:
+                type: string
+                format: uuid
+          required:
+            - ids
+    responses:
+      200:
+        description: Mappa id -> true se eliminata, false se non trovata.
+        schema:
+          type: object
+          properties:
+            deleted:
+              type: object
+              additionalProperties:
+                type: boolean
+      400:
+        description: Dati non validi.
+    """
+    ids, error = batch_ids()
+    if error:
+        return error
+    client_id = get_or_create_client_id()
+    service = TaskServiceSession(get_task_repository(client_id), client_id)
+    return jsonify({"deleted": service.deleteTasks(ids)})
 
 
 # Endpoint API per aggiornare un'attività esistente
@@ -315,7 +1068,10 @@ def update_task(task_id):
     client_id = get_or_create_client_id()
 
     repo = get_task_repository(client_id)
-    updated = repo.update(task_id, data)
+    try:
+        updated = repo.update(task_id, data)
+    except ValueError:
+        return jsonify({"error": "Campo 'blobs' deve contenere stringhe base64 valide"}), 400
     if updated is None:
         return jsonify({"error": "Task non trovata"}), 404
     return jsonify({"task": updated})
@@ -345,8 +1101,8 @@ def delete_task(task_id):
     """
 
     client_id = get_or_create_client_id()
-    repo = get_task_repository(client_id)
-    ok = repo.delete(task_id)
+    service = TaskServiceSession(get_task_repository(client_id), client_id)
+    ok = service.deleteTasks([task_id])[task_id]
     if not ok:
         return jsonify({"error": "Task non trovata"}), 404
     return jsonify({"result": True})
@@ -392,15 +1148,82 @@ def get_task_files(task_id: str, file_idx: int = 0):
     """
     client_id = get_or_create_client_id()
     repo = get_task_repository(client_id)
-    files = repo.get_by_id_with_attachments(task_id)
+    # Ricodifica solo l'allegato richiesto, non tutti quelli della task
+    attachment = repo.get_attachment(task_id, file_idx, encoded=True)
 
-    if files is None:
+    if attachment is None:
         return jsonify({"error": "Task non trovata"}), 404
     return jsonify({
         "taskId": task_id,
-        "fileStructures": [files.get("fileStructures", [])[file_idx]], #files.get("fileStructures", []),
-        "blobs": [files.get("blobs", [])[file_idx]]
+        "fileStructures": [attachment["fileStructure"]],
+        "blobs": [attachment["source"]]
     })
+
+
+@app.route('/api/tasks/<string:task_id>/files/<int:file_idx>/raw', methods=['GET'])
+def download_task_file(task_id: str, file_idx: int):
+    """
+    Download binario di un allegato
+    Questo endpoint restituisce il contenuto binario dell'allegato con il suo contentType,
+    con supporto a Range (206), ETag e richieste condizionali (304).
+    ---
+    tags:
+      - Attività
+    produces:
+      - application/octet-stream
+    parameters:
+      - name: task_id
+        in: path
+        type: string
+        required: true
+        description: ID della task.
+      - name: file_idx
+        in: path
+        type: integer
+        required: true
+        description: Indice del file da prelevare
+      - name: Range
+        in: header
+        type: string
+        required: false
+        description: Intervallo di byte richiesto (es. bytes=0-1023).
+    responses:
+      200:
+        description: Contenuto del file.
+      206:
+        description: Contenuto parziale del file.
+      304:
+        description: Il file non è cambiato (If-None-Match).
+      404:
+        description: Attività o file non trovato.
+      416:
+        description: Range non soddisfacibile.
+    """
+    client_id = get_or_create_client_id()
+    repo = get_task_repository(client_id)
+    attachment = repo.get_attachment(task_id, file_idx)
+
+    if attachment is None:
+        return jsonify({"error": "File non trovato"}), 404
+    structure = attachment["fileStructure"] or {}
+    source = attachment["source"]
+    # Su disco: path servito zero-copy via wsgi.file_wrapper; in memoria: stream sui byte
+    body = io.BytesIO(source) if isinstance(source, bytes) else source
+    try:
+        # Il contenuto è indirizzato per digest: l'ETag forte non cambia mai per lo stesso file
+        response = send_file(
+            body,
+            mimetype=structure.get("contentType") or "application/octet-stream",
+            download_name=structure.get("filename") or f"{task_id}-{file_idx}",
+            conditional=True,
+            etag=attachment["digest"],
+        )
+    except FileNotFoundError:
+        # Blob su disco rilasciato nel frattempo (task cancellata o sessione rimossa)
+        return jsonify({"error": "File non trovato"}), 404
+    # Allegati della sessione: niente cache condivise, il browser rivalida con l'ETag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 # ..
 
 
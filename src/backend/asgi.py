@@ -0,0 +1,545 @@
+# asgi.py
+# Entry point ASGI (asyncio) accanto a src.backend.app:app (WSGI/gthread):
+#   uvicorn src.backend.asgi:app --host 0.0.0.0 --port 8000
+# Gli endpoint delle task che tengono aperta la connessione (wait, stream) e
+# quelli più frequenti (lettura, creazione JSON, cancellazione) sono nativi:
+# un'attesa è un asyncio.Event svegliato dallo store, non un thread bloccato,
+# e un processo regge migliaia di connessioni inattive. Le chiamate allo store
+# e al servizio (lock, SQLite, base64) girano in un piccolo pool di thread,
+# così l'event loop non si blocca mai.
+# Con lo store in memoria le letture brevi (una task, la versione) girano nel
+# loop solo se il lock della stripe è libero (try_lock: senza attese e senza
+# eviction delle sessioni): passare dal pool le metterebbe in coda dietro le
+# creazioni. Con il lock occupato, e sempre per la lista completa, si passa dal pool.
+# Tutto il resto (swagger, statici, multipart, batch, file, ...) passa
+# all'app Flask tramite un ponte WSGI con il corpo già letto in modo asincrono.
+# Sessione (cookie firmato di Flask), CORS e metriche sono gli stessi dell'app WSGI.
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+from werkzeug.http import dump_cookie, parse_cookie, parse_etags, quote_etag
+
+from src.backend.app import REQUEST_LATENCY, STREAM_KEEPALIVE_SECONDS, STREAM_MAX_SECONDS, TASK_STORE, \
+    WAIT_TIMEOUT_DEFAULT, WAIT_TIMEOUT_MAX, app as flask_app, get_task_repository, task_payload_error
+from src.backend.infrastructure.metrics import METRICS
+from src.backend.infrastructure.repository import TaskConflict
+from src.backend.infrastructure.upload import MAX_REQUEST_BYTES
+from src.backend.service.admission import Overloaded
+from src.backend.service.service import TaskServiceSession
+
+# Thread per lo store e il servizio (operazioni brevi) e per le richieste
+# passate a Flask (possono leggere allegati o generare risposte lunghe)
+ASGI_STORE_THREADS = int(os.environ.get("ASGI_STORE_THREADS", 8))
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 16))
+# Corpo massimo di una creazione JSON nativa (gli allegati base64 sono nel corpo)
+ASGI_MAX_JSON_BYTES = int(os.environ.get("ASGI_MAX_JSON_BYTES", MAX_REQUEST_BYTES))
+# Corpo delle richieste passate a Flask tenuto in memoria fino a questa soglia, poi su file
+ASGI_SPOOL_BYTES = 1024 * 1024
+
+STORE_EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_STORE_THREADS, thread_name_prefix='asgi-store')
+WSGI_EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+_SESSION_COOKIE = flask_app.config['SESSION_COOKIE_NAME']
+_SESSION_SERIALIZER = flask_app.session_interface.get_signing_serializer(flask_app)
+# Senza sessione permanente Flask accetta cookie firmati da non più di questi secondi
+_SESSION_MAX_AGE = flask_app.permanent_session_lifetime.total_seconds()
+_END = object()
+
+
+class _Waiters:
+    """
+    Attese asyncio per task. Lo store chiama notify(client_id, task_id) da
+    qualunque thread a ogni task completata, chunk di risposta o cancellazione
+    (task_id None: sessione rimossa, tutte le attese del client): gli eventi
+    vengono impostati nell'event loop con call_soon_threadsafe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: dict[tuple[str, str], set] = {}
+        self._loop = None
+
+    def register(self, client_id: str, task_id: str, event: asyncio.Event):
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._events.setdefault((client_id, task_id), set()).add(event)
+
+    def unregister(self, client_id: str, task_id: str, event: asyncio.Event):
+        with self._lock:
+            events = self._events.get((client_id, task_id))
+            if events is not None:
+                events.discard(event)
+                if not events:
+                    del self._events[(client_id, task_id)]
+
+    def notify(self, client_id: str, task_id: str | None):
+        if task_id is not None and (client_id, task_id) not in self._events:
+            return
+        with self._lock:
+            if task_id is None:
+                events = [event for key, waiting in self._events.items() if key[0] == client_id
+                          for event in waiting]
+            else:
+                events = list(self._events.get((client_id, task_id), ()))
+            loop = self._loop
+        if events:
+            loop.call_soon_threadsafe(_set_all, events)
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
+
+
+WAITERS = _Waiters()
+if hasattr(TASK_STORE, 'add_done_listener'):
+    TASK_STORE.add_done_listener(WAITERS.notify)
+    # Con lo store in memoria le attese sono svegliate dallo store
+    _POLL_INTERVAL = None
+    _INLINE_READS = hasattr(TASK_STORE, 'try_lock')
+else:
+    # SQLite: le modifiche possono arrivare da altri processi, si interroga a
+    # intervalli; ogni lettura è I/O e passa dal pool
+    _POLL_INTERVAL = 0.1
+    _INLINE_READS = False
+
+
+class _Request:
+    """Richiesta HTTP nativa: scope ASGI, header, query e sessione del client."""
+    __slots__ = ('scope', 'receive', 'method', 'headers', 'query', 'client_id', 'set_cookie',
+                 'wake', 'disconnected', '_watcher')
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope['method']
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.query = parse_qs(scope['query_string'].decode('latin-1'))
+        self.client_id = None
+        self.set_cookie = None
+        # Svegliato dallo store (o dalla disconnessione del client) durante le attese
+        self.wake = asyncio.Event()
+        self.disconnected = False
+        self._watcher = None
+
+    def arg(self, name: str, default=None, type=str):
+        values = self.query.get(name)
+        if not values:
+            return default
+        try:
+            return type(values[0])
+        except ValueError:
+            return default
+
+    def session(self) -> str:
+        """client_id dal cookie di sessione di Flask; se manca ne crea uno nuovo (come get_or_create_client_id)."""
+        if self.client_id is None:
+            data = {}
+            raw = parse_cookie(self.headers.get('cookie', '')).get(_SESSION_COOKIE)
+            if raw:
+                try:
+                    data = _SESSION_SERIALIZER.loads(raw, max_age=_SESSION_MAX_AGE)
+                except BadSignature:
+                    data = {}
+            if 'client_id' not in data:
+                data['client_id'] = str(uuid.uuid4())
+                self.set_cookie = dump_cookie(
+                    _SESSION_COOKIE, _SESSION_SERIALIZER.dumps(data), path=flask_app.config['SESSION_COOKIE_PATH'] or '/',
+                    httponly=flask_app.config['SESSION_COOKIE_HTTPONLY'],
+                    secure=flask_app.config['SESSION_COOKIE_SECURE'],
+                    samesite=flask_app.config['SESSION_COOKIE_SAMESITE'])
+            self.client_id = data['client_id']
+        return self.client_id
+
+    async def body(self, limit: int) -> bytes | None:
+        """Corpo completo; None se supera limit byte."""
+        chunks, size = [], 0
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected = True
+                return b''.join(chunks)
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def watch_disconnect(self):
+        """Da chiamare dopo aver letto il corpo: una disconnessione sveglia le attese in corso."""
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected = True
+                self.wake.set()
+                return
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+
+
+def _headers(request: _Request, content_type: str, extra=()) -> list:
+    headers = [(b'content-type', content_type.encode())]
+    headers.extend((name.encode('latin-1'), value.encode('latin-1')) for name, value in extra)
+    if request.set_cookie is not None:
+        headers.append((b'set-cookie', request.set_cookie.encode('latin-1')))
+        headers.append((b'vary', b'Cookie'))
+    if 'origin' in request.headers:
+        # Come CORS(app) con la configurazione di default
+        headers.append((b'access-control-allow-origin', b'*'))
+    return headers
+
+
+async def _respond(send, request: _Request, status: int, body: bytes = b'',
+                   content_type: str = 'application/json', extra=()):
+    headers = _headers(request, content_type, extra)
+    headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _json(send, request: _Request, status: int, payload, extra=()):
+    # Stesso formato compatto di jsonify
+    body = json.dumps(payload, separators=(',', ':'), sort_keys=True).encode() + b'\n'
+    await _respond(send, request, status, body, extra=extra)
+
+
+async def _in_store(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(STORE_EXECUTOR, partial(function, *args, **kwargs))
+
+
+async def _read(client_id: str, function, *args):
+    """
+    Lettura breve dallo store: nel loop se il lock della stripe del client è
+    libero (lo store in memoria non attende mai), altrimenti nel pool.
+    """
+    if _INLINE_READS and TASK_STORE.try_lock(client_id):
+        try:
+            return function(*args)
+        finally:
+            TASK_STORE.unlock(client_id)
+    return await _in_store(function, *args)
+
+
+async def _wait_for(request: _Request, repo, task_id: str, predicate, timeout: float):
+    """
+    Attende (al massimo timeout secondi) che la task soddisfi predicate, senza
+    occupare thread: ritorna la task (anche se non pronta allo scadere) o None.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    client_id = request.session()
+    WAITERS.register(client_id, task_id, request.wake)
+    try:
+        while True:
+            # Azzerato prima della lettura: una notifica arrivata nel frattempo non si perde
+            request.wake.clear()
+            task = await _read(client_id, repo.get_by_id, task_id)
+            remaining = deadline - loop.time()
+            if task is None or predicate(task) or remaining <= 0 or request.disconnected:
+                return task
+            try:
+                await asyncio.wait_for(request.wake.wait(), min(remaining, _POLL_INTERVAL or remaining))
+            except TimeoutError:
+                pass
+    finally:
+        WAITERS.unregister(client_id, task_id, request.wake)
+
+
+# Endpoint nativi (stessa semantica delle route Flask omonime)
+
+async def get_tasks(request: _Request, send):
+    client_id = request.session()
+    repo = get_task_repository(client_id)
+    version = str(await _read(client_id, repo.get_version))
+    extra = [('etag', quote_etag(version)), ('cache-control', 'no-cache, private')]
+    if parse_etags(request.headers.get('if-none-match')).contains(version):
+        return await _respond(send, request, 304, extra=extra)
+    # La lista completa (serializzazione proporzionale alla sessione) non gira mai nel loop
+    await _respond(send, request, 200, await _in_store(repo.get_all_json), extra=extra)
+
+
+async def get_task(request: _Request, send, task_id: str):
+    client_id = request.session()
+    repo = get_task_repository(client_id)
+    task = await _read(client_id, repo.get_by_id, task_id)
+    if task is None:
+        return await _json(send, request, 404, {"error": "Task non trovata"})
+    await _json(send, request, 200, task)
+
+
+async def wait_task(request: _Request, send, task_id: str):
+    timeout = max(0.0, min(request.arg('timeout', WAIT_TIMEOUT_DEFAULT, float), WAIT_TIMEOUT_MAX))
+    repo = get_task_repository(request.session())
+    request.watch_disconnect()
+    task = await _wait_for(request, repo, task_id, lambda task: task['done'], timeout)
+    if task is None:
+        return await _json(send, request, 404, {"error": "Task non trovata"})
+    await _json(send, request, 200, task)
+
+
+async def stream_task(request: _Request, send, task_id: str):
+    client_id = request.session()
+    repo = get_task_repository(client_id)
+    if await _read(client_id, repo.get_by_id, task_id) is None:
+        return await _json(send, request, 404, {"error": "Task non trovata"})
+    offset = request.arg('offset', None, int)
+    if offset is None:
+        try:
+            offset = int(request.headers.get('last-event-id', 0))
+        except ValueError:
+            offset = 0
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _headers(
+        request, 'text/event-stream; charset=utf-8', [('cache-control', 'no-cache'), ('x-accel-buffering', 'no')])})
+    request.watch_disconnect()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_MAX_SECONDS
+    while not request.disconnected:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        task = await _wait_for(request, repo, task_id, lambda task: task['done'] or len(task['msgresponse']) > offset,
+                               min(remaining, STREAM_KEEPALIVE_SECONDS))
+        if request.disconnected:
+            break
+        if task is None:
+            await send({'type': 'http.response.body', 'body': b'event: gone\ndata: {}\n\n', 'more_body': True})
+            break
+        text = task['msgresponse']
+        if len(text) > offset:
+            delta = json.dumps({"delta": text[offset:], "done": task['done']})
+            offset = len(text)
+            event = f'id: {offset}\ndata: {delta}\n\n'
+        elif not task['done']:
+            event = ': keep-alive\n\n'
+        else:
+            event = ''
+        if task['done']:
+            event += f'event: done\ndata: {json.dumps(task)}\n\n'
+        await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+        if task['done']:
+            break
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def create_task(request: _Request, send):
+    raw = await request.body(ASGI_MAX_JSON_BYTES)
+    if raw is None:
+        return await _json(send, request, 413, {"error": f"Richiesta oltre il limite di {ASGI_MAX_JSON_BYTES} byte"})
+    try:
+        data = json.loads(raw) if raw else {}
+    except ValueError:
+        data = {}
+    error = task_payload_error(data or {})
+    if error:
+        return await _json(send, request, 400, {"error": error})
+
+    client_id = request.session()
+    service = TaskServiceSession(get_task_repository(client_id), client_id)
+    try:
+        task, created = await _in_store(service.createTask, data["uuid"], data["msg"],
+                                        file_structures=data.get("fileStructures") or [],
+                                        blobs=data.get("blobs") or [])
+    except ValueError:
+        return await _json(send, request, 400, {"error": "Campo 'blobs' deve contenere stringhe base64 valide"})
+    except TaskConflict as exc:
+        return await _json(send, request, 409, {"error": "uuid già usato da un'attività con un contenuto diverso",
+                                                "uuid": exc.task_id})
+    except Overloaded as exc:
+        return await _json(send, request, exc.status, {"error": exc.message},
+                           extra=[('retry-after', str(exc.retry_after))])
+    await _json(send, request, 201 if created else 200, {"task": task})
+
+
+async def delete_task(request: _Request, send, task_id: str):
+    client_id = request.session()
+    service = TaskServiceSession(get_task_repository(client_id), client_id)
+    if not (await _in_store(service.deleteTasks, [task_id]))[task_id]:
+        return await _json(send, request, 404, {"error": "Task non trovata"})
+    await _json(send, request, 200, {"result": True})
+
+
+# (metodo, path, handler, route Flask usata come label delle metriche)
+_ROUTES = [
+    ('GET', re.compile(r'/api/tasks'), get_tasks, '/api/tasks'),
+    ('POST', re.compile(r'/api/tasks'), create_task, '/api/tasks'),
+    ('GET', re.compile(r'/api/tasks/(?P<task_id>[^/]+)'), get_task, '/api/tasks/<string:task_id>'),
+    ('DELETE', re.compile(r'/api/tasks/(?P<task_id>[^/]+)'), delete_task, '/api/tasks/<string:task_id>'),
+    ('GET', re.compile(r'/api/tasks/(?P<task_id>[^/]+)/wait'), wait_task, '/api/tasks/<string:task_id>/wait'),
+    ('GET', re.compile(r'/api/tasks/(?P<task_id>[^/]+)/stream'), stream_task, '/api/tasks/<string:task_id>/stream'),
+]
+
+
+def _match(request: _Request, path: str):
+    for route_method, pattern, handler, rule in _ROUTES:
+        if route_method == request.method:
+            match = pattern.fullmatch(path)
+            if match is not None:
+                break
+    else:
+        return None, None, None
+    # Restano in Flask: lista con since, limit, cursori o fields e upload
+    # multipart (in streaming sul blob store)
+    if handler is get_tasks and request.query:
+        return None, None, None
+    if handler is create_task and request.headers.get('content-type', '').startswith('multipart/form-data'):
+        return None, None, None
+    return handler, match.groupdict(), rule
+
+
+# Ponte WSGI verso l'app Flask
+
+async def _to_wsgi(request: _Request, send):
+    """Esegue la richiesta con l'app Flask in WSGI_EXECUTOR, leggendo prima tutto il corpo."""
+    loop = asyncio.get_running_loop()
+    body = tempfile.SpooledTemporaryFile(max_size=ASGI_SPOOL_BYTES)
+    try:
+        size = 0
+        while True:
+            message = await request.receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_REQUEST_BYTES:
+                return await _json(send, request, 413, {"error": f"Richiesta oltre il limite di {MAX_REQUEST_BYTES} byte"})
+            # Scrittura su disco oltre la soglia: fuori dall'event loop
+            if size > ASGI_SPOOL_BYTES:
+                await loop.run_in_executor(WSGI_EXECUTOR, body.write, chunk)
+            else:
+                body.write(chunk)
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        environ = _environ(request.scope, body, size)
+        status, headers, iterator, result = await loop.run_in_executor(WSGI_EXECUTOR, _start_wsgi, environ)
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while True:
+                # Un chunk alla volta: le risposte in streaming non vengono accumulate
+                chunk = await loop.run_in_executor(WSGI_EXECUTOR, next, iterator, _END)
+                if chunk is _END:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(WSGI_EXECUTOR, result.close)
+    finally:
+        body.close()
+
+
+def _environ(scope, body, size: int) -> dict:
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # PEP 3333: il path è una str latin-1 che contiene i byte UTF-8
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f'HTTP_{name}'
+        if key in environ:
+            value = environ[key] + ('; ' if name == 'COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+def _start_wsgi(environ):
+    """Chiama l'app WSGI e ne legge il primo chunk (che per Flask fissa status e header)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return _unsupported_write
+
+    result = flask_app(environ, start_response)
+    iterator = iter(result)
+    first = next(iterator, _END)
+    if first is not _END:
+        iterator = _prepend(first, iterator)
+    return started['status'], started['headers'], iterator, result
+
+
+def _prepend(first, iterator):
+    yield first
+    yield from iterator
+
+
+def _unsupported_write(data):
+    raise RuntimeError("write() di start_response non è supportata")
+
+
+# Applicazione ASGI
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            STORE_EXECUTOR.shutdown(wait=False)
+            WSGI_EXECUTOR.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    started = time.perf_counter()
+    request = _Request(scope, receive)
+    handler, params, rule = _match(request, scope['path'])
+    try:
+        if handler is None:
+            # Le metriche delle richieste passate a Flask le registra l'app Flask
+            return await _to_wsgi(request, send)
+        await handler(request, send, **params)
+        if METRICS.enabled:
+            REQUEST_LATENCY.observe(time.perf_counter() - started, request.method, rule)
+    finally:
+        request.close()
@@ -0,0 +1,189 @@
+# BENCHMARK / ASGI
+# Connessioni inattive: gunicorn gthread (src.backend.app:app) contro uvicorn
+# (src.backend.asgi:app), un processo ciascuno con lo store in memoria.
+# N client tengono ognuno una connessione e per --seconds secondi ripetono:
+# crea una task, long-poll su /wait fino al completamento (1-5,5 s di risposta
+# simulata), pausa di --think secondi: la connessione è quasi sempre inattiva,
+# in attesa della risposta o del messaggio successivo. Nel
+# frattempo una sonda legge una task ogni 50 ms. Per ogni server riporta
+# messaggi completati, attese scadute, latenza della sonda e RSS/thread.
+#
+# Uso (dalla root del repository):
+#   python -m src.backend.benchmarks.bench_asgi [--connections 2000] [--seconds 20] [--think 5]
+#       [--threads 4] [--timeout 25] [--servers gthread,asgi]
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from src.backend.benchmarks.bench_load import _Sampler, _children, _summary
+from src.backend.benchmarks.bench_workers import _wait_ready
+
+
+class _Connection:
+    """
+    Client HTTP/1.1 minimo su asyncio (keep-alive, corpo con Content-Length).
+    Se il server ha chiuso la connessione inattiva (keep-alive scaduto) la
+    riapre e ripete la richiesta: la creazione è idempotente sullo uuid.
+    """
+    def __init__(self, port: int):
+        self.port = port
+        self.reader = self.writer = None
+        self.cookie = None
+
+    async def request(self, method: str, path: str, payload=None) -> tuple[int, bytes]:
+        for attempt in (0, 1):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+            try:
+                return await self._exchange(method, path, payload)
+            except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+
+    async def _exchange(self, method: str, path: str, payload) -> tuple[int, bytes]:
+        body = json.dumps(payload).encode() if payload is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', 'Host: 127.0.0.1', f'Content-Length: {len(body)}']
+        if payload is not None:
+            lines.append('Content-Type: application/json')
+        if self.cookie:
+            lines.append(f'Cookie: {self.cookie}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        length = 0
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'set-cookie' and self.cookie is None:
+                self.cookie = value.strip().split(';')[0]
+        return int(status_line.split()[1]), await self.reader.readexactly(length)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def _idle_client(port: int, deadline: float, think: float, timeout: float, results: dict):
+    loop = asyncio.get_running_loop()
+    try:
+        conn = _Connection(port)
+        try:
+            while loop.time() < deadline:
+                task_id = str(uuid.uuid4())
+                await asyncio.wait_for(conn.request('POST', '/api/tasks', {'uuid': task_id, 'msg': 'asgi'}), timeout)
+                # Margine oltre il timeout del long-poll: scade solo se il server non ha servito l'attesa
+                status, body = await asyncio.wait_for(
+                    conn.request('GET', f'/api/tasks/{task_id}/wait?timeout={timeout}'), timeout + 5)
+                results['done' if status == 200 and json.loads(body)['done'] else 'notDone'] += 1
+                await asyncio.sleep(random.uniform(0, 2 * think))
+        finally:
+            conn.close()
+    except (asyncio.TimeoutError, TimeoutError):
+        results['timeouts'] += 1
+    except OSError:
+        results['errors'] += 1
+
+
+def _probe(port: int, stop: threading.Event, latencies: list, results: dict):
+    # In un thread a parte: il loop dei client inattivi non ne ritarda le misure
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    task_id = str(uuid.uuid4())
+    conn.request('POST', '/api/tasks', body=json.dumps({'uuid': task_id, 'msg': 'sonda'}),
+                 headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    response.read()
+    headers = {'Cookie': response.getheader('Set-Cookie').split(';')[0]}
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn.request('GET', f'/api/tasks/{task_id}', headers=headers)
+            conn.getresponse().read()
+        except TimeoutError:
+            results['probeTimeouts'] += 1
+            conn.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+        stop.wait(0.05)
+    conn.close()
+
+
+async def _storm(port: int, connections: int, seconds: float, think: float, timeout: float) -> dict:
+    results = {'done': 0, 'notDone': 0, 'timeouts': 0, 'errors': 0, 'probeTimeouts': 0}
+    latencies: list[float] = []
+    stop = threading.Event()
+    probe = threading.Thread(target=_probe, args=(port, stop, latencies, results))
+    probe.start()
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    deadline = asyncio.get_running_loop().time() + seconds
+    await asyncio.gather(*(_idle_client(port, deadline, think, timeout, results) for _ in range(connections)))
+    results['seconds'] = round(time.perf_counter() - start, 2)
+    stop.set()
+    probe.join()
+    results['probe'] = _summary(latencies) if latencies else None
+    return results
+
+
+def run(server: str, connections: int, seconds: float, think: float, threads: int, timeout: float, port: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    if server == 'gthread':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', '1', '--threads', str(threads),
+                   '--worker-class', 'gthread', '--worker-connections', str(connections + 100),
+                   '--timeout', '120', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'src.backend.app:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', '--port', str(port), '--log-level', 'warning',
+                   '--backlog', str(connections + 100), 'src.backend.asgi:app']
+    proc = subprocess.Popen(command, env=env)
+    try:
+        _wait_ready(port)
+        sampler = _Sampler(lambda: [proc.pid] + _children(proc.pid))
+        sampler.start()
+        result = asyncio.run(_storm(port, connections, seconds, think, timeout))
+        result.update(sampler.stop())
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--think", type=float, default=5.0, help="pausa media tra due messaggi (secondi)")
+    parser.add_argument("--threads", type=int, default=4, help="thread del worker gthread (come nel Dockerfile)")
+    parser.add_argument("--timeout", type=float, default=25.0, help="timeout del long-poll (secondi)")
+    parser.add_argument("--servers", default="gthread,asgi")
+    parser.add_argument("--port", type=int, default=8772)
+    args = parser.parse_args()
+
+    # Una connessione per client: servono abbastanza descrittori (anche per il server, che li eredita)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, 2 * args.connections + 1024)) if hard != resource.RLIM_INFINITY \
+        else max(soft, 2 * args.connections + 1024)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    for server in args.servers.split(','):
+        result = run(server, args.connections, args.seconds, args.think, args.threads, args.timeout, args.port)
+        probe = result['probe'] or {}
+        print(f"{server:8s} conn={args.connections} completati={result['done']} non_done={result['notDone']} "
+              f"timeout={result['timeouts']} errori={result['errors']} tempo={result['seconds']}s  "
+              f"sonda p50={probe.get('p50Ms')}ms p99={probe.get('p99Ms')}ms max={probe.get('maxMs')}ms "
+              f"(scadute {result['probeTimeouts']})  "
+              f"rss={result['rssMaxBytes'] / 2 ** 20:.0f}MiB thread={result['threadsMax']}")
+
+
+if __name__ == '__main__':
+    main()
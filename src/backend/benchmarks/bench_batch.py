@@ -0,0 +1,63 @@
+# BENCHMARK / BATCH
+# Replay di una conversazione (crea K task, ne legge lo stato, le cancella)
+# con gli endpoint per singola task e con quelli batch: numero di richieste e
+# latenza p50/p99 dell'intero replay. Il test client è in-process, quindi la
+# latenza di rete (che penalizza ancora di più le richieste singole) è esclusa.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_batch [--tasks 50] [--rounds 200]
+import argparse
+import time
+import uuid
+
+from src.backend.app import app
+
+
+def _replay_single(client, ids: list[str]) -> int:
+    for task_id in ids:
+        assert client.post('/api/tasks', json={"uuid": task_id, "msg": "replay"}).status_code == 201
+    for task_id in ids:
+        assert client.get(f'/api/tasks/{task_id}').status_code == 200
+    for task_id in ids:
+        assert client.delete(f'/api/tasks/{task_id}').status_code == 200
+    return 3 * len(ids)
+
+
+def _replay_batch(client, ids: list[str]) -> int:
+    tasks = [{"uuid": task_id, "msg": "replay"} for task_id in ids]
+    assert client.post('/api/tasks:batch', json={"tasks": tasks}).status_code == 201
+    assert client.post('/api/tasks:status', json={"ids": ids}).status_code == 200
+    assert client.delete('/api/tasks:batch', json={"ids": ids}).status_code == 200
+    return 3
+
+
+def _run(replay, tasks: int, rounds: int) -> tuple[int, float, float]:
+    client = app.test_client()
+    client.post('/api/newchat')
+    latencies = []
+    requests = 0
+    for _ in range(rounds):
+        ids = [str(uuid.uuid4()) for _ in range(tasks)]
+        start = time.perf_counter()
+        requests += replay(client, ids)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return requests // rounds, p50 * 1e3, p99 * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"replay di {args.tasks} task, {args.rounds} ripetizioni")
+    for name, replay in (("singole", _replay_single), ("batch", _replay_batch)):
+        requests, p50, p99 = _run(replay, args.tasks, args.rounds)
+        print(f"{name:8s} richieste/replay={requests:4d}  p50={p50:8.2f}ms  p99={p99:8.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# BENCHMARK / CONTENTION
+# Load test multi-sessione sullo store: T thread, ognuno con le proprie sessioni,
+# eseguono un mix di create / get_all / get_by_id / update. Confronta lo store
+# con una sola stripe (equivalente al vecchio lock globale) e con N stripe.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_contention [--threads 1,4,16] [--stripes 1,16]
+import argparse
+import random
+import threading
+import time
+import uuid
+
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore
+
+
+def _worker(store: InMemoryTaskStore, sessions: int, ops: int, barrier: threading.Barrier):
+    repos = [InMemoryTaskRepository(client_id=str(uuid.uuid4()), store=store) for _ in range(sessions)]
+    ids = {id(r): [] for r in repos}
+    barrier.wait()
+    for i in range(ops):
+        repo = random.choice(repos)
+        known = ids[id(repo)]
+        if not known or i % 10 == 0:
+            task_id = str(uuid.uuid4())
+            repo.create({"uuid": task_id, "msg": "load"})
+            known.append(task_id)
+        elif i % 3 == 0:
+            repo.update(random.choice(known), {"done": True})
+        elif i % 3 == 1:
+            repo.get_by_id(random.choice(known))
+        else:
+            repo.get_all()
+
+
+def run(threads: int, stripes: int, sessions: int, ops: int) -> float:
+    store = InMemoryTaskStore(stripes=stripes)
+    barrier = threading.Barrier(threads + 1)
+    pool = [threading.Thread(target=_worker, args=(store, sessions, ops, barrier)) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in pool:
+        t.join()
+    return threads * ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", default="1,4,16,64")
+    parser.add_argument("--stripes", default="1,16")
+    parser.add_argument("--sessions", type=int, default=8, help="sessioni per thread")
+    parser.add_argument("--ops", type=int, default=5000, help="operazioni per thread")
+    args = parser.parse_args()
+
+    stripes = [int(s) for s in args.stripes.split(",")]
+    print(f"{'threads':>8} " + " ".join(f"{f'stripes={s}':>14}" for s in stripes) + "  (ops/s)")
+    for threads in (int(t) for t in args.threads.split(",")):
+        row = [run(threads, s, args.sessions, args.ops) for s in stripes]
+        print(f"{threads:>8} " + " ".join(f"{v:>14.0f}" for v in row))
+
+
+if __name__ == '__main__':
+    main()
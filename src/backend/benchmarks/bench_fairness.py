@@ -0,0 +1,68 @@
+# BENCHMARK / FAIRNESS
+# Tempo di risposta (p50/p99) dei client leggeri mentre un client pesante ha
+# centinaia di completamenti in coda: pool FIFO diretto contro FairExecutor.
+# Ogni job simula il lavoro di un completamento con una sleep di --work-ms.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_fairness [--heavy 100,500,2000] [--light 50]
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.backend.service.fair_executor import PRIORITY_INTERACTIVE, FairExecutor
+
+
+def _run(heavy: int, light: int, work: float, workers: int, fair: bool) -> tuple[float, float]:
+    pool = ThreadPoolExecutor(max_workers=workers)
+    executor = FairExecutor(pool, max_in_flight=workers) if fair else None
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def job(submitted: float, measure: bool):
+        time.sleep(work)
+        if measure:
+            with lock:
+                latencies.append(time.perf_counter() - submitted)
+        done.release()
+
+    def submit(key: str, measure: bool):
+        args = (time.perf_counter(), measure)
+        if executor is not None:
+            executor.submit_for(key, PRIORITY_INTERACTIVE, job, *args)
+        else:
+            pool.submit(job, *args)
+
+    # Il client pesante accoda tutto il suo lavoro in un colpo solo...
+    for _ in range(heavy):
+        submit("heavy", False)
+    # ...mentre i client leggeri inviano un messaggio ciascuno durante la raffica
+    for i in range(light):
+        time.sleep(random.uniform(0, work))
+        submit(f"light-{i}", True)
+    for _ in range(heavy + light):
+        done.acquire()
+    pool.shutdown()
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1e3, latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heavy", default="100,500,2000")
+    parser.add_argument("--light", type=int, default=50)
+    parser.add_argument("--work-ms", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"client leggeri={args.light} lavoro/job={args.work_ms}ms worker={args.workers}")
+    for heavy in (int(value) for value in args.heavy.split(",")):
+        for name, fair in (("fifo", False), ("fair", True)):
+            p50, p99 = _run(heavy, args.light, args.work_ms / 1e3, args.workers, fair)
+            print(f"pesante={heavy:5d} {name}  leggeri p50={p50:8.1f}ms  p99={p99:8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
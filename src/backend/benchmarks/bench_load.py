@@ -0,0 +1,309 @@
+# BENCHMARK / LOAD
+# Load test riproducibile dell'API della chat, in-process (test client Flask)
+# oppure contro un'istanza gunicorn reale avviata dal benchmark. Ogni sessione
+# simulata segue il flusso del frontend:
+#   nuova chat -> import dello storico (batch) -> per ogni messaggio: invio
+#   (con o senza allegato) -> polling fino a done -> lettura dello storico.
+# Riporta throughput, latenze p50/p95/p99 per operazione, tempo fino a done,
+# RSS e thread del server, e salva tutto in JSON (con il commit corrente) per
+# confrontare le esecuzioni tra commit diversi.
+#
+# Uso (dalla root del repository):
+#   python -m src.backend.benchmarks.bench_load [--target inprocess|gunicorn] [--sessions 20]
+#       [--messages 5] [--history 50] [--attachment-ratio 0.2] [--attachment-kb 64]
+#       [--seed 1] [--output bench-results/load.json] [--compare bench-results/prima.json]
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Elementi per richiesta dell'import batch (BATCH_MAX_ITEMS dell'app)
+HISTORY_CHUNK = 100
+
+
+class _InProcessClient:
+    """Sessione HTTP sul test client Flask (cookie gestiti dal client)."""
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method: str, path: str, body=None) -> tuple[int, dict | None]:
+        response = self._client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class _HttpClient:
+    """Sessione HTTP reale (keep-alive) con il cookie di sessione."""
+    def __init__(self, port: int):
+        self._conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self._cookie = None
+
+    def request(self, method: str, path: str, body=None) -> tuple[int, dict | None]:
+        headers = {'Cookie': self._cookie} if self._cookie else {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self._conn.request(method, path, body=payload, headers=headers)
+        response = self._conn.getresponse()
+        data = response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self._cookie = cookie.split(';')[0]
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+def _session(client, index: int, args, latencies: dict, errors: list):
+    """Una sessione completa; latencies: {operazione: [secondi]} propri del thread."""
+    rng = random.Random(args.seed * 100003 + index)
+
+    def call(operation: str, method: str, path: str, body=None):
+        start = time.perf_counter()
+        status, data = client.request(method, path, body)
+        latencies.setdefault(operation, []).append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(f"{operation} {status}")
+        return status, data
+
+    call('new_chat', 'POST', '/api/newchat')
+    history = [{'uuid': str(uuid.uuid4()), 'msg': f'storico {i} sessione {index}'} for i in range(args.history)]
+    for start in range(0, len(history), HISTORY_CHUNK):
+        call('import_history', 'POST', '/api/tasks:batch', {'tasks': history[start:start + HISTORY_CHUNK]})
+    attachment = base64.b64encode(rng.randbytes(args.attachment_kb * 1024)).decode('ascii')
+    for i in range(args.messages):
+        task_id = str(uuid.uuid4())
+        body = {'uuid': task_id, 'msg': f'domanda {i} della sessione {index}: {rng.random()}'}
+        operation = 'send'
+        if rng.random() < args.attachment_ratio:
+            operation = 'send_attachment'
+            body['fileStructures'] = [{'filename': 'documento.pdf', 'contentType': 'application/pdf'}]
+            body['blobs'] = ['data:application/pdf;base64,' + attachment]
+        sent_at = time.perf_counter()
+        status, _ = call(operation, 'POST', '/api/tasks', body)
+        if status >= 400:
+            continue
+        # Polling come il frontend, fino a done o a max_wait secondi
+        while time.perf_counter() - sent_at < args.max_wait:
+            _, task = call('poll', 'GET', f'/api/tasks/{task_id}')
+            if task and task.get('done'):
+                latencies.setdefault('time_to_done', []).append(time.perf_counter() - sent_at)
+                break
+            time.sleep(args.poll_interval)
+        else:
+            errors.append('timeout')
+        call('list_history', 'GET', f'/api/tasks?limit={args.page_size}')
+
+
+def _process_stats(pids: list[int]) -> tuple[int, int]:
+    """(RSS in byte, thread) sommati sui processi indicati, da /proc."""
+    rss = threads = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as fh:
+                for line in fh:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+        except OSError:
+            pass
+    return rss, threads
+
+
+def _children(pid: int) -> list[int]:
+    found = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as fh:
+                    # Il nome del comando può contenere spazi: i campi seguono l'ultima ')'
+                    if int(fh.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        found.append(int(name))
+            except (OSError, IndexError, ValueError):
+                pass
+    return found
+
+
+class _Sampler(threading.Thread):
+    """Campiona RSS e thread dei processi del server durante il test."""
+    def __init__(self, pids, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self._pids = pids
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.samples: list[tuple[int, int]] = []
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(_process_stats(self._pids()))
+            self._stop_event.wait(self._interval)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join()
+        self.samples.append(_process_stats(self._pids()))
+        return {
+            'rssMaxBytes': max(rss for rss, _ in self.samples),
+            'rssEndBytes': self.samples[-1][0],
+            'threadsMax': max(threads for _, threads in self.samples),
+            'threadsEnd': self.samples[-1][1],
+        }
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _summary(values: list[float]) -> dict:
+    return {
+        'count': len(values),
+        'p50Ms': round(_percentile(values, 50) * 1e3, 3),
+        'p95Ms': round(_percentile(values, 95) * 1e3, 3),
+        'p99Ms': round(_percentile(values, 99) * 1e3, 3),
+        'maxMs': round(max(values) * 1e3, 3),
+    }
+
+
+def _run_sessions(make_client, args) -> tuple[float, dict[str, list[float]], list[str]]:
+    per_thread = [{} for _ in range(args.sessions)]
+    errors: list[str] = []
+    pool = [threading.Thread(target=_session, args=(make_client(), index, args, per_thread[index], errors))
+            for index in range(args.sessions)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies: dict[str, list[float]] = {}
+    for own in per_thread:
+        for operation, values in own.items():
+            latencies.setdefault(operation, []).extend(values)
+    return elapsed, latencies, errors
+
+
+def _run_inprocess(args):
+    from src.backend.app import app
+
+    sampler = _Sampler(lambda: [os.getpid()])
+    sampler.start()
+    elapsed, latencies, errors = _run_sessions(lambda: _InProcessClient(app), args)
+    return elapsed, latencies, errors, sampler.stop()
+
+
+def _run_gunicorn(args):
+    from src.backend.benchmarks.bench_workers import _wait_ready
+
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    if args.sqlite:
+        env.update(TASK_STORE_BACKEND='sqlite',
+                   TASK_DB_PATH=os.path.join(tempfile.mkdtemp(prefix='bench-load-'), 'tasks.db'))
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+         '--worker-class', 'gthread', '--bind', f'127.0.0.1:{args.port}', '--log-level', 'warning',
+         'src.backend.app:app'],
+        env=env)
+    try:
+        _wait_ready(args.port)
+        sampler = _Sampler(lambda: [proc.pid] + _children(proc.pid))
+        sampler.start()
+        elapsed, latencies, errors = _run_sessions(lambda: _HttpClient(args.port), args)
+        return elapsed, latencies, errors, sampler.stop()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_report(result: dict, baseline: dict | None):
+    print(f"target={result['scenario']['target']} sessioni={result['scenario']['sessions']} "
+          f"durata={result['durationSeconds']}s richieste={result['requests']} "
+          f"throughput={result['throughputRps']} req/s errori={len(result['errors'])}")
+    server = result['server']
+    print(f"server: RSS max={server['rssMaxBytes'] / 2 ** 20:.1f} MiB fine={server['rssEndBytes'] / 2 ** 20:.1f} MiB "
+          f"thread max={server['threadsMax']} fine={server['threadsEnd']}")
+    print(f"{'operazione':16s} {'n':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}" +
+          ("   (p99 rispetto al confronto)" if baseline else ""))
+    for operation, stats in sorted(result['operations'].items()):
+        line = f"{operation:16s} {stats['count']:>6d} {stats['p50Ms']:>9.2f} {stats['p95Ms']:>9.2f} {stats['p99Ms']:>9.2f}"
+        old = (baseline or {}).get('operations', {}).get(operation)
+        if old and old['p99Ms']:
+            line += f"   {(stats['p99Ms'] - old['p99Ms']) / old['p99Ms'] * 100:+7.1f}%"
+        print(line)
+    if baseline:
+        old_rps = baseline['throughputRps']
+        print(f"throughput rispetto a {baseline.get('commit')}: "
+              f"{(result['throughputRps'] - old_rps) / old_rps * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=("inprocess", "gunicorn"), default="inprocess")
+    parser.add_argument("--sessions", type=int, default=20, help="sessioni concorrenti")
+    parser.add_argument("--messages", type=int, default=5, help="messaggi inviati per sessione")
+    parser.add_argument("--history", type=int, default=50, help="task importate nello storico di ogni sessione")
+    parser.add_argument("--page-size", type=int, default=50, help="task lette a ogni lettura dello storico")
+    parser.add_argument("--attachment-ratio", type=float, default=0.2, help="quota di messaggi con allegato")
+    parser.add_argument("--attachment-kb", type=int, default=64)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--max-wait", type=float, default=30.0, help="attesa massima di done per messaggio")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1, help="solo gunicorn")
+    parser.add_argument("--threads", type=int, default=8, help="solo gunicorn")
+    parser.add_argument("--sqlite", action="store_true", help="solo gunicorn: store SQLite condiviso")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="file JSON dei risultati (default bench-results/load-<commit>-<ora>.json)")
+    parser.add_argument("--compare", help="JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args()
+
+    run = _run_gunicorn if args.target == "gunicorn" else _run_inprocess
+    elapsed, latencies, errors, server = run(args)
+    requests = sum(len(values) for operation, values in latencies.items() if operation != 'time_to_done')
+    commit = _git_commit()
+    result = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'scenario': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'durationSeconds': round(elapsed, 3),
+        'requests': requests,
+        'throughputRps': round(requests / elapsed, 1),
+        'operations': {operation: _summary(values) for operation, values in latencies.items()},
+        'server': server,
+        'errors': errors[:100],
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+    _print_report(result, baseline)
+
+    output = args.output or os.path.join('bench-results', f"load-{commit or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as fh:
+        json.dump(result, fh, indent=2, sort_keys=True)
+    print(f"risultati salvati in {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# BENCHMARK / METRICS
+# Costo della raccolta delle metriche (/metrics): lo stesso carico con
+# METRICS.enabled attivo e disattivo, ripetuto a turno, confrontando la mediana.
+# - store: il mix multi-thread di bench_contention (ogni operazione misura
+#   attesa e possesso del lock della stripe),
+# - http: GET e PUT di una task con il test client (istogramma per route).
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_metrics [--threads 8] [--ops 5000] [--requests 5000] [--rounds 5]
+import argparse
+import statistics
+import time
+import uuid
+
+from src.backend.app import app
+from src.backend.benchmarks.bench_contention import run as run_store
+from src.backend.infrastructure.metrics import METRICS
+
+
+def run_http(requests: int) -> float:
+    client = app.test_client()
+    client.post('/api/newchat')
+    task_id = str(uuid.uuid4())
+    client.post('/api/tasks', json={"uuid": task_id, "msg": "metrics"})
+    start = time.perf_counter()
+    for i in range(requests):
+        if i % 4 == 0:
+            client.put(f'/api/tasks/{task_id}', json={"msg": "metrics"})
+        else:
+            client.get(f'/api/tasks/{task_id}')
+    return requests / (time.perf_counter() - start)
+
+
+def _compare(name: str, workload, rounds: int):
+    results = {True: [], False: []}
+    for index in range(rounds):
+        # A turno e con ordine alternato, così rumore e riscaldamento pesano allo stesso modo
+        for enabled in ((False, True) if index % 2 == 0 else (True, False)):
+            METRICS.enabled = enabled
+            results[enabled].append(workload())
+    METRICS.enabled = True
+    off, on = statistics.median(results[False]), statistics.median(results[True])
+    print(f"{name:6s} senza={off:10.0f}/s  con={on:10.0f}/s  overhead={(off - on) / off * 100:6.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=8, help="sessioni per thread")
+    parser.add_argument("--ops", type=int, default=5000, help="operazioni per thread")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    _compare("store", lambda: run_store(args.threads, 16, args.sessions, args.ops), args.rounds)
+    _compare("http", lambda: run_http(args.requests), args.rounds)
+
+
+if __name__ == '__main__':
+    main()
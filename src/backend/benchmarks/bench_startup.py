@@ -0,0 +1,109 @@
+# BENCHMARK / STARTUP
+# Avvio a freddo dell'app: processi nuovi che importano src.backend.app con
+# python -X importtime. Per ogni albero riporta (mediana su --runs esecuzioni)
+# il tempo del processo, il tempo di import dell'app, la prima richiesta della
+# spec (/apispec_1.json) e gli import diretti più costosi.
+# Con --compare <revisione git> misura anche quella revisione (estratta con
+# git archive in una directory temporanea) per il confronto prima/dopo.
+#
+# Uso (dalla root del repository):
+#   python -m src.backend.benchmarks.bench_startup [--runs 7] [--top 10] [--compare HEAD~1]
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = '''
+import time
+start = time.perf_counter()
+import src.backend.app as module
+imported = time.perf_counter() - start
+client = module.app.test_client()
+start = time.perf_counter()
+client.get('/apispec_1.json')
+print(imported, time.perf_counter() - start)
+'''
+
+
+def _direct_imports(stderr: str) -> dict[str, int]:
+    """
+    Import diretti di src.backend.app {modulo: cumulativo in µs} dalle righe
+    'import time: self | cumulative | nome' (i figli precedono il padre; gli
+    import successivi, es. flasgger alla prima richiesta, non contano).
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == 'src.backend.app':
+            break
+        if (len(name) - len(name.lstrip()) - 1) // 2 == 1:
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure(root: str, runs: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=root)
+    spec_dir = tempfile.mkdtemp(prefix='bench-startup-spec-')
+    try:
+        if os.path.exists(os.path.join(root, 'src', 'backend', 'apidocs.py')):
+            # Come nell'immagine: spec precalcolata al build
+            env['APISPEC_PATH'] = os.path.join(spec_dir, 'apispec.json')
+            subprocess.run([sys.executable, '-m', 'src.backend.apidocs', env['APISPEC_PATH']], cwd=root, env=env,
+                           capture_output=True, check=True)
+        # Un'esecuzione a vuoto: bytecode e cache del filesystem pronti per tutte le misure
+        subprocess.run([sys.executable, '-c', SCRIPT], cwd=root, env=env, capture_output=True, check=True)
+        wall, imported, spec = [], [], []
+        modules: dict[str, list[int]] = {}
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT], cwd=root, env=env,
+                                    capture_output=True, text=True, check=True)
+            wall.append(time.perf_counter() - start)
+            import_seconds, spec_seconds = map(float, result.stdout.split()[-2:])
+            imported.append(import_seconds)
+            spec.append(spec_seconds)
+            for name, cumulative in _direct_imports(result.stderr).items():
+                modules.setdefault(name, []).append(cumulative)
+    finally:
+        shutil.rmtree(spec_dir)
+    return {
+        'wall': statistics.median(wall),
+        'import': statistics.median(imported),
+        'spec': statistics.median(spec),
+        'modules': {name: statistics.median(values) for name, values in modules.items()},
+    }
+
+
+def _print(label: str, result: dict, top: int):
+    print(f"{label}: processo={result['wall'] * 1e3:7.1f} ms  import app={result['import'] * 1e3:7.1f} ms  "
+          f"prima /apispec_1.json={result['spec'] * 1e3:7.1f} ms")
+    for name, cumulative in sorted(result['modules'].items(), key=lambda item: -item[1])[:top]:
+        print(f"    {cumulative / 1e3:7.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--compare", help="revisione git da misurare come 'prima'")
+    args = parser.parse_args()
+
+    if args.compare:
+        before = tempfile.mkdtemp(prefix='bench-startup-')
+        try:
+            archive = subprocess.run(['git', 'archive', args.compare], capture_output=True, check=True).stdout
+            subprocess.run(['tar', '-x', '-C', before], input=archive, check=True)
+            _print(f"prima ({args.compare})", measure(before, args.runs), args.top)
+        finally:
+            shutil.rmtree(before)
+    _print("albero corrente", measure(os.getcwd(), args.runs), args.top)
+
+
+if __name__ == '__main__':
+    main()
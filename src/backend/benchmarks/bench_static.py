@@ -0,0 +1,86 @@
+# BENCHMARK / STATIC
+# Statici del frontend: il vecchio handler (os.path.exists + send_from_directory
+# a ogni richiesta, senza compressione né cache) contro il manifest di
+# StaticAssets con varianti precompresse. Su un build finto (un bundle JS con
+# hash nel nome e index.html) misura richieste al secondo e byte inviati per:
+# primo download (Accept-Encoding: gzip, br) e revalidazione con If-None-Match.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_static [--requests 5000] [--bundle-kb 500]
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from flask import send_from_directory
+
+import src.backend.app as app_module
+from src.backend.infrastructure.static_assets import StaticAssets, precompress
+
+BUNDLE = 'assets/index-Bench_01.js'
+
+
+def _build(directory: str, bundle_kb: int):
+    os.makedirs(os.path.join(directory, 'assets'))
+    rng = random.Random(1)
+    lines, size = [], 0
+    while size < bundle_kb * 1024:
+        line = f'function f{len(lines)}(a){{return a*{rng.randint(0, 10 ** 6)}+"{rng.random()}"}}\n'
+        lines.append(line)
+        size += len(line)
+    with open(os.path.join(directory, BUNDLE), 'w') as fh:
+        fh.write(''.join(lines))
+    with open(os.path.join(directory, 'index.html'), 'w') as fh:
+        fh.write(f'<!doctype html><html><head><script type="module" src="/{BUNDLE}"></script></head></html>')
+    precompress(directory)
+
+
+def _legacy_view(directory: str):
+    # Handler precedente a StaticAssets (stessi hook dell'app, cambia solo la view)
+    def serve_static_assets(path):
+        if path != "" and os.path.exists(os.path.join(directory, path)):
+            return send_from_directory(directory, path)
+        return send_from_directory(directory, 'index.html')
+
+    return serve_static_assets
+
+
+def _measure(client, requests: int, headers: dict) -> tuple[float, float, int]:
+    sent = 0
+    status = None
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get('/' + BUNDLE, headers=headers)
+        sent += len(response.get_data())
+        status = response.status_code
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, sent / requests, status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--bundle-kb", type=int, default=500)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-static-')
+    try:
+        _build(directory, args.bundle_kb)
+        app_module.STATIC_ASSETS = StaticAssets(directory)
+        accept = {'Accept-Encoding': 'gzip, deflate, br'}
+        views = {'legacy': _legacy_view(directory), 'manifest': app_module.serve_static_assets}
+        client = app_module.app.test_client()
+        for name, view in views.items():
+            app_module.app.view_functions['serve_static_assets'] = view
+            etag = client.get('/' + BUNDLE, headers=accept).headers['ETag']
+            for label, headers in (('download', accept), ('revalida', dict(accept, **{'If-None-Match': etag}))):
+                rate, size, status = _measure(client, args.requests, headers)
+                print(f"{name:9s} {label:9s} {rate:9.0f} req/s  {size / 1024:8.1f} KiB/risposta  status={status}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
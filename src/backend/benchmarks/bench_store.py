@@ -0,0 +1,60 @@
+# BENCHMARK / STORE
+# Microbenchmark delle operazioni puntuali di InMemoryTaskRepository al crescere
+# della lunghezza della sessione: con l'indice per uuid la curva resta piatta.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_store [--sizes 10,100,1000,10000] [--ops 2000]
+import argparse
+import random
+import time
+import uuid
+
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore
+
+
+def _fill(repo: InMemoryTaskRepository, size: int) -> list[str]:
+    ids = [str(uuid.uuid4()) for _ in range(size)]
+    for task_id in ids:
+        repo.create({"uuid": task_id, "msg": "benchmark"})
+    return ids
+
+
+def _per_op_us(fn, args: list) -> float:
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def run(sizes: list[int], ops: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        repo = InMemoryTaskRepository(client_id="bench", store=InMemoryTaskStore())
+        ids = _fill(repo, size)
+        sample = [random.choice(ids) for _ in range(ops)]
+        row = {
+            "size": size,
+            "get_by_id_us": _per_op_us(repo.get_by_id, sample),
+            "update_us": _per_op_us(lambda t: repo.update(t, {"done": True}), sample),
+        }
+        # delete consuma gli id: campione senza ripetizioni
+        victims = random.sample(ids, min(ops, size))
+        row["delete_us"] = _per_op_us(repo.delete, victims)
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    print(f"{'size':>8} {'get_by_id':>12} {'update':>12} {'delete':>12}  (us/op)")
+    for row in run(sizes, args.ops):
+        print(f"{row['size']:>8} {row['get_by_id_us']:>12.2f} {row['update_us']:>12.2f} {row['delete_us']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# BENCHMARK / TASK MODEL
+# Memoria per task (tracemalloc) e latenza di GET /api/tasks su sessioni da 10k
+# task: serializzazione completa con jsonify rispetto ai frammenti JSON in cache.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_task_model [--tasks 10000] [--rounds 50]
+import argparse
+import time
+import tracemalloc
+import uuid
+
+from flask import jsonify
+
+from src.backend.app import app
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore
+
+
+def _fill(repo: InMemoryTaskRepository, tasks: int):
+    for i in range(tasks):
+        task_id = str(uuid.uuid4())
+        repo.create({"uuid": task_id, "msg": f"question number {i} about the attached document"})
+        repo.update(task_id, {"done": True, "msgresponse": f" response {i}"})
+
+
+def _per_call_ms(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    store = InMemoryTaskStore()
+    repo = InMemoryTaskRepository(client_id="bench", store=store)
+    before = tracemalloc.get_traced_memory()[0]
+    _fill(repo, args.tasks)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"memoria: {(after - before) / args.tasks:.0f} byte/task (testi e indice inclusi)")
+
+    with app.app_context():
+        dicts_ms = _per_call_ms(lambda: jsonify(repo.get_all()).get_data(), args.rounds)
+        cached_ms = _per_call_ms(
+            lambda: app.response_class(repo.get_all_json(), mimetype='application/json').get_data(), args.rounds)
+    print(f"get_all con {args.tasks} task: jsonify {dicts_ms:.2f}ms, frammenti in cache {cached_ms:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# BENCHMARK / UPLOAD
+# Picco di memoria Python (tracemalloc) durante create_task per lo stesso file
+# inviato come JSON base64 e come multipart/form-data in streaming.
+#
+# Uso:
+#   python -m src.backend.benchmarks.bench_upload [--size-mb 20]
+import argparse
+import base64
+import io
+import json
+import os
+import tracemalloc
+import uuid
+
+from src.backend.app import app
+
+
+def _peak_mb(fn) -> float:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=20)
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    structures = [{"filename": "bench.pdf", "contentType": "application/pdf"}]
+    client = app.test_client()
+
+    json_body = json.dumps({
+        "uuid": str(uuid.uuid4()),
+        "msg": "bench",
+        "fileStructures": structures,
+        "blobs": ["data:application/pdf;base64," + base64.b64encode(payload).decode()],
+    })
+
+    def send_json():
+        r = client.post('/api/tasks', data=json_body, content_type='application/json')
+        assert r.status_code == 201, r.get_json()
+
+    def send_multipart():
+        r = client.post('/api/tasks', content_type='multipart/form-data', data={
+            "uuid": str(uuid.uuid4()),
+            "msg": "bench",
+            "fileStructures": json.dumps(structures),
+            "files": (io.BytesIO(payload), "bench.pdf", "application/pdf"),
+        })
+        assert r.status_code == 201, r.get_json()
+
+    # Il corpo JSON è già costruito: si misura solo l'elaborazione lato server
+    print(f"file={args.size_mb:.1f}MB")
+    print(f"json      peak={_peak_mb(send_json):8.1f}MB")
+    print(f"multipart peak={_peak_mb(send_multipart):8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# BENCHMARK / WORKERS
+# Avvia gunicorn con store SQLite condiviso e confronta il throughput HTTP con
+# 1 e N worker. Ogni client simula una sessione: crea task e legge lo storico.
+#
+# Uso (dalla root del repository):
+#   python -m src.backend.benchmarks.bench_workers [--workers 1,4] [--clients 16] [--seconds 10]
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+
+def _wait_ready(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/me')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn non risponde")
+
+
+def _client(port: int, stop_at: float, counter: list):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    cookie = None
+    done = 0
+    while time.monotonic() < stop_at:
+        headers = {'Content-Type': 'application/json'}
+        if cookie:
+            headers['Cookie'] = cookie
+        body = json.dumps({'uuid': str(uuid.uuid4()), 'msg': 'bench'})
+        conn.request('POST', '/api/tasks', body=body, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        cookie = cookie or (resp.getheader('Set-Cookie') or '').split(';')[0]
+        conn.request('GET', '/api/tasks', headers={'Cookie': cookie})
+        conn.getresponse().read()
+        done += 2
+    counter.append(done)
+
+
+def run(workers: int, threads: int, clients: int, seconds: float, port: int) -> float:
+    db_dir = tempfile.mkdtemp(prefix='bench-workers-')
+    env = dict(os.environ, TASK_STORE_BACKEND='sqlite', TASK_DB_PATH=os.path.join(db_dir, 'tasks.db'),
+               PYTHONPATH=os.getcwd())
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+         '--worker-class', 'gthread', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+         'src.backend.app:app'],
+        env=env)
+    try:
+        _wait_ready(port)
+        counter: list[int] = []
+        stop_at = time.monotonic() + seconds
+        pool = [threading.Thread(target=_client, args=(port, stop_at, counter)) for _ in range(clients)]
+        start = time.monotonic()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        return sum(counter) / (time.monotonic() - start)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 2}")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for workers in (int(w) for w in args.workers.split(",")):
+        rps = run(workers, args.threads, args.clients, args.seconds, args.port)
+        print(f"workers={workers:>3} threads={args.threads} clients={args.clients}  {rps:8.0f} req/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,44 @@
 # CORE / DOMAIN LAYER
 # Definisce la logica di business e i modelli di dati indipendenti
 # da qualsiasi dettaglio tecnologico esterno.
+import json
+
+# Campi pubblici di una task, nell'ordine di to_dict (usati anche per la proiezione fields=)
+TASK_FIELDS = ('uuid', 'msg', 'done', 'msgresponse')
+
 
 class Task:
-    def __init__(self, uuid, msg, msgresponse, done=False,  file_structures=None, blobs=None):
+    # __slots__: niente __dict__ per istanza, le sessioni lunghe occupano molta meno memoria
+    __slots__ = ('uuid', 'msg', 'done', 'msgresponse', 'file_structures', 'blobs', 'payload_hash', '_json')
+
+    def __init__(self, uuid, msg, msgresponse, done=False,  file_structures=None, blobs=None, payload_hash=None):
         self.uuid = uuid
         self.msg = msg
         self.done = done
         self.msgresponse= msgresponse
-        # fields for attachments
+        # fields for attachments: blobs holds references into the blob store
+        # (content-addressed), not the base64 content itself
         self.file_structures = file_structures or []
         self.blobs = blobs or []
+        # impronta del contenuto di creazione, per riconoscere le create ripetute
+        self.payload_hash = payload_hash
 
-    def to_dict(self):
+    def __setattr__(self, name, value):
+        # Ogni modifica invalida la forma JSON in cache
+        object.__setattr__(self, name, value)
+        if name != '_json':
+            object.__setattr__(self, '_json', None)
+
+    def to_dict(self, fields=None):
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
         return {'uuid': self.uuid,  'msg': self.msg, 'done': self.done, 'msgresponse': self.msgresponse}
 
+    def to_json(self) -> bytes:
+        """Forma JSON di to_dict(), calcolata alla prima richiesta e riusata fino alla prossima modifica."""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), separators=(',', ':'), sort_keys=True).encode('utf-8')
+        return self._json
+
     def to_dict_with_attachments(self):
-        return {**self.to_dict(), 'fileStructures': self.file_structures, 'blobs': self.blobs}
\ No newline at end of file
+        return {**self.to_dict(), 'fileStructures': self.file_structures, 'blobs': self.blobs}
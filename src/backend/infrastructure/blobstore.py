@@ -0,0 +1,244 @@
+# INFRASTRUCTURE / BLOB STORE
+# Archivio content-addressed degli allegati: ogni file viene decodificato una
+# sola volta, indicizzato per SHA-256 e conservato in un'unica copia con
+# reference counting. Oltre il budget di memoria i contenuti finiscono su disco.
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+
+
+class BlobRef:
+    """
+    Riferimento a un allegato nel blob store, è ciò che il Task conserva.
+    - digest: SHA-256 esadecimale del contenuto,
+    - size: dimensione in byte del contenuto decodificato,
+    - header: prefisso data URL originale (es. "data:application/pdf;base64,"),
+      per restituire al client la stessa stringa ricevuta.
+    """
+    __slots__ = ('digest', 'size', 'header')
+
+    def __init__(self, digest: str, size: int, header: str = ''):
+        self.digest = digest
+        self.size = size
+        self.header = header
+
+
+class BlobTooLarge(ValueError):
+    """Il contenuto in scrittura supera la dimensione massima consentita."""
+
+
+class BlobWriter:
+    """
+    Scrittura incrementale di un allegato (upload in streaming):
+    ogni chunk aggiorna lo SHA-256 e finisce subito in un file temporaneo,
+    quindi in memoria non resta mai più di un chunk.
+    Va chiusa con commit() (ritorna il BlobRef) oppure abort().
+    """
+    def __init__(self, store: 'InMemoryBlobStore', header: str = '', max_size: int | None = None):
+        self._store = store
+        self._header = header
+        self._max_size = max_size
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self._tmp_path = os.path.join(store._ensure_spill_dir(), f"{uuid.uuid4().hex}.tmp")
+        self._fh = open(self._tmp_path, 'wb')
+
+    def write(self, chunk: bytes):
+        self._size += len(chunk)
+        if self._max_size is not None and self._size > self._max_size:
+            self.abort()
+            raise BlobTooLarge(f"Allegato oltre il limite di {self._max_size} byte")
+        self._hash.update(chunk)
+        self._fh.write(chunk)
+
+    def commit(self) -> BlobRef:
+        self._fh.close()
+        digest = self._hash.hexdigest()
+        self._store._publish_file(self._tmp_path, digest, self._size, promote=True)
+        return BlobRef(digest, self._size, self._header)
+
+    def abort(self):
+        if not self._fh.closed:
+            self._fh.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class _BlobEntry:
+    __slots__ = ('data', 'path', 'size', 'refs')
+
+    def __init__(self, size: int, data: bytes | None = None, path: str | None = None):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.refs = 1
+
+
+class InMemoryBlobStore:
+    """
+    Store condiviso thread-safe per i contenuti degli allegati.
+    - put/put_encoded incrementano il refcount, release lo decrementa:
+      a zero il contenuto (in memoria o su disco) viene liberato.
+    - memory_budget: byte massimi tenuti in memoria, il resto va in spill_dir.
+    """
+    DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, spill_dir: str | None = None):
+        self._lock = threading.Lock()
+        self._entries: dict[str, _BlobEntry] = {}
+        self._memory_budget = memory_budget
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._spill_dir = spill_dir
+
+    @staticmethod
+    def _split_data_url(blob: str) -> tuple[str, str]:
+        if blob.startswith('data:') and ',' in blob:
+            idx = blob.index(',') + 1
+            return blob[:idx], blob[idx:]
+        return '', blob
+
+    def put_encoded(self, blob: str) -> BlobRef:
+        """
+        Decodifica un allegato base64 (anche in forma data URL) e lo archivia.
+        Solleva ValueError se il contenuto non è base64 valido.
+        """
+        if not isinstance(blob, str):
+            raise ValueError("Il blob deve essere una stringa base64")
+        header, payload = self._split_data_url(blob)
+        data = base64.b64decode(payload, validate=True)
+        return BlobRef(self.put(data), len(data), header)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry.refs += 1
+                return digest
+            if self._memory_bytes + len(data) <= self._memory_budget:
+                self._entries[digest] = _BlobEntry(len(data), data=data)
+                self._memory_bytes += len(data)
+                return digest
+        # Spill su disco fuori dal lock: si scrive un file temporaneo e lo si
+        # pubblica con una rename atomica solo se nessuno ci ha preceduto.
+        tmp_path = os.path.join(self._ensure_spill_dir(), f"{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        self._publish_file(tmp_path, digest, len(data))
+        return digest
+
+    def writer(self, header: str = '', max_size: int | None = None) -> BlobWriter:
+        """Apre una scrittura in streaming, vedi BlobWriter."""
+        return BlobWriter(self, header, max_size)
+
+    def _publish_file(self, tmp_path: str, digest: str, size: int, promote: bool = False):
+        """
+        Registra un contenuto già scritto in tmp_path. Se il digest esiste già
+        incrementa il refcount e scarta il file; con promote=True il contenuto
+        viene portato in memoria quando rientra nel budget.
+        La lettura del file e la sua rimozione avvengono fuori dal lock.
+        """
+        data = None
+        if promote:
+            with self._lock:
+                fits = digest not in self._entries and self._memory_bytes + size <= self._memory_budget
+            if fits:
+                with open(tmp_path, 'rb') as fh:
+                    data = fh.read()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry.refs += 1
+            elif data is not None and self._memory_bytes + size <= self._memory_budget:
+                self._entries[digest] = _BlobEntry(size, data=data)
+                self._memory_bytes += size
+            else:
+                # Rename atomica nella stessa directory: la voce e il file compaiono insieme
+                path = os.path.join(self._spill_dir, digest)
+                os.replace(tmp_path, path)
+                self._entries[digest] = _BlobEntry(size, path=path)
+                self._disk_bytes += size
+                return
+        os.remove(tmp_path)
+
+    def get(self, digest: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry.data is not None:
+                return entry.data
+            path = entry.path
+        try:
+            with open(path, 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            # Rilasciato nel frattempo
+            return None
+
+    def source(self, digest: str) -> bytes | str | None:
+        """
+        Sorgente del contenuto per lo streaming: i byte se residente in memoria,
+        altrimenti il path su disco (servibile zero-copy con wsgi.file_wrapper).
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            return entry.data if entry.data is not None else entry.path
+
+    def encode(self, ref: BlobRef) -> str | None:
+        """Ricostruisce la stringa base64 (con l'header data URL originale)."""
+        data = self.get(ref.digest)
+        if data is None:
+            return None
+        return ref.header + base64.b64encode(data).decode('ascii')
+
+    def release(self, digest: str):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._entries[digest]
+            if entry.data is not None:
+                self._memory_bytes -= entry.size
+                return
+            self._disk_bytes -= entry.size
+            # Rimozione sotto lock: un put concorrente dello stesso contenuto
+            # potrebbe ripubblicare lo stesso path
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blobs": len(self._entries),
+                "memoryBytes": self._memory_bytes,
+                "diskBytes": self._disk_bytes,
+            }
+
+    def _ensure_spill_dir(self) -> str:
+        with self._lock:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix='chatbot-blobs-')
+            else:
+                os.makedirs(self._spill_dir, exist_ok=True)
+            return self._spill_dir
+
+
+# Istanza singleton del blob store condiviso nel processo
+BLOB_STORE = InMemoryBlobStore(
+    memory_budget=int(os.environ.get("BLOB_MEMORY_BUDGET", InMemoryBlobStore.DEFAULT_MEMORY_BUDGET)),
+    spill_dir=os.environ.get("BLOB_SPILL_DIR") or None,
+)
@@ -0,0 +1,220 @@
+# INFRASTRUCTURE / JOURNAL
+# Persistenza opzionale dello store in memoria: write-ahead log append-only
+# delle operazioni (put/del) con group commit in background, snapshot
+# periodici compatti e recovery "ultimo snapshot + coda del log".
+#
+# Layout della directory:
+#   log-<seq>.jsonl       segmenti del log, una riga JSON per operazione
+#   snapshot-<seq>.jsonl  stato completo; la replay riparte dal segmento <seq>
+#   blobs/<digest>        contenuti degli allegati (content-addressed)
+#
+# I record put contengono lo stato completo della task, quindi la replay è
+# idempotente: un'operazione presente sia nello snapshot sia nel log non fa danni.
+# Lo snapshot ha una riga per client con tutte le sue task in forma posizionale:
+# pochi json.loads su array invece di uno per task, per una recovery veloce.
+import json
+import os
+import re
+import threading
+import time
+
+from src.backend.core.model import Task
+from src.backend.infrastructure.blobstore import BlobRef
+
+_SEGMENT_RE = re.compile(r'^(log|snapshot)-(\d+)\.jsonl$')
+
+
+def task_record(task: Task) -> list:
+    """Forma compatta (posizionale) della task usata nel log e negli snapshot."""
+    return [task.uuid, task.msg, task.done, task.msgresponse, task.file_structures,
+            [[ref.digest, ref.size, ref.header] for ref in task.blobs], task.payload_hash]
+
+
+def task_from_record(record: list) -> Task:
+    # I record scritti prima delle create idempotenti non hanno payload_hash
+    uuid, msg, done, msgresponse, file_structures, blobs, *rest = record
+    if blobs:
+        blobs = [BlobRef(digest, size, header) for digest, size, header in blobs]
+    return Task(uuid, msg, msgresponse, done, file_structures, blobs, rest[0] if rest else None)
+
+
+class TaskJournal:
+    """
+    Write-ahead log con group commit:
+    - append() accoda la riga in memoria (costo sub-millisecondo),
+    - un thread dedicato scrive e fa fsync del batch ogni flush_interval secondi,
+    - rotate() chiude il segmento corrente, usato da InMemoryTaskStore.snapshot.
+    Un crash può perdere al massimo le operazioni dell'ultimo flush_interval.
+    """
+    def __init__(self, directory: str, flush_interval: float = 0.05):
+        self._dir = directory
+        self._blob_dir = os.path.join(directory, 'blobs')
+        os.makedirs(self._blob_dir, exist_ok=True)
+        self._flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._buffer: list[str] = []
+        self._pending_fsync: list[str] = []
+        self._io_lock = threading.Lock()
+        # Non si riapre mai un segmento esistente (potrebbe essere troncato)
+        self._seq = max((seq for _, seq in self._files()), default=0) + 1
+        self._fh = open(self._segment_path('log', self._seq), 'a', encoding='utf-8')
+        self.records_since_snapshot = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='task-journal', daemon=True)
+        self._thread.start()
+
+    def _files(self) -> list[tuple[str, int]]:
+        found = []
+        for name in os.listdir(self._dir):
+            match = _SEGMENT_RE.match(name)
+            if match:
+                found.append((match.group(1), int(match.group(2))))
+        return found
+
+    def _segment_path(self, kind: str, seq: int) -> str:
+        return os.path.join(self._dir, f'{kind}-{seq:08d}.jsonl')
+
+    # Scrittura
+
+    def append(self, record: dict):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._cond:
+            self._buffer.append(line)
+            self.records_since_snapshot += 1
+            self._cond.notify()
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(os.path.join(self._blob_dir, digest))
+
+    def save_blob(self, digest: str, data: bytes):
+        path = os.path.join(self._blob_dir, digest)
+        if os.path.exists(path):
+            return
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+        # L'fsync del file avviene nel prossimo group commit
+        with self._cond:
+            self._pending_fsync.append(path)
+
+    def read_blob(self, digest: str) -> bytes | None:
+        try:
+            with open(os.path.join(self._blob_dir, digest), 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._pending_fsync and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._buffer and not self._pending_fsync:
+                    return
+            # Attesa breve per raccogliere più operazioni nello stesso fsync
+            time.sleep(self._flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._io_lock:
+            with self._cond:
+                lines, self._buffer = self._buffer, []
+                paths, self._pending_fsync = self._pending_fsync, []
+            for path in paths:
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+            if lines:
+                self._fh.write('\n'.join(lines) + '\n')
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+
+    def rotate(self) -> int:
+        """Chiude il segmento corrente e ne apre uno nuovo; ritorna il suo seq."""
+        with self._io_lock:
+            with self._cond:
+                lines, self._buffer = self._buffer, []
+                self.records_since_snapshot = 0
+            if lines:
+                self._fh.write('\n'.join(lines) + '\n')
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._seq += 1
+            self._fh = open(self._segment_path('log', self._seq), 'a', encoding='utf-8')
+            return self._seq
+
+    def write_snapshot(self, seq: int, records):
+        """
+        Scrive lo snapshot (righe {"c": client_id, "t": [task_record, ...]}) in
+        modo atomico e rimuove snapshot e segmenti precedenti a seq.
+        """
+        path = self._segment_path('snapshot', seq)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            for record in records:
+                fh.write(json.dumps(record, separators=(',', ':')) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+        for kind, old_seq in self._files():
+            if old_seq < seq:
+                os.remove(self._segment_path(kind, old_seq))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    # Recovery
+
+    def load(self) -> dict[str, dict[str, dict]]:
+        """
+        Ricostruisce lo stato {client_id: {uuid: task_record}} dall'ultimo
+        snapshot completo e dai segmenti di log successivi, in ordine.
+        """
+        files = self._files()
+        snapshots = sorted(seq for kind, seq in files if kind == 'snapshot')
+        start = snapshots[-1] if snapshots else 0
+        state: dict[str, dict[str, dict]] = {}
+        if snapshots:
+            for record in self._read_lines(self._segment_path('snapshot', start)):
+                tasks = state.setdefault(record['c'], {})
+                for task in record['t']:
+                    tasks[task[0]] = task
+        for seq in sorted(seq for kind, seq in files if kind == 'log' and start <= seq < self._seq):
+            for record in self._read_lines(self._segment_path('log', seq)):
+                tasks = state.setdefault(record['c'], {})
+                if record['op'] == 'put':
+                    tasks[record['t'][0]] = record['t']
+                elif record['op'] == 'del':
+                    tasks.pop(record['u'], None)
+                elif record['op'] == 'evict':
+                    state.pop(record['c'], None)
+        return state
+
+    @staticmethod
+    def _read_lines(path: str):
+        with open(path, encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Ultima riga troncata da un crash durante la scrittura
+                    return
+
+    def collect_blobs(self, referenced: set[str]):
+        """Rimuove i contenuti non più referenziati (da chiamare dopo la recovery)."""
+        for name in os.listdir(self._blob_dir):
+            if name not in referenced:
+                try:
+                    os.remove(os.path.join(self._blob_dir, name))
+                except OSError:
+                    pass
@@ -0,0 +1,180 @@
+# INFRASTRUCTURE / METRICS
+# Metriche di processo in formato testo Prometheus (esposte da /metrics):
+# istogrammi con bucket fissi allocati alla prima osservazione di ogni
+# combinazione di label e gauge calcolati solo al momento dello scrape.
+# Nessuna dipendenza esterna: un'osservazione costa una bisect e un lock
+# non conteso, senza allocazioni.
+#
+# Con più worker gunicorn ogni processo ha le proprie metriche (come per /api/stats).
+import os
+import threading
+from bisect import bisect_left
+
+# METRICS_ENABLED=0 disattiva la raccolta (le osservazioni diventano no-op)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# Bucket predefiniti (secondi)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOCK_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+
+class _HistogramChild:
+    """Contatori di una combinazione di label: uno per bucket più +Inf, somma e conteggio."""
+    __slots__ = ('lock', 'counts', 'sum')
+
+    def __init__(self, size: int):
+        self.lock = threading.Lock()
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class HistogramShard:
+    """
+    Contatori di un istogramma senza label aggiornati senza lock: chi osserva
+    deve già essere serializzato (es. sotto il lock di una stripe dello store).
+    Il registro somma gli shard allo scrape.
+    """
+    __slots__ = ('_histogram', 'counts', 'sum')
+
+    def __init__(self, histogram: 'Histogram'):
+        self._histogram = histogram
+        self.counts = [0] * (len(histogram.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self._histogram.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    """
+    Istogramma cumulativo alla Prometheus.
+    - observe(value, *labels): labels nello stesso ordine di labelnames,
+    - i bucket sono fissi, i contatori vengono creati una volta per combinazione di label,
+    - shard(): contatori separati per chi osserva già sotto un proprio lock.
+    """
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, buckets,
+                 labelnames: tuple = ()):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, _HistogramChild] = {}
+        self._children_lock = threading.Lock()
+        self._shards: list[HistogramShard] = []
+
+    def shard(self) -> HistogramShard:
+        shard = HistogramShard(self)
+        with self._children_lock:
+            self._shards.append(shard)
+        return shard
+
+    def _child(self, labels: tuple) -> _HistogramChild:
+        child = self._children.get(labels)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(labels)
+                if child is None:
+                    child = self._children[labels] = _HistogramChild(len(self.buckets) + 1)
+        return child
+
+    def observe(self, value: float, *labels):
+        if not self._registry.enabled:
+            return
+        child = self._child(labels)
+        index = bisect_left(self.buckets, value)
+        with child.lock:
+            child.counts[index] += 1
+            child.sum += value
+
+    def collect(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._children_lock:
+            children = sorted(self._children.items())
+            shards = list(self._shards)
+        samples = []
+        for labels, child in children:
+            with child.lock:
+                samples.append((labels, list(child.counts), child.sum))
+        if shards:
+            # Lettura senza lock degli shard: al più un'osservazione in corso non ancora contata
+            counts = [sum(values) for values in zip(*(shard.counts for shard in shards))]
+            samples.append(((), counts, sum(shard.sum for shard in shards)))
+        for labels, counts, total in samples:
+            base = _format_labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{le}"}} {cumulative}')
+            suffix = f'{{{base}}}' if base else ''
+            lines.append(f'{self.name}_sum{suffix} {total!r}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """
+    Gauge calcolato allo scrape da function: ritorna un numero oppure, con
+    labelnames, un dict {tupla di label: valore}. Un errore salta il gauge.
+    """
+    def __init__(self, name: str, documentation: str, function, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> list[str]:
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        values = value if self.labelnames else {(): value}
+        for labels, sample in sorted(values.items()):
+            base = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}{{{base}}} {sample}' if base else f'{self.name} {sample}')
+        return lines
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """Insieme delle metriche del processo; render() produce il testo per /metrics."""
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: dict[str, Histogram | Gauge] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metrica già registrata: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, documentation: str, buckets=LATENCY_BUCKETS, labelnames: tuple = ()) -> Histogram:
+        return self._register(Histogram(self, name, documentation, buckets, labelnames))
+
+    def gauge(self, name: str, documentation: str, function, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, function, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# Registro condiviso del processo
+METRICS = MetricsRegistry(enabled=METRICS_ENABLED)
+
@@ -0,0 +1,190 @@
+# INFRASTRUCTURE / PROFILER
+# Profiling su richiesta di singole richieste HTTP, attivabile senza redeploy:
+# - header X-Profile con il token PROFILE_TOKEN per una richiesta,
+# - toggle amministrativo che campiona una quota delle richieste (rate).
+# Senza PROFILE_TOKEN né l'header né il toggle sono accettati: resta solo la
+# quota iniziale PROFILE_SAMPLE_RATE decisa da chi configura il processo.
+# Per ogni richiesta profilata vengono scritti in PROFILE_DIR:
+#   <id>.collapsed   stack campionati in formato collapsed (flamegraph.pl, speedscope)
+#   <id>.tracemalloc snapshot tracemalloc delle allocazioni fatte durante la richiesta
+#   <id>.alloc.txt   le righe che allocano di più, per una lettura veloce
+# Si conservano solo gli ultimi PROFILE_MAX_KEPT profili (i più vecchi vengono cancellati).
+# Senza PROFILE_DIR il profiler non esiste e l'app non registra alcun hook.
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or None
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+# Quota delle richieste profilate con il toggle attivo (anche il valore iniziale del toggle)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# Intervallo di campionamento dello stack (secondi)
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.002))
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", 10))
+# Profili conservati in PROFILE_DIR
+PROFILE_MAX_KEPT = int(os.environ.get("PROFILE_MAX_KEPT", 50))
+# Estensioni dei file di un profilo (il primo identifica il profilo)
+PROFILE_SUFFIXES = ('.alloc.txt', '.collapsed', '.tracemalloc')
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class _Sampler(threading.Thread):
+    """Campiona lo stack di un thread ogni interval secondi finché non viene fermato."""
+    def __init__(self, target_ident: int, interval: float):
+        super().__init__(name='request-profiler', daemon=True)
+        self._target = target_ident
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._labels: dict = {}
+        self.stacks: dict[tuple, int] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+        return label
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                key = tuple(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self) -> dict[tuple, int]:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def _short_path(path: str) -> str:
+    # Path relativi alla root del progetto o al nome del pacchetto installato
+    for marker in ('/src/', '/site-packages/', '/lib/python'):
+        index = path.rfind(marker)
+        if index != -1:
+            return path[index + 1:]
+    return os.path.basename(path)
+
+
+class RequestProfile:
+    """Profilo di una richiesta in corso (campionamento dello stack + tracemalloc)."""
+    def __init__(self, profile_id: str, sampler: _Sampler):
+        self.id = profile_id
+        self.sampler = sampler
+        self.started = time.perf_counter()
+
+
+class RequestProfiler:
+    """
+    Profiler delle richieste:
+    - select(header) decide se profilare la richiesta (header valido oppure
+      toggle attivo e campione estratto) e ritorna False quando è già in corso
+      un altro profilo: al massimo max_concurrent alla volta,
+    - start(label) / finish(profile) avvolgono la richiesta nel thread che la serve;
+      finish cancella i profili più vecchi oltre max_kept.
+    Senza token l'header e il toggle amministrativo sono sempre rifiutati.
+    """
+    def __init__(self, directory: str, token: str | None = None, rate: float = 0.0,
+                 interval: float = 0.002, tracemalloc_frames: int = 10, max_concurrent: int = 1,
+                 max_kept: int = 50):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.token = token
+        self.rate = rate
+        self.interval = interval
+        self.tracemalloc_frames = tracemalloc_frames
+        self.max_kept = max_kept
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._tracing = 0
+        # tracemalloc avviato da noi (non da chi lo usava già nel processo)
+        self._owns_tracing = False
+        self.profiled = 0
+
+    def authorized(self, token: str | None) -> bool:
+        """Token per il toggle amministrativo e l'header (senza PROFILE_TOKEN nessuno è autorizzato)."""
+        return self.token is not None and token == self.token
+
+    def select(self, header: str | None) -> bool:
+        if header is not None:
+            wanted = self.authorized(header)
+        else:
+            wanted = self.rate > 0 and random.random() < self.rate
+        return wanted and self._slots.acquire(blocking=False)
+
+    def start(self, label: str) -> RequestProfile:
+        """Da chiamare dopo select() == True, nel thread della richiesta."""
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.tracemalloc_frames)
+                self._owns_tracing = True
+            self._tracing += 1
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{_UNSAFE_CHARS.sub('_', label).strip('_')}-{uuid.uuid4().hex[:8]}"
+        sampler = _Sampler(threading.get_ident(), self.interval)
+        sampler.start()
+        return RequestProfile(profile_id, sampler)
+
+    def finish(self, profile: RequestProfile) -> str:
+        """Ferma il profilo, scrive i file e ritorna l'id (prefisso dei file in directory)."""
+        try:
+            stacks = profile.sampler.stop()
+            elapsed = time.perf_counter() - profile.started
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ))
+        finally:
+            with self._lock:
+                self._tracing -= 1
+                if self._tracing == 0 and self._owns_tracing:
+                    tracemalloc.stop()
+                    self._owns_tracing = False
+            self._slots.release()
+        base = os.path.join(self.directory, profile.id)
+        with open(base + '.collapsed', 'w', encoding='utf-8') as fh:
+            for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                fh.write(';'.join(stack) + f' {count}\n')
+        snapshot.dump(base + '.tracemalloc')
+        with open(base + '.alloc.txt', 'w', encoding='utf-8') as fh:
+            fh.write(f'# {profile.id}: {elapsed * 1e3:.1f} ms, {sum(stacks.values())} campioni\n')
+            for stat in snapshot.statistics('lineno')[:25]:
+                fh.write(f'{stat}\n')
+        self.profiled += 1
+        self._prune()
+        return profile.id
+
+    def _prune(self):
+        """Cancella i profili più vecchi (per data di scrittura) oltre max_kept."""
+        with self._lock:
+            try:
+                with os.scandir(self.directory) as entries:
+                    profiles = [(entry.stat().st_mtime, entry.name[:-len(PROFILE_SUFFIXES[0])])
+                                for entry in entries if entry.name.endswith(PROFILE_SUFFIXES[0])]
+            except OSError:
+                return
+            profiles.sort()
+            for _, profile_id in profiles[:max(0, len(profiles) - self.max_kept)]:
+                for suffix in PROFILE_SUFFIXES:
+                    try:
+                        os.remove(os.path.join(self.directory, profile_id + suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "profiled": self.profiled, "directory": self.directory, "maxKept": self.max_kept}
+
+
+# Profiler del processo, solo se PROFILE_DIR è impostata
+PROFILER = RequestProfiler(PROFILE_DIR, token=PROFILE_TOKEN, rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL,
+                           tracemalloc_frames=PROFILE_TRACEMALLOC_FRAMES,
+                           max_kept=PROFILE_MAX_KEPT) if PROFILE_DIR else None
@@ -1,21 +1,40 @@
 from src.backend.core.model import Task
+from src.backend.infrastructure.blobstore import BLOB_STORE, BlobRef, InMemoryBlobStore
+from src.backend.infrastructure.journal import TaskJournal, task_from_record, task_record
+from src.backend.infrastructure.metrics import LOCK_BUCKETS, METRICS
+from collections import OrderedDict
+import hashlib
+import json
 import threading
+import time
 
 # INFRASTRUCTURE / REPOSITORY LAYER
 # Definisce l'interfaccia (l'Adattatore) per l'accesso ai dati.
 # La logica di servizio lavorerà solo con questa interfaccia.
 
+
 class TaskRepository:
     def get_all(self):
         raise NotImplementedError
 
+    def get_all_json(self) -> bytes:
+        """Lista delle task già serializzata in JSON (default: da get_all)."""
+        return json.dumps(self.get_all(), separators=(',', ':'), sort_keys=True).encode('utf-8')
+
     def get_by_id(self, task_id):
         raise NotImplementedError
 
     def get_by_id_with_attachments(self, task_id):
         raise NotImplementedError
 
+    def get_attachment(self, task_id, file_idx, encoded=False):
+        raise NotImplementedError
+
     def create(self, task):
+        """
+        Crea la task; idempotente su uuid: se esiste già con lo stesso contenuto
+        ritorna quella esistente, con un contenuto diverso solleva TaskConflict.
+        """
         raise NotImplementedError
 
     def update(self, task_id, task_data):
@@ -24,127 +43,978 @@ class TaskRepository:
     def delete(self, task_id):
         raise NotImplementedError
 
+    # Operazioni batch: i default ripetono l'operazione singola, i repository
+    # concreti le eseguono con un solo lock (o una sola transazione) per batch
+
+    def create_many(self, tasks_data: list) -> list:
+        """
+        Crea tutte le task indicate; ritorna [(task, created)] nello stesso ordine,
+        con created False per le ripetizioni di una task già esistente.
+        """
+        return [(self.create(task_data), True) for task_data in tasks_data]
+
+    def get_status(self, task_ids: list) -> dict:
+        """
+        Stato compatto per ogni id: {'done': False} per le task in corso,
+        {'done': True, 'msgresponse'} per quelle completate, None se non esiste.
+        """
+        return {task_id: status_of(self.get_by_id(task_id)) for task_id in task_ids}
+
+    def delete_many(self, task_ids: list) -> dict:
+        """Cancella le task indicate; ritorna {id: True se cancellata}."""
+        return {task_id: self.delete(task_id) for task_id in task_ids}
+
+    def wait_done(self, task_id, timeout):
+        raise NotImplementedError
+
+    # Generazione della risposta in streaming (usati dal servizio)
+
+    def get_prompts(self, task_ids: list) -> dict:
+        """Prompt {'msg', 'digests'} delle task senza prenderle in carico: {id: prompt | None}."""
+        raise NotImplementedError
+
+    def begin_response(self, task_id, stale_before: float | None = None):
+        """
+        Prende in carico la generazione della task: azzera la risposta e ritorna
+        il prompt {'msg', 'digests'} con i digest degli allegati. Ritorna None se
+        la task non esiste, è già done o (store condivisi) è in carico a un altro
+        worker: con stale_before la presa riesce solo se la scadenza della task
+        (due_at) è precedente a stale_before.
+        """
+        raise NotImplementedError
+
+    def append_response(self, task_id, chunk: str, done: bool = False):
+        """Aggiunge chunk a msgresponse (e con done=True completa la task); None se non esiste."""
+        raise NotImplementedError
+
+    def wait_response(self, task_id, offset: int, timeout):
+        """
+        Attende (al massimo timeout secondi) che msgresponse superi offset
+        caratteri o che la task sia done. Ritorna la task oppure None se non esiste.
+        """
+        raise NotImplementedError
+
+    def get_version(self) -> int:
+        """Versione corrente della lista del client (cresce a ogni modifica)."""
+        raise NotImplementedError
+
+    def get_changes(self, since: int):
+        """
+        Modifiche successive alla versione since:
+        {'version', 'tasks': [task create o aggiornate], 'deleted': [uuid]}.
+        None se since è più vecchia della storia conservata (serve una lista completa).
+        """
+        raise NotImplementedError
+
+    def get_page(self, limit=None, after=None, before=None, fields=None):
+        """
+        Pagina della lista in ordine di inserimento, con i soli campi fields:
+        - after: le limit task successive al cursore,
+        - before: le limit task precedenti al cursore,
+        - nessun cursore: le ultime limit task (la pagina più recente).
+        Ritorna {'tasks', 'before', 'after'} dove before/after sono i cursori
+        delle pagine adiacenti (None se non ce ne sono); None se il cursore non esiste.
+        Con limit None ritorna tutte le task (solo proiezione).
+        """
+        raise NotImplementedError
+
+
+def status_of(task: dict | None) -> dict | None:
+    """Forma compatta di una task per get_status."""
+    if task is None:
+        return None
+    if task['done']:
+        return {'done': True, 'msgresponse': task['msgresponse']}
+    return {'done': False}
+
+
+class TaskConflict(Exception):
+    """Creazione con lo uuid di una task esistente ma con un contenuto diverso."""
+    def __init__(self, task_id: str):
+        super().__init__(task_id)
+        self.task_id = task_id
+
+
+def payload_hash(task_data: dict) -> str:
+    """
+    Impronta del contenuto di una creazione (msg, fileStructures, allegati) per
+    riconoscere le create ripetute. Gli allegati entrano così come arrivano
+    (stringa base64 o digest del BlobRef già caricato): nessuna decodifica.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([task_data['msg'], task_data.get('fileStructures') or []],
+                             separators=(',', ':'), sort_keys=True).encode('utf-8'))
+    for blob in task_data.get('blobs') or []:
+        digest.update(b'\x00' + (blob.digest if isinstance(blob, BlobRef) else str(blob)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Tombstone conservati per client per la sincronizzazione incrementale: oltre
+# questo limite i client con una versione più vecchia ricevono la lista completa
+MAX_TOMBSTONES = 1024
+
+
+def initial_version() -> int:
+    """
+    Versione di partenza di una sessione (microsecondi dall'epoch): resta
+    monotona anche dopo eviction o riavvio, così un ETag di una vecchia
+    incarnazione della sessione non può coincidere con quella nuova.
+    """
+    return time.time_ns() // 1000
+
+
+# Stima dell'occupazione di una task oltre ai testi e agli allegati (oggetto, dict, indice)
+TASK_OVERHEAD_BYTES = 512
+
+
+def task_bytes(task: Task) -> int:
+    """Dimensione stimata di una task, allegati inclusi (per il budget di memoria)."""
+    return TASK_OVERHEAD_BYTES + len(task.msg) + len(task.msgresponse) + sum(ref.size for ref in task.blobs)
+
+
+# Tempi dei lock dello store in memoria (vedi _TimedLock): viene misurata una
+# sezione critica ogni LOCK_SAMPLE_EVERY, le altre usano il lock senza wrapper
+LOCK_SAMPLE_EVERY = 16
+STORE_LOCK_WAIT = METRICS.histogram(
+    'chatbot_store_lock_wait_seconds',
+    f'Attesa per acquisire il lock di una stripe dello store (campione 1 su {LOCK_SAMPLE_EVERY})', LOCK_BUCKETS)
+STORE_LOCK_HOLD = METRICS.histogram(
+    'chatbot_store_lock_hold_seconds',
+    f'Durata delle sezioni critiche sul lock di una stripe dello store (campione 1 su {LOCK_SAMPLE_EVERY})',
+    LOCK_BUCKETS)
+
+
+class _TimedLock:
+    """
+    Context manager sul lock di una stripe che misura attesa e durata della
+    sezione critica più esterna. Stato e contatori (shard degli istogrammi)
+    sono protetti dal lock stesso: un'istanza per stripe, nessuna allocazione
+    né lock aggiuntivo per ogni with.
+    """
+    __slots__ = ('_lock', '_depth', '_acquired_at', '_wait', '_hold')
+
+    def __init__(self, lock: threading.RLock):
+        self._lock = lock
+        self._depth = 0
+        self._acquired_at = 0.0
+        self._wait = STORE_LOCK_WAIT.shard()
+        self._hold = STORE_LOCK_HOLD.shard()
+
+    def __enter__(self):
+        # Caso comune senza contesa: nessuna misura dell'attesa
+        if self._lock.acquire(blocking=False):
+            waited = 0.0
+        else:
+            start = time.perf_counter()
+            self._lock.acquire()
+            waited = time.perf_counter() - start
+        if self._depth == 0:
+            self._acquired_at = time.perf_counter()
+            self._wait.observe(waited)
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            self._hold.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+        return False
+
+
+class _TaskWaiter:
+    """Condition (sul lock della stripe) dei thread in attesa di un task, con il loro numero."""
+    __slots__ = ('condition', 'count')
+
+    def __init__(self, lock: threading.RLock):
+        self.condition = threading.Condition(lock)
+        self.count = 0
+
+
+class _StoreStripe:
+    """
+    Partizione dello store: un lock proprio e i bucket dei client che vi ricadono.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Stesso lock, con i tempi di attesa e di possesso registrati nelle metriche
+        self.timed_lock = _TimedLock(self.lock)
+        # Contatore (non protetto, basta approssimato) per il campionamento di timed_lock
+        self.lock_uses = 0
+        # Attese per task: (client_id, uuid) -> _TaskWaiter, create alla prima
+        # attesa e rimosse con l'ultima; una notifica sveglia solo quel task
+        self.waiters: dict[tuple[str, str], _TaskWaiter] = {}
+        # Dati separati per client_id: indice uuid -> Task.
+        # Il dict conserva l'ordine di inserimento, quindi get_all resta ordinato
+        # mentre lookup, update e delete diventano O(1).
+        self.tasks_by_client: dict[str, dict[str, Task]] = {}
+        self.current_id_by_client: dict[str, int] = {}
+        # LRU delle sessioni: client_id -> ultimo accesso (monotonic), dal più vecchio
+        self.last_access: OrderedDict[str, float] = OrderedDict()
+        self.bytes_by_client: dict[str, int] = {}
+        # Sincronizzazione incrementale: versione corrente del client, versione
+        # dell'ultima modifica di ogni task (dalla meno recente) e tombstone
+        self.version_by_client: dict[str, int] = {}
+        self.floor_by_client: dict[str, int] = {}
+        self.changed_by_client: dict[str, OrderedDict[str, int]] = {}
+        self.tombstones_by_client: dict[str, OrderedDict[str, int]] = {}
+        # Indice per la paginazione: uuid in ordine di inserimento (None dove
+        # una task è stata cancellata) e posizione di ogni uuid nella lista.
+        # Gli estremi sono sempre task esistenti: i buchi in coda vengono tolti
+        # subito e first_by_client è l'indice della prima task esistente
+        self.order_by_client: dict[str, list[str | None]] = {}
+        self.position_by_client: dict[str, dict[str, int]] = {}
+        self.first_by_client: dict[str, int] = {}
+        # True mentre il lock è tenuto da try_lock: le letture non fanno eviction
+        self.evict_paused = False
+        self.bytes = 0
+        self.evicted_ttl = 0
+        self.evicted_budget = 0
 
 
 class InMemoryTaskStore:
     """
     Store condiviso thread-safe per i Task.
-    - Mantiene i dati e il lock.
+    - Mantiene i dati e i lock.
+    - I client sono ripartiti su N stripe (hash di client_id), ognuna con il
+      proprio lock: sessioni diverse non si contendono lo stesso lock.
+    - Le sessioni inattive da più di session_ttl secondi, o le meno recenti
+      quando l'occupazione stimata supera memory_budget byte, vengono rimosse
+      a piccoli lotti durante le richieste normali e dallo sweep periodico.
     - È pensato come singleton del processo.
     """
-    def __init__(self):
-        self._lock = threading.RLock()
-        # Dati separati per client_id
-        self._tasks_by_client: dict[str, list[Task]] = {}
-        self._current_id_by_client: dict[str, int] = {}
+    DEFAULT_STRIPES = 16
+    # Sessioni rimosse al massimo per ogni accesso: niente pause lunghe
+    EVICTION_BATCH = 8
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES, journal: TaskJournal | None = None,
+                 session_ttl: float | None = None, memory_budget: int | None = None,
+                 blob_store: InMemoryBlobStore = BLOB_STORE):
+        if stripes < 1:
+            raise ValueError("stripes deve essere >= 1")
+        self._stripes = [_StoreStripe() for _ in range(stripes)]
+        # Persistenza opzionale (write-ahead log + snapshot), vedi journal.py
+        self._journal = journal
+        self._session_ttl = session_ttl
+        self._memory_budget = memory_budget
+        # Serve a rilasciare gli allegati delle sessioni rimosse
+        self._blobs = blob_store
+        # Callback chiamate da notify_task (es. le attese asyncio del server ASGI)
+        self._done_listeners: list = []
 
-    # Metodi di utilità protetti dal lock per operazioni atomiche
-    def _ensure_client(self, client_id: str):
-        if client_id not in self._tasks_by_client:
-            self._tasks_by_client[client_id] = []
-            self._current_id_by_client[client_id] = 0
+    def _stripe(self, client_id: str) -> _StoreStripe:
+        return self._stripes[hash(client_id) % len(self._stripes)]
+
+    # Metodi di utilità protetti dal lock della stripe per operazioni atomiche
+    @staticmethod
+    def _ensure_client(stripe: _StoreStripe, client_id: str):
+        if client_id not in stripe.tasks_by_client:
+            stripe.tasks_by_client[client_id] = {}
+            stripe.current_id_by_client[client_id] = 0
+            stripe.bytes_by_client[client_id] = 0
+            stripe.version_by_client[client_id] = stripe.floor_by_client[client_id] = initial_version()
+            stripe.changed_by_client[client_id] = OrderedDict()
+            stripe.tombstones_by_client[client_id] = OrderedDict()
+            stripe.order_by_client[client_id] = []
+            stripe.position_by_client[client_id] = {}
+            stripe.first_by_client[client_id] = 0
+        stripe.last_access[client_id] = time.monotonic()
+        stripe.last_access.move_to_end(client_id)
 
     # def next_id(self, client_id: str) -> int:
-    #     with self._lock:
-    #         self._ensure_client(client_id)
-    #         self._current_id_by_client[client_id] += 1
-    #         return self._current_id_by_client[client_id]
+    #     stripe = self._stripe(client_id)
+    #     with stripe.lock:
+    #         self._ensure_client(stripe, client_id)
+    #         stripe.current_id_by_client[client_id] += 1
+    #         return stripe.current_id_by_client[client_id]
+
+    def get_tasks(self, client_id: str) -> dict[str, Task]:
+        stripe = self._stripe(client_id)
+        with stripe.lock:
+            self._ensure_client(stripe, client_id)
+            # Eviction ammortizzata: ogni accesso rimuove al più un piccolo lotto
+            # (non dalle letture dell'event loop, vedi try_lock)
+            if not stripe.evict_paused:
+                self._evict_some(stripe, exclude=client_id)
+            return stripe.tasks_by_client[client_id]
 
-    def get_tasks(self, client_id: str) -> list:
-        with self._lock:
-            self._ensure_client(client_id)
-            return self._tasks_by_client[client_id]
+    def set_tasks(self, client_id: str, tasks: dict[str, Task]):
+        stripe = self._stripe(client_id)
+        with stripe.lock:
+            self._ensure_client(stripe, client_id)
+            stripe.tasks_by_client[client_id] = tasks
+            # Lista sostituita per intero: la storia precedente non è più valida
+            stripe.changed_by_client[client_id].clear()
+            stripe.tombstones_by_client[client_id].clear()
+            stripe.order_by_client[client_id] = []
+            stripe.position_by_client[client_id] = {}
+            stripe.first_by_client[client_id] = 0
+            for task_id in tasks:
+                self.touch(client_id, task_id)
+            stripe.floor_by_client[client_id] = stripe.version_by_client[client_id]
+            self.account(client_id, sum(task_bytes(t) for t in tasks.values()) - stripe.bytes_by_client[client_id])
 
-    def set_tasks(self, client_id: str, tasks: list):
-        with self._lock:
-            self._ensure_client(client_id)
-            self._tasks_by_client[client_id] = tasks
+    def account(self, client_id: str, delta: int):
+        """Aggiorna l'occupazione stimata del client (sotto il lock del client)."""
+        stripe = self._stripe(client_id)
+        if client_id in stripe.bytes_by_client:
+            stripe.bytes_by_client[client_id] += delta
+            stripe.bytes += delta
+
+    # Versioni: touch e tombstone vanno chiamati sotto il lock del client
+
+    def touch(self, client_id: str, task_id: str):
+        """Registra la creazione o modifica di una task e incrementa la versione."""
+        stripe = self._stripe(client_id)
+        version = stripe.version_by_client[client_id] + 1
+        stripe.version_by_client[client_id] = version
+        changed = stripe.changed_by_client[client_id]
+        changed.pop(task_id, None)
+        changed[task_id] = version
+        stripe.tombstones_by_client[client_id].pop(task_id, None)
+        positions = stripe.position_by_client[client_id]
+        if task_id not in positions:
+            order = stripe.order_by_client[client_id]
+            positions[task_id] = len(order)
+            order.append(task_id)
+
+    def tombstone(self, client_id: str, task_id: str):
+        """Registra la cancellazione di una task (tombstone con la nuova versione)."""
+        stripe = self._stripe(client_id)
+        version = stripe.version_by_client[client_id] + 1
+        stripe.version_by_client[client_id] = version
+        stripe.changed_by_client[client_id].pop(task_id, None)
+        tombstones = stripe.tombstones_by_client[client_id]
+        tombstones[task_id] = version
+        if len(tombstones) > MAX_TOMBSTONES:
+            # Il tombstone più vecchio si perde: chi è fermo prima di lui deve risincronizzarsi
+            _, dropped = tombstones.popitem(last=False)
+            stripe.floor_by_client[client_id] = dropped
+        order = stripe.order_by_client[client_id]
+        positions = stripe.position_by_client[client_id]
+        position = positions.pop(task_id, None)
+        if position is not None:
+            order[position] = None
+            # Ogni buco è superato una sola volta (in coda viene tolto, in testa
+            # first avanza e non torna indietro): costo ammortizzato O(1)
+            while order and order[-1] is None:
+                order.pop()
+            first = stripe.first_by_client[client_id]
+            while first < len(order) and order[first] is None:
+                first += 1
+            # Compattazione quando i buchi superano la metà: costo ammortizzato O(1)
+            if len(order) > 64 and len(positions) * 2 < len(order):
+                order[:] = [uuid for uuid in order if uuid is not None]
+                positions.clear()
+                positions.update((uuid, i) for i, uuid in enumerate(order))
+                first = 0
+            stripe.first_by_client[client_id] = first if order else 0
+
+    def page(self, client_id: str, limit: int, after: str | None = None,
+             before: str | None = None) -> tuple[list[str], bool, bool] | None:
+        """
+        (uuid della pagina, ci sono task più vecchie, ci sono task più recenti).
+        Il cursore si risolve in O(1) tramite l'indice delle posizioni, e con gli
+        estremi della lista sempre esistenti anche le altre due risposte; None
+        se il cursore non esiste. Sotto il lock del client.
+        """
+        stripe = self._stripe(client_id)
+        self._ensure_client(stripe, client_id)
+        order = stripe.order_by_client[client_id]
+        positions = stripe.position_by_client[client_id]
+        cursor = after if after is not None else before
+        if cursor is not None and cursor not in positions:
+            return None
+        ids = []
+        if after is not None:
+            i = positions[after] + 1
+            while i < len(order) and len(ids) < limit:
+                if order[i] is not None:
+                    ids.append(order[i])
+                i += 1
+            # L'ultimo elemento della lista è una task esistente
+            return ids, True, i < len(order)
+        i = positions[before] - 1 if before is not None else len(order) - 1
+        while i >= 0 and len(ids) < limit:
+            if order[i] is not None:
+                ids.append(order[i])
+            i -= 1
+        ids.reverse()
+        return ids, i >= stripe.first_by_client[client_id], before is not None
+
+    def version(self, client_id: str) -> int:
+        stripe = self._stripe(client_id)
+        with stripe.lock:
+            self._ensure_client(stripe, client_id)
+            return stripe.version_by_client[client_id]
+
+    def changes_since(self, client_id: str, since: int) -> tuple[int, list[str], list[str]] | None:
+        """
+        (versione, uuid modificati, uuid cancellati) dopo since, in ordine di
+        versione; costo proporzionale alle modifiche, non alla lunghezza della
+        sessione. None se since precede la storia conservata. Sotto il lock del client.
+        """
+        stripe = self._stripe(client_id)
+        self._ensure_client(stripe, client_id)
+        if since < stripe.floor_by_client[client_id]:
+            return None
+
+        def after(entries: OrderedDict[str, int]) -> list[str]:
+            found = []
+            for task_id in reversed(entries):
+                if entries[task_id] <= since:
+                    break
+                found.append(task_id)
+            found.reverse()
+            return found
+
+        return (stripe.version_by_client[client_id],
+                after(stripe.changed_by_client[client_id]),
+                after(stripe.tombstones_by_client[client_id]))
+
+    def resident_bytes(self) -> int:
+        return sum(stripe.bytes for stripe in self._stripes)
+
+    def _over_budget(self) -> bool:
+        return self._memory_budget is not None and self.resident_bytes() > self._memory_budget
+
+    def _evict_some(self, stripe: _StoreStripe, exclude: str | None = None, limit: int = EVICTION_BATCH):
+        if self._session_ttl is None and self._memory_budget is None:
+            return
+        now = time.monotonic()
+        evicted = 0
+        while evicted < limit and stripe.last_access:
+            client_id, last = next(iter(stripe.last_access.items()))
+            if client_id == exclude:
+                break
+            if self._session_ttl is not None and now - last > self._session_ttl:
+                stripe.evicted_ttl += 1
+            elif self._over_budget():
+                stripe.evicted_budget += 1
+            else:
+                break
+            self._evict(stripe, client_id)
+            evicted += 1
+
+    def _evict(self, stripe: _StoreStripe, client_id: str):
+        tasks = stripe.tasks_by_client.pop(client_id)
+        stripe.current_id_by_client.pop(client_id, None)
+        stripe.last_access.pop(client_id, None)
+        stripe.bytes -= stripe.bytes_by_client.pop(client_id, 0)
+        stripe.version_by_client.pop(client_id, None)
+        stripe.floor_by_client.pop(client_id, None)
+        stripe.changed_by_client.pop(client_id, None)
+        stripe.tombstones_by_client.pop(client_id, None)
+        stripe.order_by_client.pop(client_id, None)
+        stripe.position_by_client.pop(client_id, None)
+        stripe.first_by_client.pop(client_id, None)
+        refs = [ref for task in tasks.values() for ref in task.blobs]
+        # Chi ha ancora un riferimento al dict (es. wait_done) vede le task sparite
+        tasks.clear()
+        if self._journal is not None:
+            self._journal.append({'op': 'evict', 'c': client_id})
+        for (waiter_client, _), waiter in stripe.waiters.items():
+            if waiter_client == client_id:
+                waiter.condition.notify_all()
+        for listener in self._done_listeners:
+            listener(client_id, None)
+        for ref in refs:
+            self._blobs.release(ref.digest)
+
+    def sweep(self):
+        """
+        Sweep incrementale di tutte le stripe (job periodico a bassa priorità):
+        un lotto per stripe, prendendo un lock alla volta.
+        """
+        for stripe in self._stripes:
+            with stripe.lock:
+                self._evict_some(stripe)
+
+    def stats(self) -> dict:
+        sessions = tasks = 0
+        # Una stripe alla volta sotto il suo lock: i dict cambiano durante le scritture concorrenti
+        for stripe in self._stripes:
+            with stripe.lock:
+                sessions += len(stripe.tasks_by_client)
+                tasks += sum(len(client_tasks) for client_tasks in stripe.tasks_by_client.values())
+        return {
+            "sessions": sessions,
+            "tasks": tasks,
+            "residentBytes": self.resident_bytes(),
+            "evictedTtl": sum(stripe.evicted_ttl for stripe in self._stripes),
+            "evictedBudget": sum(stripe.evicted_budget for stripe in self._stripes),
+        }
 
     #def get_tasks_for_client(self, client_id: str):
     #    if client_id not in self._data:
     #        self._data[client_id] = {}
     #    return self._data[client_id]
 
-    def with_lock(self):
+    def with_lock(self, client_id: str):
         """
-        Context manager per operazioni consistenti multi-passaggio.
+        Context manager per operazioni consistenti multi-passaggio sui task
+        di un client (blocca solo la stripe a cui appartiene).
         Esempio:
-            with store.with_lock():
+            with store.with_lock(client_id):
                 # leggi/modifica tasks in modo atomico
         """
-        return self._lock
+        stripe = self._stripe(client_id)
+        if METRICS.enabled:
+            stripe.lock_uses += 1
+            if stripe.lock_uses % LOCK_SAMPLE_EVERY == 0:
+                return stripe.timed_lock
+        return stripe.lock
 
+    def try_lock(self, client_id: str) -> bool:
+        """
+        Prende il lock della stripe del client solo se è libero, senza attendere
+        (per chi non può bloccarsi, es. l'event loop ASGI); True se preso, da
+        rilasciare con unlock(). Il lock è rientrante per i metodi del repository
+        e finché è tenuto così gli accessi non fanno eviction (rilascio dei blob,
+        file su disco, journal): la farà il prossimo accesso da un thread.
+        """
+        stripe = self._stripe(client_id)
+        if not stripe.lock.acquire(blocking=False):
+            return False
+        stripe.evict_paused = True
+        return True
 
+    def unlock(self, client_id: str):
+        stripe = self._stripe(client_id)
+        stripe.evict_paused = False
+        stripe.lock.release()
 
-# Istanza singleton di store condiviso nel processo
-TASK_STORE = InMemoryTaskStore()
+    def wait_task(self, client_id: str, task_id: str, ready, timeout):
+        """
+        Attende (al massimo timeout secondi) che ready(task) sia vero, con task
+        None se non esiste; ritorna il task come dict (letto sotto il lock) o
+        None. Solo notify_task dello stesso task (o l'eviction della sessione)
+        sveglia l'attesa.
+        """
+        stripe = self._stripe(client_id)
+        key = (client_id, task_id)
+        with stripe.lock:
+            tasks = self.get_tasks(client_id)
+            waiter = stripe.waiters.get(key)
+            if waiter is None:
+                waiter = stripe.waiters[key] = _TaskWaiter(stripe.lock)
+            waiter.count += 1
+            try:
+                waiter.condition.wait_for(lambda: ready(tasks.get(task_id)), timeout)
+            finally:
+                waiter.count -= 1
+                if waiter.count == 0:
+                    del stripe.waiters[key]
+            found = tasks.get(task_id)
+            return found.to_dict() if found else None
+
+    def notify_task(self, client_id: str, task_id: str):
+        """Sveglia le attese del task: è diventato done, ha un nuovo chunk di risposta o è stato cancellato."""
+        stripe = self._stripe(client_id)
+        with stripe.lock:
+            waiter = stripe.waiters.get((client_id, task_id))
+            if waiter is not None:
+                waiter.condition.notify_all()
+        for listener in self._done_listeners:
+            listener(client_id, task_id)
+
+    def add_done_listener(self, listener):
+        """
+        Registra listener(client_id, task_id), chiamata a ogni notify_task dal
+        thread che modifica la task (spesso sotto il lock della stripe) e con
+        task_id None quando la sessione viene rimossa: deve solo segnalare,
+        senza bloccare né accedere allo store.
+        """
+        self._done_listeners.append(listener)
+
+    # Persistenza: i metodi log_* vanno chiamati sotto il lock del client,
+    # così l'ordine nel log coincide con l'ordine delle modifiche
+
+    def log_put(self, client_id: str, task: Task):
+        if self._journal is not None:
+            self._journal.append({'op': 'put', 'c': client_id, 't': task_record(task)})
+
+    def log_delete(self, client_id: str, task_id: str):
+        if self._journal is not None:
+            self._journal.append({'op': 'del', 'c': client_id, 'u': task_id})
+
+    def persist_blobs(self, refs: list[BlobRef], blob_store: InMemoryBlobStore):
+        """Salva nel journal i contenuti non ancora persistiti (fuori dai lock)."""
+        if self._journal is None:
+            return
+        for ref in refs:
+            if not self._journal.has_blob(ref.digest):
+                data = blob_store.get(ref.digest)
+                if data is not None:
+                    self._journal.save_blob(ref.digest, data)
+
+    def journal_records(self) -> int:
+        """Operazioni registrate nel log dall'ultimo snapshot (0 senza journal)."""
+        return self._journal.records_since_snapshot if self._journal is not None else 0
+
+    def snapshot(self):
+        """
+        Scrive uno snapshot compatto: ruota il log e poi copia lo stato una
+        stripe alla volta (mai un lock globale). Le operazioni successive alla
+        rotazione sono nel nuovo segmento e la replay è idempotente.
+        """
+        if self._journal is None:
+            return
+        seq = self._journal.rotate()
+
+        def records():
+            for stripe in self._stripes:
+                with stripe.lock:
+                    rows = [(client_id, [task_record(task) for task in tasks.values()])
+                            for client_id, tasks in stripe.tasks_by_client.items() if tasks]
+                for client_id, tasks in rows:
+                    yield {'c': client_id, 't': tasks}
+
+        self._journal.write_snapshot(seq, records())
+
+    def recover(self, blob_store: InMemoryBlobStore) -> list[tuple[str, str]]:
+        """
+        Ricarica lo stato dal journal (da chiamare all'avvio, prima di servire
+        richieste). Ritorna le task non completate [(client_id, uuid)] da ripianificare.
+        """
+        if self._journal is None:
+            return []
+        pending = []
+        referenced = set()
+        for client_id, records in self._journal.load().items():
+            stripe = self._stripe(client_id)
+            with stripe.lock:
+                self._ensure_client(stripe, client_id)
+                tasks = stripe.tasks_by_client[client_id]
+                for task_id, record in records.items():
+                    task = task_from_record(record)
+                    if task.blobs:
+                        for ref in task.blobs:
+                            data = self._journal.read_blob(ref.digest)
+                            if data is not None:
+                                blob_store.put(data)
+                                referenced.add(ref.digest)
+                    tasks[task_id] = task
+                    self.touch(client_id, task_id)
+                    self.account(client_id, task_bytes(task))
+                    if not task.done:
+                        pending.append((client_id, task_id))
+        self._journal.collect_blobs(referenced)
+        return pending
 
 
 # INFRASTRUCTURE / ADAPTER
 # Repository senza stato proprio (stateless) che usa lo store condiviso.
 class InMemoryTaskRepository(TaskRepository):
-    def __init__(self, client_id: str, store: InMemoryTaskStore = TASK_STORE):
+    def __init__(self, client_id: str, store: InMemoryTaskStore, blob_store: InMemoryBlobStore = BLOB_STORE):
         self._store = store
         self._client_id = client_id
+        self._blobs = blob_store
+
+    def _put_blobs(self, blobs: list) -> list[BlobRef]:
+        """
+        Decodifica e archivia gli allegati (fuori dal lock dello store).
+        I BlobRef già archiviati (upload in streaming) vengono adottati così come sono.
+        In caso di blob non valido rilascia quelli già archiviati e solleva ValueError.
+        """
+        refs = []
+        try:
+            for blob in blobs:
+                refs.append(blob if isinstance(blob, BlobRef) else self._blobs.put_encoded(blob))
+        except ValueError:
+            self._release_blobs(refs)
+            raise
+        return refs
+
+    def _release_blobs(self, refs: list[BlobRef]):
+        for ref in refs:
+            self._blobs.release(ref.digest)
 
     def get_all(self):
-        with self._store.with_lock():
+        with self._store.with_lock(self._client_id):
             tasks = self._store.get_tasks(self._client_id)
-            return [task.to_dict() for task in tasks]
+            return [task.to_dict() for task in tasks.values()]
 
-    def get_by_id(self, task_id):
-        with self._store.with_lock():
+    def get_all_json(self) -> bytes:
+        # Concatena i frammenti JSON in cache di ogni task: nessun dict né
+        # serializzazione per le task non modificate dall'ultima lettura
+        with self._store.with_lock(self._client_id):
+            tasks = self._store.get_tasks(self._client_id)
+            return b'[' + b','.join([task.to_json() for task in tasks.values()]) + b']'
+
+    def get_version(self) -> int:
+        return self._store.version(self._client_id)
+
+    def get_changes(self, since: int):
+        with self._store.with_lock(self._client_id):
+            changes = self._store.changes_since(self._client_id, since)
+            if changes is None:
+                return None
+            version, changed, deleted = changes
             tasks = self._store.get_tasks(self._client_id)
-            found = next((task for task in tasks if task.uuid == task_id), None)
+            return {'version': version, 'tasks': [tasks[task_id].to_dict() for task_id in changed],
+                    'deleted': deleted}
+
+    def get_page(self, limit=None, after=None, before=None, fields=None):
+        with self._store.with_lock(self._client_id):
+            tasks = self._store.get_tasks(self._client_id)
+            if limit is None:
+                return {'tasks': [task.to_dict(fields) for task in tasks.values()], 'before': None, 'after': None}
+            page = self._store.page(self._client_id, limit, after, before)
+            if page is None:
+                return None
+            ids, has_older, has_newer = page
+            return {
+                'tasks': [tasks[task_id].to_dict(fields) for task_id in ids],
+                'before': ids[0] if ids and has_older else None,
+                'after': ids[-1] if ids and has_newer else None,
+            }
+
+    def get_by_id(self, task_id):
+        with self._store.with_lock(self._client_id):
+            found = self._store.get_tasks(self._client_id).get(task_id)
             return found.to_dict() if found else None
 
     def get_by_id_with_attachments(self, task_id):
-        with self._store.with_lock():
-            tasks = self._store.get_tasks(self._client_id)
-            found = next((task for task in tasks if task.uuid == task_id), None)
-            return found.to_dict_with_attachments() if found else None
+        with self._store.with_lock(self._client_id):
+            found = self._store.get_tasks(self._client_id).get(task_id)
+            if found is None:
+                return None
+            result = found.to_dict_with_attachments()
+        # La ricostruzione del base64 avviene fuori dal lock
+        result['blobs'] = [self._blobs.encode(ref) for ref in result['blobs']]
+        return result
+
+    def get_attachment(self, task_id, file_idx, encoded=False):
+        """
+        Ritorna il singolo allegato file_idx della task:
+        {'fileStructure', 'digest', 'size', 'source'} dove source sono i byte
+        in memoria o il path su disco; con encoded=True source è invece la
+        stringa base64 originale. None se task o allegato non esistono.
+        """
+        with self._store.with_lock(self._client_id):
+            found = self._store.get_tasks(self._client_id).get(task_id)
+            if found is None or not 0 <= file_idx < len(found.blobs):
+                return None
+            ref = found.blobs[file_idx]
+            structures = found.file_structures
+            structure = structures[file_idx] if file_idx < len(structures) else {}
+        source = self._blobs.encode(ref) if encoded else self._blobs.source(ref.digest)
+        if source is None:
+            return None
+        return {'fileStructure': structure, 'digest': ref.digest, 'size': ref.size, 'source': source}
 
     def create(self, task_data):
-        # next_id() è già thread-safe e namespaced per client
-        # new_id = self._store.next_id(self._client_id)
-        new_task = Task(
-            uuid=task_data["uuid"],
-            msg=task_data['msg'],
-            done=False,
-            msgresponse='',
-            file_structures=task_data.get('fileStructures') or [],
-            blobs=task_data.get('blobs') or []
-        )
-        with self._store.with_lock():
+        return self.create_many([task_data])[0][0]
+
+    def create_many(self, tasks_data):
+        hashes = [payload_hash(task_data) for task_data in tasks_data]
+        # Prima verifica delle ripetizioni: per queste nessuna decodifica degli allegati
+        with self._store.with_lock(self._client_id):
+            try:
+                replays = self._replays(tasks_data, hashes)
+            except TaskConflict:
+                for task_data in tasks_data:
+                    self._release_staged(task_data)
+                raise
+        new_tasks = {}
+        try:
+            for index, (task_data, digest) in enumerate(zip(tasks_data, hashes)):
+                if index in replays:
+                    self._release_staged(task_data)
+                    continue
+                new_tasks[index] = Task(
+                    uuid=task_data["uuid"],
+                    msg=task_data['msg'],
+                    done=False,
+                    msgresponse='',
+                    file_structures=task_data.get('fileStructures') or [],
+                    blobs=self._put_blobs(task_data.get('blobs') or []),
+                    payload_hash=digest
+                )
+        except ValueError:
+            # Un allegato non valido annulla tutto il batch
+            for task in new_tasks.values():
+                self._release_blobs(task.blobs)
+            for task_data in tasks_data[index + 1:]:
+                self._release_staged(task_data)
+            raise
+        for task in new_tasks.values():
+            self._store.persist_blobs(task.blobs, self._blobs)
+        unused_blobs = []
+        # Un solo lock per tutto il batch
+        with self._store.with_lock(self._client_id):
             tasks = self._store.get_tasks(self._client_id)
-            tasks.append(new_task)
-            self._store.set_tasks(self._client_id, tasks)
-            return new_task.to_dict()
+            try:
+                # Di nuovo sotto lock: una create concorrente con lo stesso uuid può essere arrivata prima
+                replays = self._replays(tasks_data, hashes)
+            except TaskConflict:
+                for task in new_tasks.values():
+                    self._release_blobs(task.blobs)
+                raise
+            for index, new_task in new_tasks.items():
+                if index in replays:
+                    unused_blobs.extend(new_task.blobs)
+                    continue
+                tasks[new_task.uuid] = new_task
+                self._store.touch(self._client_id, new_task.uuid)
+                self._store.account(self._client_id, task_bytes(new_task))
+                self._store.log_put(self._client_id, new_task)
+            result = []
+            for index in range(len(tasks_data)):
+                source = replays.get(index, index)
+                if isinstance(source, int):
+                    result.append((new_tasks[source].to_dict(), source == index))
+                else:
+                    result.append((source.to_dict(), False))
+        self._release_blobs(unused_blobs)
+        return result
 
-    def update(self, task_id, task_data):
-        with self._store.with_lock():
-            mocked_msg = "This is a mocked response from the chatbot. The task has been processed successfully and here's the simulated AI response to your question."
+    def _replays(self, tasks_data: list, hashes: list[str]) -> dict:
+        """
+        Creazioni che ripetono una task esistente o un elemento precedente dello
+        stesso batch con lo stesso contenuto: {indice: Task esistente | indice}.
+        Lo uuid con un contenuto diverso solleva TaskConflict. Da chiamare sotto lock.
+        """
+        tasks = self._store.get_tasks(self._client_id)
+        first_index = {}
+        replays = {}
+        for index, (task_data, digest) in enumerate(zip(tasks_data, hashes)):
+            task_id = task_data['uuid']
+            existing = tasks.get(task_id)
+            if existing is not None:
+                # Task senza impronta (ripristinate da un journal precedente): accettate come ripetizioni
+                if existing.payload_hash not in (None, digest):
+                    raise TaskConflict(task_id)
+                replays[index] = existing
+            elif task_id in first_index:
+                if hashes[first_index[task_id]] != digest:
+                    raise TaskConflict(task_id)
+                replays[index] = first_index[task_id]
+            else:
+                first_index[task_id] = index
+        return replays
+
+    def _release_staged(self, task_data: dict):
+        """Rilascia gli allegati già caricati in streaming di una creazione non eseguita."""
+        self._release_blobs([blob for blob in task_data.get('blobs') or [] if isinstance(blob, BlobRef)])
+
+    def get_status(self, task_ids):
+        with self._store.with_lock(self._client_id):
             tasks = self._store.get_tasks(self._client_id)
-            task = next((t for t in tasks if t.uuid == task_id), None)
+            result = {}
+            for task_id in task_ids:
+                task = tasks.get(task_id)
+                result[task_id] = status_of(task.to_dict()) if task is not None else None
+            return result
+
+    def update(self, task_id, task_data):
+        # Gli eventuali nuovi allegati vengono decodificati prima di prendere il lock
+        new_blobs = self._put_blobs(task_data.get('blobs') or []) if 'blobs' in task_data else None
+        if new_blobs:
+            self._store.persist_blobs(new_blobs, self._blobs)
+        with self._store.with_lock(self._client_id):
+            task = self._store.get_tasks(self._client_id).get(task_id)
             if task is None:
-                return None
-            task.msg = task_data.get('msg', task.msg)
-            task.msgresponse = mocked_msg + task_data.get('msgresponse', task.msgresponse) + ' For question '+task.msg
-            task.done = task_data.get('done', task.done)
-            # opzionale: permetti aggiornamento degli allegati se forniti
-            if 'fileStructures' in task_data:
-                task.file_structures = task_data.get('fileStructures') or []
-            if 'blobs' in task_data:
-                task.blobs = task_data.get('blobs') or []
-            return task.to_dict()
+                stale_blobs, result = new_blobs or [], None
+            else:
+                size_before = task_bytes(task)
+                was_done = task.done
+                task.msg = task_data.get('msg', task.msg)
+                task.msgresponse = task_data.get('msgresponse', task.msgresponse)
+                task.done = task_data.get('done', task.done)
+                if task.done and not was_done:
+                    self._store.notify_task(self._client_id, task_id)
+                # opzionale: permetti aggiornamento degli allegati se forniti
+                if 'fileStructures' in task_data:
+                    task.file_structures = task_data.get('fileStructures') or []
+                stale_blobs = []
+                if new_blobs is not None:
+                    stale_blobs, task.blobs = task.blobs, new_blobs
+                self._store.touch(self._client_id, task_id)
+                self._store.account(self._client_id, task_bytes(task) - size_before)
+                self._store.log_put(self._client_id, task)
+                result = task.to_dict()
+        self._release_blobs(stale_blobs)
+        return result
 
     def delete(self, task_id):
-        with self._store.with_lock():
+        return self.delete_many([task_id])[task_id]
+
+    def delete_many(self, task_ids):
+        result = {}
+        removed_blobs = []
+        with self._store.with_lock(self._client_id):
+            tasks = self._store.get_tasks(self._client_id)
+            for task_id in task_ids:
+                removed = tasks.pop(task_id, None)
+                result[task_id] = removed is not None
+                if removed is not None:
+                    self._store.tombstone(self._client_id, task_id)
+                    self._store.account(self._client_id, -task_bytes(removed))
+                    self._store.log_delete(self._client_id, task_id)
+                    removed_blobs.extend(removed.blobs)
+            # Sveglia eventuali attese sui task appena rimossi
+            for task_id, removed in result.items():
+                if removed:
+                    self._store.notify_task(self._client_id, task_id)
+        self._release_blobs(removed_blobs)
+        return result
+
+    def wait_done(self, task_id, timeout):
+        """
+        Attende (al massimo timeout secondi) che il task diventi done.
+        Ritorna il task (done o meno allo scadere) oppure None se non esiste.
+        """
+        return self._wait_for(task_id, lambda task: task.done, timeout)
+
+    def wait_response(self, task_id, offset, timeout):
+        return self._wait_for(task_id, lambda task: task.done or len(task.msgresponse) > offset, timeout)
+
+    def _wait_for(self, task_id, predicate, timeout):
+        return self._store.wait_task(self._client_id, task_id, lambda task: task is None or predicate(task),
+                                     timeout)
+
+    def get_prompts(self, task_ids):
+        result = dict.fromkeys(task_ids)
+        # Un solo lock per tutte le task
+        with self._store.with_lock(self._client_id):
             tasks = self._store.get_tasks(self._client_id)
-            initial_len = len(tasks)
-            tasks = [t for t in tasks if t.uuid != task_id]
-            self._store.set_tasks(self._client_id, tasks)
-            return len(tasks) < initial_len
+            for task_id in result:
+                task = tasks.get(task_id)
+                if task is not None:
+                    result[task_id] = {'msg': task.msg, 'digests': [ref.digest for ref in task.blobs]}
+        return result
+
+    def begin_response(self, task_id, stale_before=None):
+        # Un solo processo: nessuna scadenza da controllare, solo le task già completate
+        with self._store.with_lock(self._client_id):
+            task = self._store.get_tasks(self._client_id).get(task_id)
+            if task is None or task.done:
+                return None
+            self._store.account(self._client_id, -len(task.msgresponse))
+            task.msgresponse = ''
+            task.done = False
+            self._store.touch(self._client_id, task_id)
+            self._store.log_put(self._client_id, task)
+            return {'msg': task.msg, 'digests': [ref.digest for ref in task.blobs]}
+
+    def append_response(self, task_id, chunk, done=False):
+        with self._store.with_lock(self._client_id):
+            task = self._store.get_tasks(self._client_id).get(task_id)
+            if task is None:
+                return None
+            task.msgresponse += chunk
+            if done:
+                task.done = True
+                # I chunk intermedi non vanno nel journal: dopo un crash la
+                # risposta viene rigenerata da capo (begin_response)
+                self._store.log_put(self._client_id, task)
+            self._store.touch(self._client_id, task_id)
+            self._store.account(self._client_id, len(chunk))
+            # Sveglia sia le attese di done sia gli stream della risposta parziale
+            self._store.notify_task(self._client_id, task_id)
+            return task.to_dict()
 
     # def get_task_files(self, task_id):
     #     """
@@ -0,0 +1,487 @@
+# INFRASTRUCTURE / SQLITE REPOSITORY
+# Store condiviso tra processi: un file SQLite in modalità WAL che più worker
+# gunicorn della stessa macchina possono usare in concorrenza (letture non
+# bloccanti, un writer alla volta). Anche gli allegati vivono nel database,
+# content-addressed e con refcount come nel blob store in memoria.
+import base64
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from src.backend.core.model import TASK_FIELDS
+from src.backend.infrastructure.blobstore import BLOB_STORE, BlobRef, InMemoryBlobStore
+from src.backend.infrastructure.repository import (MAX_TOMBSTONES, TaskConflict, TaskRepository, initial_version,
+                                                   payload_hash, status_of)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    msg TEXT NOT NULL,
+    msgresponse TEXT NOT NULL DEFAULT '',
+    done INTEGER NOT NULL DEFAULT 0,
+    file_structures TEXT NOT NULL DEFAULT '[]',
+    blobs TEXT NOT NULL DEFAULT '[]',
+    due_at REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    payload_hash TEXT,
+    UNIQUE (client_id, uuid)
+);
+CREATE INDEX IF NOT EXISTS tasks_pending ON tasks (done, due_at);
+CREATE INDEX IF NOT EXISTS tasks_client_seq ON tasks (client_id, seq);
+CREATE TABLE IF NOT EXISTS client_versions (
+    client_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    floor INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tombstones (
+    client_id TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (client_id, uuid)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    refs INTEGER NOT NULL
+);
+"""
+
+
+class SqliteTaskStore:
+    """
+    Store condiviso tra processi basato su SQLite (WAL).
+    - Una connessione per thread, aperta alla prima richiesta.
+    - Le scritture usano BEGIN IMMEDIATE: un solo writer, senza deadlock
+      di upgrade dei lock; busy_timeout gestisce l'attesa tra processi.
+    """
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self._path = path
+        self._busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(_SCHEMA)
+            # Database creati prima della sincronizzazione incrementale e delle create idempotenti
+            for column in ('version INTEGER NOT NULL DEFAULT 0', 'payload_hash TEXT'):
+                try:
+                    conn.execute(f'ALTER TABLE tasks ADD COLUMN {column}')
+                except sqlite3.OperationalError:
+                    pass
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_version ON tasks (client_id, version)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tombstones_version ON tombstones (client_id, version)')
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: transazioni gestite esplicitamente
+            conn = sqlite3.connect(self._path, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={self._busy_timeout_ms}')
+            self._local.conn = conn
+        return conn
+
+    def write(self):
+        """Context manager per una transazione di scrittura (BEGIN IMMEDIATE)."""
+        return _WriteTransaction(self.connection())
+
+    def overdue(self, before: float) -> list[tuple[str, str]]:
+        """Task non completate con scadenza precedente a before: [(client_id, uuid)]."""
+        rows = self.connection().execute(
+            'SELECT client_id, uuid FROM tasks WHERE done = 0 AND due_at IS NOT NULL AND due_at < ?',
+            (before,)).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+
+class _WriteTransaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._conn.execute('BEGIN IMMEDIATE')
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class SqliteTaskRepository(TaskRepository):
+    """
+    Repository per client su SqliteTaskStore, stessa semantica di
+    InMemoryTaskRepository. blob_store serve solo da area di staging per
+    gli allegati già caricati in streaming (BlobRef), che vengono copiati
+    nel database e rilasciati.
+    """
+    # Intervallo di polling di wait_done: tra processi non c'è una Condition condivisa
+    WAIT_POLL_INTERVAL = 0.1
+
+    def __init__(self, client_id: str, store: SqliteTaskStore, blob_store: InMemoryBlobStore = BLOB_STORE):
+        self._store = store
+        self._client_id = client_id
+        self._staging = blob_store
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        return {'uuid': row[0], 'msg': row[1], 'done': bool(row[2]), 'msgresponse': row[3]}
+
+    def _select(self, columns: str, task_id):
+        return self._store.connection().execute(
+            f'SELECT {columns} FROM tasks WHERE client_id = ? AND uuid = ?',
+            (self._client_id, task_id)).fetchone()
+
+    def get_all(self):
+        rows = self._store.connection().execute(
+            'SELECT uuid, msg, done, msgresponse FROM tasks WHERE client_id = ? ORDER BY seq',
+            (self._client_id,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def get_version(self) -> int:
+        row = self._store.connection().execute(
+            'SELECT version FROM client_versions WHERE client_id = ?', (self._client_id,)).fetchone()
+        if row is not None:
+            return row[0]
+        with self._store.write() as conn:
+            return self._version_row(conn)[0]
+
+    def get_changes(self, since: int):
+        conn = self._store.connection()
+        # Transazione di lettura: versione, task e tombstone dallo stesso snapshot WAL
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute('SELECT version, floor FROM client_versions WHERE client_id = ?',
+                               (self._client_id,)).fetchone()
+            if row is None or since < row[1]:
+                return None
+            tasks = conn.execute(
+                'SELECT uuid, msg, done, msgresponse FROM tasks WHERE client_id = ? AND version > ? '
+                'ORDER BY version', (self._client_id, since)).fetchall()
+            deleted = conn.execute(
+                'SELECT uuid FROM tombstones WHERE client_id = ? AND version > ? ORDER BY version',
+                (self._client_id, since)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        return {'version': row[0], 'tasks': [self._to_dict(task) for task in tasks],
+                'deleted': [task[0] for task in deleted]}
+
+    def _version_row(self, conn: sqlite3.Connection) -> tuple[int, int]:
+        """(version, floor) del client, creando la riga se manca (dentro una write())."""
+        start = initial_version()
+        conn.execute('INSERT OR IGNORE INTO client_versions (client_id, version, floor) VALUES (?, ?, ?)',
+                     (self._client_id, start, start))
+        return conn.execute('SELECT version, floor FROM client_versions WHERE client_id = ?',
+                            (self._client_id,)).fetchone()
+
+    def _next_version(self, conn: sqlite3.Connection) -> int:
+        version = self._version_row(conn)[0] + 1
+        conn.execute('UPDATE client_versions SET version = ? WHERE client_id = ?', (version, self._client_id))
+        return version
+
+    def get_page(self, limit=None, after=None, before=None, fields=None):
+        # Le colonne selezionate sono solo quelle richieste (nomi già validati)
+        fields = list(fields or TASK_FIELDS)
+        columns = ', '.join(fields)
+        conn = self._store.connection()
+        if limit is None:
+            rows = conn.execute(f'SELECT {columns} FROM tasks WHERE client_id = ? ORDER BY seq',
+                                (self._client_id,)).fetchall()
+            return {'tasks': [self._project(fields, row) for row in rows], 'before': None, 'after': None}
+        cursor = after if after is not None else before
+        seq = None
+        if cursor is not None:
+            found = self._select('seq', cursor)
+            if found is None:
+                return None
+            seq = found[0]
+        # Una riga in più per sapere se esiste la pagina successiva
+        if after is not None:
+            rows = conn.execute(
+                f'SELECT uuid, {columns} FROM tasks WHERE client_id = ? AND seq > ? ORDER BY seq LIMIT ?',
+                (self._client_id, seq, limit + 1)).fetchall()
+            has_older, has_newer = True, len(rows) > limit
+            rows = rows[:limit]
+        else:
+            rows = conn.execute(
+                f'SELECT uuid, {columns} FROM tasks WHERE client_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?',
+                (self._client_id, seq if seq is not None else 2 ** 63 - 1, limit + 1)).fetchall()
+            has_older, has_newer = len(rows) > limit, before is not None
+            rows = rows[:limit][::-1]
+        return {
+            'tasks': [self._project(fields, row[1:]) for row in rows],
+            'before': rows[0][0] if rows and has_older else None,
+            'after': rows[-1][0] if rows and has_newer else None,
+        }
+
+    @staticmethod
+    def _project(fields: list[str], row) -> dict:
+        return {field: bool(value) if field == 'done' else value for field, value in zip(fields, row)}
+
+    def get_by_id(self, task_id):
+        row = self._select('uuid, msg, done, msgresponse', task_id)
+        return self._to_dict(row) if row else None
+
+    def get_by_id_with_attachments(self, task_id):
+        row = self._select('uuid, msg, done, msgresponse, file_structures, blobs', task_id)
+        if row is None:
+            return None
+        result = self._to_dict(row)
+        result['fileStructures'] = json.loads(row[4])
+        result['blobs'] = [self._encode(ref) for ref in json.loads(row[5])]
+        return result
+
+    def get_attachment(self, task_id, file_idx, encoded=False):
+        row = self._select('file_structures, blobs', task_id)
+        if row is None:
+            return None
+        structures, refs = json.loads(row[0]), json.loads(row[1])
+        if not 0 <= file_idx < len(refs):
+            return None
+        digest, size, header = refs[file_idx]
+        data = self._blob_data(digest)
+        if data is None:
+            return None
+        return {
+            'fileStructure': structures[file_idx] if file_idx < len(structures) else {},
+            'digest': digest,
+            'size': size,
+            'source': header + base64.b64encode(data).decode('ascii') if encoded else data,
+        }
+
+    def create(self, task_data):
+        return self.create_many([task_data])[0][0]
+
+    def create_many(self, tasks_data):
+        hashes = [payload_hash(task_data) for task_data in tasks_data]
+        # Le ripetizioni vengono riconosciute prima di decodificare gli allegati
+        try:
+            replays = self._replays(self._store.connection(), tasks_data, hashes)
+        except TaskConflict:
+            for task_data in tasks_data:
+                self._release_staged(task_data)
+            raise
+        decoded = {}
+        try:
+            for index, task_data in enumerate(tasks_data):
+                if index not in replays:
+                    decoded[index] = [self._decode(blob) for blob in task_data.get('blobs') or []]
+        finally:
+            # I contenuti sono già copiati: gli allegati in staging si rilasciano tutti,
+            # anche quelli non ancora letti quando un allegato non valido interrompe il batch
+            for task_data in tasks_data:
+                self._release_staged(task_data)
+        # Una sola transazione per tutto il batch, con una nuova verifica per le create concorrenti
+        with self._store.write() as conn:
+            replays = self._replays(conn, tasks_data, hashes)
+            for index, blobs in decoded.items():
+                if index not in replays:
+                    self._insert(conn, tasks_data[index], blobs, hashes[index])
+        result = []
+        for index, task_data in enumerate(tasks_data):
+            source = replays.get(index, index)
+            if isinstance(source, int):
+                result.append(({'uuid': task_data['uuid'], 'msg': tasks_data[source]['msg'], 'done': False,
+                                'msgresponse': ''}, source == index))
+            else:
+                result.append((source, False))
+        return result
+
+    def _replays(self, conn: sqlite3.Connection, tasks_data: list, hashes: list[str]) -> dict:
+        """Come InMemoryTaskRepository._replays, con le task esistenti come dict."""
+        first_index = {}
+        replays = {}
+        for index, (task_data, digest) in enumerate(zip(tasks_data, hashes)):
+            task_id = task_data['uuid']
+            row = conn.execute('SELECT uuid, msg, done, msgresponse, payload_hash FROM tasks '
+                               'WHERE client_id = ? AND uuid = ?', (self._client_id, task_id)).fetchone()
+            if row is not None:
+                if row[4] not in (None, digest):
+                    raise TaskConflict(task_id)
+                replays[index] = self._to_dict(row)
+            elif task_id in first_index:
+                if hashes[first_index[task_id]] != digest:
+                    raise TaskConflict(task_id)
+                replays[index] = first_index[task_id]
+            else:
+                first_index[task_id] = index
+        return replays
+
+    def _insert(self, conn: sqlite3.Connection, task_data, blobs: list[tuple[str, bytes, str]], digest: str):
+        refs = [[blob_digest, len(data), header] for blob_digest, data, header in blobs]
+        for blob_digest, data, _ in blobs:
+            self._incref(conn, blob_digest, data)
+        conn.execute(
+            'INSERT INTO tasks (client_id, uuid, msg, msgresponse, done, file_structures, blobs, due_at, version, '
+            'payload_hash) VALUES (?, ?, ?, \'\', 0, ?, ?, ?, ?, ?)',
+            (self._client_id, task_data['uuid'], task_data['msg'],
+             json.dumps(task_data.get('fileStructures') or []), json.dumps(refs), task_data.get('dueAt'),
+             self._next_version(conn), digest))
+        conn.execute('DELETE FROM tombstones WHERE client_id = ? AND uuid = ?',
+                     (self._client_id, task_data['uuid']))
+
+    def get_status(self, task_ids):
+        result = dict.fromkeys(task_ids)
+        ids = list(result)
+        conn = self._store.connection()
+        # Query a blocchi per restare sotto il limite di parametri di SQLite
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(
+                f'SELECT uuid, msg, done, msgresponse FROM tasks WHERE client_id = ? '
+                f'AND uuid IN ({", ".join("?" * len(chunk))})', (self._client_id, *chunk)).fetchall()
+            for row in rows:
+                result[row[0]] = status_of(self._to_dict(row))
+        return result
+
+    def update(self, task_id, task_data):
+        try:
+            blobs = [self._decode(blob) for blob in task_data.get('blobs') or []] if 'blobs' in task_data else None
+        finally:
+            self._release_staged(task_data)
+        with self._store.write() as conn:
+            row = conn.execute(
+                'SELECT uuid, msg, done, msgresponse, file_structures, blobs FROM tasks '
+                'WHERE client_id = ? AND uuid = ?', (self._client_id, task_id)).fetchone()
+            if row is None:
+                return None
+            msg = task_data.get('msg', row[1])
+            msgresponse = task_data.get('msgresponse', row[3])
+            done = bool(task_data.get('done', bool(row[2])))
+            file_structures = row[4]
+            if 'fileStructures' in task_data:
+                file_structures = json.dumps(task_data.get('fileStructures') or [])
+            refs = row[5]
+            if blobs is not None:
+                for digest, data, _ in blobs:
+                    self._incref(conn, digest, data)
+                self._decref_all(conn, json.loads(row[5]))
+                refs = json.dumps([[digest, len(data), header] for digest, data, header in blobs])
+            conn.execute(
+                'UPDATE tasks SET msg = ?, msgresponse = ?, done = ?, file_structures = ?, blobs = ?, version = ? '
+                'WHERE client_id = ? AND uuid = ?',
+                (msg, msgresponse, int(done), file_structures, refs, self._next_version(conn),
+                 self._client_id, task_id))
+        return {'uuid': task_id, 'msg': msg, 'done': done, 'msgresponse': msgresponse}
+
+    def delete(self, task_id):
+        return self.delete_many([task_id])[task_id]
+
+    def delete_many(self, task_ids):
+        result = {}
+        with self._store.write() as conn:
+            for task_id in task_ids:
+                row = conn.execute('SELECT blobs FROM tasks WHERE client_id = ? AND uuid = ?',
+                                   (self._client_id, task_id)).fetchone()
+                result[task_id] = row is not None
+                if row is not None:
+                    conn.execute('DELETE FROM tasks WHERE client_id = ? AND uuid = ?', (self._client_id, task_id))
+                    self._add_tombstone(conn, task_id)
+                    self._decref_all(conn, json.loads(row[0]))
+        return result
+
+    def wait_done(self, task_id, timeout):
+        return self._poll(task_id, lambda task: task['done'], timeout)
+
+    def wait_response(self, task_id, offset, timeout):
+        return self._poll(task_id, lambda task: task['done'] or len(task['msgresponse']) > offset, timeout)
+
+    def _poll(self, task_id, predicate, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            task = self.get_by_id(task_id)
+            remaining = deadline - time.monotonic()
+            if task is None or predicate(task) or remaining <= 0:
+                return task
+            time.sleep(min(self.WAIT_POLL_INTERVAL, remaining))
+
+    def get_prompts(self, task_ids):
+        result = dict.fromkeys(task_ids)
+        ids = list(result)
+        conn = self._store.connection()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(
+                f'SELECT uuid, msg, blobs FROM tasks WHERE client_id = ? '
+                f'AND uuid IN ({", ".join("?" * len(chunk))})', (self._client_id, *chunk)).fetchall()
+            for row in rows:
+                result[row[0]] = {'msg': row[1], 'digests': [ref[0] for ref in json.loads(row[2])]}
+        return result
+
+    def begin_response(self, task_id, stale_before=None):
+        lease = '' if stale_before is None else ' AND (due_at IS NULL OR due_at < ?)'
+        with self._store.write() as conn:
+            # Presa in carico atomica: due_at fa da lease (lo rinnova ogni chunk), quindi
+            # due worker che riprendono la stessa task non generano due volte e una
+            # task già done non riparte mai
+            claimed = conn.execute(
+                'UPDATE tasks SET msgresponse = \'\', due_at = ? WHERE client_id = ? AND uuid = ? AND done = 0'
+                + lease, (time.time(), self._client_id, task_id)
+                + (() if stale_before is None else (stale_before,))).rowcount
+            if claimed != 1:
+                return None
+            conn.execute('UPDATE tasks SET version = ? WHERE client_id = ? AND uuid = ?',
+                         (self._next_version(conn), self._client_id, task_id))
+            row = conn.execute('SELECT msg, blobs FROM tasks WHERE client_id = ? AND uuid = ?',
+                               (self._client_id, task_id)).fetchone()
+        return {'msg': row[0], 'digests': [ref[0] for ref in json.loads(row[1])]}
+
+    def append_response(self, task_id, chunk, done=False):
+        with self._store.write() as conn:
+            updated = conn.execute(
+                'UPDATE tasks SET msgresponse = msgresponse || ?, done = done OR ?, due_at = ?, version = ? '
+                'WHERE client_id = ? AND uuid = ?',
+                (chunk, int(done), time.time(), self._next_version(conn), self._client_id, task_id)).rowcount
+        return self.get_by_id(task_id) if updated else None
+
+    def _add_tombstone(self, conn: sqlite3.Connection, task_id: str):
+        conn.execute('INSERT OR REPLACE INTO tombstones (client_id, uuid, version) VALUES (?, ?, ?)',
+                     (self._client_id, task_id, self._next_version(conn)))
+        # Oltre MAX_TOMBSTONES si scartano i più vecchi alzando la versione minima servibile
+        dropped = conn.execute(
+            'SELECT version FROM tombstones WHERE client_id = ? ORDER BY version DESC LIMIT 1 OFFSET ?',
+            (self._client_id, MAX_TOMBSTONES)).fetchone()
+        if dropped is not None:
+            conn.execute('DELETE FROM tombstones WHERE client_id = ? AND version <= ?', (self._client_id, dropped[0]))
+            conn.execute('UPDATE client_versions SET floor = ? WHERE client_id = ?', (dropped[0], self._client_id))
+
+    # Gestione allegati
+
+    def _decode(self, blob) -> tuple[str, bytes, str]:
+        if isinstance(blob, BlobRef):
+            # Il riferimento in staging lo rilascia il chiamante (_release_staged)
+            data = self._staging.get(blob.digest)
+            if data is None:
+                raise ValueError("Allegato non più disponibile")
+            return blob.digest, data, blob.header
+        if not isinstance(blob, str):
+            raise ValueError("Il blob deve essere una stringa base64")
+        header, payload = InMemoryBlobStore._split_data_url(blob)
+        data = base64.b64decode(payload, validate=True)
+        return hashlib.sha256(data).hexdigest(), data, header
+
+    def _release_staged(self, task_data: dict):
+        for blob in task_data.get('blobs') or []:
+            if isinstance(blob, BlobRef):
+                self._staging.release(blob.digest)
+
+    def _encode(self, ref) -> str | None:
+        digest, _, header = ref
+        data = self._blob_data(digest)
+        return header + base64.b64encode(data).decode('ascii') if data is not None else None
+
+    def _blob_data(self, digest: str) -> bytes | None:
+        row = self._store.connection().execute('SELECT data FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    @staticmethod
+    def _incref(conn: sqlite3.Connection, digest: str, data: bytes):
+        conn.execute('INSERT INTO blobs (digest, data, refs) VALUES (?, ?, 1) '
+                     'ON CONFLICT (digest) DO UPDATE SET refs = refs + 1', (digest, data))
+
+    @staticmethod
+    def _decref_all(conn: sqlite3.Connection, refs: list):
+        for digest, _, _ in refs:
+            conn.execute('UPDATE blobs SET refs = refs - 1 WHERE digest = ?', (digest,))
+            conn.execute('DELETE FROM blobs WHERE digest = ? AND refs <= 0', (digest,))
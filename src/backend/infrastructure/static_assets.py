@@ -0,0 +1,169 @@
+# INFRASTRUCTURE / STATIC ASSETS
+# Statici del frontend (build Vite in dist/) serviti da un manifest costruito
+# all'avvio: per ogni file il tipo, l'ETag forte (digest del contenuto) e le
+# varianti precompresse .br/.gz presenti accanto all'originale. Le richieste
+# non fanno stat: si sceglie la variante con Accept-Encoding e, con
+# If-None-Match invariato, si risponde 304 consultando solo il manifest.
+# I file con l'hash nel nome (assets/index-AbC123xy.js) non cambiano mai:
+# Cache-Control immutable per un anno; gli altri (index.html) si rivalidano.
+#
+# Le varianti compresse si generano al build (vedi Dockerfile), non a runtime:
+#   python -m src.backend.infrastructure.static_assets <dist>
+# (.gz sempre, .br se è installato il pacchetto opzionale brotli)
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # opzionale: senza brotli si generano solo le varianti .gz
+
+# Varianti in ordine di preferenza: (content-coding, estensione)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Tipi che vale la pena comprimere e dimensione minima
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'application/manifest+json', 'image/svg+xml', 'application/wasm')
+MIN_COMPRESS_BYTES = 1024
+# Nome con hash di contenuto generato da Vite: [name]-[hash].[ext] sotto assets/
+HASHED_NAME = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+
+
+class StaticVariant:
+    """Una rappresentazione del file: identity o una codifica precompressa."""
+    __slots__ = ('encoding', 'path', 'size', 'etag')
+
+    def __init__(self, encoding: str | None, path: str, size: int, etag: str):
+        self.encoding = encoding
+        self.path = path
+        self.size = size
+        self.etag = etag
+
+
+class StaticAsset:
+    """Voce del manifest: tipo, Cache-Control e varianti (None = identity)."""
+    __slots__ = ('mimetype', 'cache_control', 'variants')
+
+    def __init__(self, mimetype: str, cache_control: str, variants: dict):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.variants = variants
+
+    def select(self, accept_encodings) -> StaticVariant:
+        """Variante più compatta accettata dal client (accept_encodings: quality per codifica)."""
+        for encoding, _ in ENCODINGS:
+            variant = self.variants.get(encoding)
+            if variant is not None and accept_encodings[encoding] > 0:
+                return variant
+        return self.variants[None]
+
+    @property
+    def negotiated(self) -> bool:
+        """True se la risposta dipende da Accept-Encoding (serve Vary)."""
+        return len(self.variants) > 1
+
+
+class StaticAssets:
+    """
+    Manifest dei file di directory, costruito una volta: i file aggiunti o
+    modificati dopo l'avvio richiedono un riavvio (il build è immutabile).
+    get(path) ritorna lo StaticAsset o None; fallback è il file servito per le
+    route del frontend (SPA) che non corrispondono a un file.
+    """
+    def __init__(self, directory: str, fallback: str = 'index.html'):
+        self.directory = directory
+        self.fallback = fallback
+        self._assets: dict[str, StaticAsset] = {}
+        if os.path.isdir(directory):
+            self._scan()
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            names = set(files)
+            for name in files:
+                if any(name.endswith(suffix) and name[:-len(suffix)] in names for _, suffix in ENCODINGS):
+                    continue  # variante di un altro file
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                self._assets[relative] = self._entry(relative, path, names)
+
+    @staticmethod
+    def _entry(relative: str, path: str, names: set) -> StaticAsset:
+        digest = _file_digest(path)
+        variants = {None: StaticVariant(None, path, os.path.getsize(path), digest)}
+        for encoding, suffix in ENCODINGS:
+            if os.path.basename(path) + suffix in names:
+                compressed = path + suffix
+                size = os.path.getsize(compressed)
+                # Le rappresentazioni hanno ETag forti distinti
+                if size < variants[None].size:
+                    variants[encoding] = StaticVariant(encoding, compressed, size, f'{digest}-{suffix[1:]}')
+        mimetype = mimetypes.guess_type(relative)[0] or 'application/octet-stream'
+        cache_control = CACHE_IMMUTABLE if HASHED_NAME.match(relative) else CACHE_REVALIDATE
+        return StaticAsset(mimetype, cache_control, variants)
+
+    def get(self, path: str) -> StaticAsset | None:
+        return self._assets.get(path)
+
+    def stats(self) -> dict:
+        return {"files": len(self._assets),
+                "precompressed": sum(1 for asset in self._assets.values() if asset.negotiated)}
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compressible(path: str) -> bool:
+    mimetype = mimetypes.guess_type(path)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES) and os.path.getsize(path) >= MIN_COMPRESS_BYTES
+
+
+def precompress(directory: str) -> list[tuple[str, int, dict]]:
+    """
+    Scrive accanto ai file comprimibili le varianti .gz (e .br con brotli),
+    solo se più piccole dell'originale. Ritorna (file, byte, {codifica: byte}).
+    """
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            path = os.path.join(root, name)
+            if not _compressible(path):
+                continue
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            encoded = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                encoded['.br'] = brotli.compress(data, quality=11)
+            sizes = {}
+            for suffix, payload in encoded.items():
+                if len(payload) < len(data):
+                    with open(path + suffix, 'wb') as out:
+                        out.write(payload)
+                    sizes[suffix[1:]] = len(payload)
+            written.append((os.path.relpath(path, directory), len(data), sizes))
+    return written
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit("Uso: python -m src.backend.infrastructure.static_assets <dist>")
+    if brotli is None:
+        print("brotli non installato: solo varianti .gz")
+    for name, size, sizes in precompress(sys.argv[1]):
+        print(f"{name}: {size} byte -> " + ', '.join(f'{encoding} {value}' for encoding, value in sizes.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# INFRASTRUCTURE / UPLOAD
+# Ingest in streaming di una task inviata come multipart/form-data.
+# I metadati (uuid, msg, fileStructures) devono precedere i file: vengono
+# validati prima di leggere i payload, e ogni parte file viene scritta nel
+# blob store un chunk alla volta, senza mai materializzarla in memoria.
+import json
+import os
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from src.backend.infrastructure.blobstore import BlobTooLarge, InMemoryBlobStore
+
+CHUNK_SIZE = 64 * 1024
+# Limiti configurabili: per singolo file e per l'intera richiesta
+MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", 25 * 1024 * 1024))
+MAX_REQUEST_BYTES = int(os.environ.get("UPLOAD_MAX_REQUEST_BYTES", 100 * 1024 * 1024))
+# Dimensione massima dei campi testuali (metadati), tenuti in memoria
+MAX_FIELD_BYTES = 1024 * 1024
+
+METADATA_FIELDS = ('uuid', 'msg', 'fileStructures')
+
+
+class UploadError(Exception):
+    """Richiesta multipart non valida: status HTTP e messaggio per il client."""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def read_multipart_task(stream, boundary: str, content_length: int | None,
+                        blob_store: InMemoryBlobStore) -> dict:
+    """
+    Legge una task multipart da stream e ritorna
+    {'uuid', 'msg', 'fileStructures', 'blobs'} dove blobs sono BlobRef già
+    archiviati (da adottare con repository.create). Solleva UploadError.
+    Campi attesi: uuid, msg, fileStructures (JSON, opzionale) e poi le parti
+    file (qualsiasi nome); senza fileStructures si usano filename e Content-Type.
+    """
+    if content_length is not None and content_length > MAX_REQUEST_BYTES:
+        raise UploadError(413, f"Richiesta oltre il limite di {MAX_REQUEST_BYTES} byte")
+
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=MAX_FIELD_BYTES)
+    fields: dict[str, str] = {}
+    structures: list | None = None
+    derived_structures: list[dict] = []
+    refs = []
+    field_name, field_buf = None, None
+    writer = None
+    received = 0
+    eof = False
+
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = stream.read(CHUNK_SIZE)
+                received += len(chunk)
+                if received > MAX_REQUEST_BYTES:
+                    raise UploadError(413, f"Richiesta oltre il limite di {MAX_REQUEST_BYTES} byte")
+                if not chunk and eof:
+                    raise UploadError(400, "Corpo multipart troncato")
+                eof = not chunk
+                decoder.receive_data(chunk or None)
+                continue
+            if isinstance(event, Field):
+                if structures is not None and event.name in METADATA_FIELDS:
+                    raise UploadError(400, f"Campo '{event.name}' deve precedere i file")
+                field_name, field_buf = event.name, []
+            elif isinstance(event, File):
+                if structures is None:
+                    structures = _validate_metadata(fields)
+                if structures and len(refs) >= len(structures):
+                    raise UploadError(400, "La lunghezza di 'fileStructures' e dei file deve coincidere")
+                content_type = event.headers.get('Content-Type') or 'application/octet-stream'
+                derived_structures.append({'filename': event.filename or '', 'contentType': content_type})
+                writer = blob_store.writer(header=f"data:{content_type};base64,", max_size=MAX_FILE_BYTES)
+            elif isinstance(event, Data):
+                if writer is not None:
+                    writer.write(event.data)
+                    if not event.more_data:
+                        refs.append(writer.commit())
+                        writer = None
+                elif field_name is not None:
+                    field_buf.append(event.data)
+                    if not event.more_data:
+                        fields[field_name] = b''.join(field_buf).decode('utf-8')
+                        field_name, field_buf = None, None
+            elif isinstance(event, Epilogue):
+                break
+    except BlobTooLarge as exc:
+        writer = None
+        _release(blob_store, refs)
+        raise UploadError(413, str(exc))
+    except UploadError:
+        _release(blob_store, refs)
+        raise
+    except ValueError:
+        # Errori di parsing del decoder multipart o di decodifica UTF-8
+        _release(blob_store, refs)
+        raise UploadError(400, "Corpo multipart non valido")
+    finally:
+        if writer is not None:
+            writer.abort()
+
+    if structures is None:
+        structures = _validate_metadata(fields)
+    if structures and len(structures) != len(refs):
+        _release(blob_store, refs)
+        raise UploadError(400, "La lunghezza di 'fileStructures' e dei file deve coincidere")
+
+    return {
+        'uuid': fields['uuid'],
+        'msg': fields['msg'],
+        'fileStructures': structures or derived_structures,
+        'blobs': refs,
+    }
+
+
+def _validate_metadata(fields: dict) -> list:
+    if not fields.get('uuid'):
+        raise UploadError(400, "Campo 'uuid' obbligatorio (prima dei file)")
+    if not fields.get('msg'):
+        raise UploadError(400, "Campo 'msg' obbligatorio (prima dei file)")
+    raw = fields.get('fileStructures')
+    if not raw:
+        return []
+    try:
+        structures = json.loads(raw)
+    except ValueError:
+        raise UploadError(400, "Campo 'fileStructures' deve essere un array JSON")
+    if not isinstance(structures, list):
+        raise UploadError(400, "Campo 'fileStructures' deve essere un array")
+    return structures
+
+
+def _release(blob_store: InMemoryBlobStore, refs: list):
+    for ref in refs:
+        blob_store.release(ref.digest)
@@ -0,0 +1,103 @@
+# SERVICE LAYER / ADMISSION CONTROL
+# Backpressure sui completamenti: ogni task creata occupa un posto finché il
+# job di completamento non è terminato. Il numero di posti è limitato sia in
+# totale (profondità della coda di lavoro) sia per client, così una sessione
+# rumorosa non può affamare le altre. Oltre i limiti la creazione viene
+# rifiutata subito invece di accodare lavoro che arriverebbe in ritardo.
+# Il lavoro batch (import dello storico, replay) ha una quota per client
+# separata: un import completo non blocca i messaggi interattivi successivi.
+import math
+import os
+import threading
+
+# Limiti configurabili: completamenti in sospeso in totale e per client
+MAX_PENDING = int(os.environ.get("COMPLETION_QUEUE_DEPTH", 10000))
+MAX_CLIENT_INFLIGHT = int(os.environ.get("CLIENT_MAX_INFLIGHT", 100))
+MAX_CLIENT_BATCH_INFLIGHT = int(os.environ.get("CLIENT_MAX_BATCH_INFLIGHT", 1000))
+
+
+class Overloaded(Exception):
+    """Richiesta rifiutata per saturazione: status HTTP (429/503), messaggio e Retry-After in secondi."""
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    Contatori dei completamenti in sospeso (totali e per client_id, con quote
+    per client distinte per il lavoro interattivo e per quello batch).
+    - admit() riserva i posti o solleva Overloaded: 429 se è il client ad aver
+      superato il proprio limite, 503 se è piena la coda globale (comune),
+    - release() libera i posti a completamento avvenuto,
+    - retry_after è una funzione che stima dopo quanti secondi riprovare.
+    """
+    def __init__(self, max_pending: int = MAX_PENDING, max_per_client: int = MAX_CLIENT_INFLIGHT,
+                 retry_after=None, max_batch_per_client: int = MAX_CLIENT_BATCH_INFLIGHT):
+        self._max_pending = max_pending
+        self._max_per_client = max_per_client
+        self._max_batch_per_client = max_batch_per_client
+        self._retry_after = retry_after or (lambda: 1.0)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._by_client: dict[str, int] = {}
+        self._batch_by_client: dict[str, int] = {}
+        self.admitted = 0
+        self.rejected_client = 0
+        self.rejected_global = 0
+
+    def _check(self, client_id: str, count: int, batch: bool):
+        """Solleva Overloaded se count nuovi posti non sono disponibili (sotto il lock)."""
+        by_client, limit = self._quota(batch)
+        if by_client.get(client_id, 0) + count > limit:
+            self.rejected_client += 1
+            raise Overloaded(429, f"Troppe attività in corso per questa sessione (massimo {limit})",
+                             self._retry_after_seconds())
+        if self._pending + count > self._max_pending:
+            self.rejected_global += 1
+            raise Overloaded(503, "Servizio saturo, riprovare più tardi", self._retry_after_seconds())
+
+    def _retry_after_seconds(self) -> int:
+        return max(1, math.ceil(self._retry_after()))
+
+    def _quota(self, batch: bool) -> tuple[dict[str, int], int]:
+        return (self._batch_by_client, self._max_batch_per_client) if batch \
+            else (self._by_client, self._max_per_client)
+
+    def check(self, client_id: str, count: int = 1, batch: bool = False):
+        """Come admit ma senza riservare i posti (es. prima di leggere un upload)."""
+        with self._lock:
+            self._check(client_id, count, batch)
+
+    def admit(self, client_id: str, count: int = 1, batch: bool = False):
+        with self._lock:
+            self._check(client_id, count, batch)
+            by_client, _ = self._quota(batch)
+            self._pending += count
+            by_client[client_id] = by_client.get(client_id, 0) + count
+            self.admitted += count
+
+    def release(self, client_id: str, count: int = 1, batch: bool = False):
+        with self._lock:
+            by_client, _ = self._quota(batch)
+            remaining = by_client.get(client_id, 0) - count
+            if remaining > 0:
+                by_client[client_id] = remaining
+            else:
+                by_client.pop(client_id, None)
+            self._pending = max(0, self._pending - count)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "maxPending": self._max_pending,
+                "maxPerClient": self._max_per_client,
+                "maxBatchPerClient": self._max_batch_per_client,
+                "clients": len(self._by_client.keys() | self._batch_by_client.keys()),
+                "admitted": self.admitted,
+                "rejectedClient": self.rejected_client,
+                "rejectedGlobal": self.rejected_global,
+            }
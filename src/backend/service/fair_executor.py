@@ -0,0 +1,119 @@
+# SERVICE LAYER / FAIR EXECUTOR
+# Livello tra lo scheduler e il pool di worker: i job scaduti non finiscono in
+# un'unica coda FIFO ma in una coda per client, servita a turno (round-robin).
+# Un client che invia centinaia di messaggi occupa un turno come tutti gli
+# altri, quindi le risposte delle sessioni leggere non si accodano dietro le sue.
+# Due classi di priorità: interattiva (messaggi della chat) e batch (replay,
+# job di sistema); la batch riceve comunque un turno ogni INTERACTIVE_SHARE.
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+
+from src.backend.infrastructure.metrics import METRICS
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+# Job interattivi serviti al massimo di seguito prima di un job batch in attesa
+INTERACTIVE_SHARE = 4
+
+# Job rimasti in attesa (tutte le classi) dopo ogni submit
+QUEUE_DEPTH = METRICS.histogram(
+    'chatbot_executor_queue_depth', 'Job in attesa nel fair executor dopo ogni submit',
+    (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000))
+
+
+class FairExecutor:
+    """
+    Dispatcher equo sopra un Executor:
+    - submit_for(key, priority, fn, *args) accoda il job nella coda del client key,
+    - al pool arrivano al massimo max_in_flight job alla volta: ogni worker, finito
+      un job, prende il successivo scelto per priorità e a turno tra i client,
+    - submit(fn, *args) è compatibile con Executor (job di sistema, classe batch).
+    Le code per client sono limitate a monte dal controllo di ammissione
+    (CLIENT_MAX_INFLIGHT): qui non si rifiuta lavoro già accettato.
+    """
+    def __init__(self, executor: Executor, max_in_flight: int):
+        self._executor = executor
+        self._max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        # Per classe: client in attesa nell'ordine di turno -> coda dei suoi job
+        self._rings: dict[int, OrderedDict] = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BATCH: OrderedDict()}
+        self._queued = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._interactive_streak = 0
+        self._in_flight = 0
+        self.dispatched = 0
+
+    def submit(self, fn, *args):
+        self.submit_for(None, PRIORITY_BATCH, fn, *args)
+
+    def submit_for(self, key, priority: int, fn, *args):
+        with self._lock:
+            ring = self._rings[priority]
+            queue = ring.get(key)
+            if queue is None:
+                queue = ring[key] = deque()
+            queue.append((fn, args))
+            self._queued[priority] += 1
+            job = None
+            if self._in_flight < self._max_in_flight:
+                self._in_flight += 1
+                job = self._next()
+            depth = self._queued[PRIORITY_INTERACTIVE] + self._queued[PRIORITY_BATCH]
+        QUEUE_DEPTH.observe(depth)
+        if job is None:
+            return
+        try:
+            self._executor.submit(self._work, *job)
+        except RuntimeError:
+            # Pool già chiuso: il job resta in coda, lo slot viene liberato
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+    def _next(self):
+        """Prossimo job (sotto il lock): sceglie la classe, poi il primo client del turno."""
+        interactive = self._queued[PRIORITY_INTERACTIVE]
+        batch = self._queued[PRIORITY_BATCH]
+        if interactive and (not batch or self._interactive_streak < INTERACTIVE_SHARE):
+            priority = PRIORITY_INTERACTIVE
+            self._interactive_streak += 1
+        elif batch:
+            priority = PRIORITY_BATCH
+            self._interactive_streak = 0
+        else:
+            return None
+        ring = self._rings[priority]
+        key, queue = next(iter(ring.items()))
+        job = queue.popleft()
+        # Il client torna in fondo al turno se ha altri job, altrimenti esce
+        del ring[key]
+        if queue:
+            ring[key] = queue
+        self._queued[priority] -= 1
+        self.dispatched += 1
+        return job
+
+    def _work(self, fn, args):
+        # Il worker resta sul dispatcher finché c'è lavoro in coda
+        while True:
+            try:
+                fn(*args)
+            except Exception:
+                # Un job fallito non deve fermare il worker
+                pass
+            with self._lock:
+                job = self._next()
+                if job is None:
+                    self._in_flight -= 1
+                    return
+            fn, args = job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "inFlight": self._in_flight,
+                "queuedInteractive": self._queued[PRIORITY_INTERACTIVE],
+                "queuedBatch": self._queued[PRIORITY_BATCH],
+                "waitingClients": len(self._rings[PRIORITY_INTERACTIVE]) + len(self._rings[PRIORITY_BATCH]),
+                "dispatched": self.dispatched,
+            }
@@ -0,0 +1,42 @@
+# SERVICE LAYER / RESPONSE GENERATOR
+# Backend che produce la risposta del bot, guidato dal servizio. La risposta
+# arriva come sequenza di chunk: ogni chunk viene aggiunto alla task appena
+# prodotto, così i client vedono la risposta parziale prima di done e
+# l'attesa percepita diventa il tempo al primo chunk.
+from typing import Iterator
+
+# Testo della risposta simulata (il chatbot reale non è ancora collegato)
+MOCKED_RESPONSE = "This is a mocked response from the chatbot. The task has been processed successfully and here's the simulated AI response to your question."
+
+
+class ResponseGenerator:
+    """
+    Interfaccia dei generatori di risposte.
+    generate() ritorna un iteratore di chunk di testo: il servizio chiede un
+    chunk per volta in un job dello scheduler, quindi un backend remoto può
+    bloccarsi sull'I/O di rete in next() senza occupare un worker tra un chunk
+    e l'altro più del necessario.
+    """
+    # Pausa tra un chunk e il successivo, affidata allo scheduler (non a una sleep)
+    chunk_interval = 0.0
+
+    def generate(self, prompt: str, attachments: list[str]) -> Iterator[str]:
+        """prompt è il messaggio dell'utente, attachments i digest SHA-256 degli allegati."""
+        raise NotImplementedError
+
+
+class MockResponseGenerator(ResponseGenerator):
+    """
+    Generatore locale deterministico (sviluppo e test): stesso prompt, stessi
+    chunk. Restituisce MOCKED_RESPONSE seguita dalla domanda, words_per_chunk
+    parole alla volta ogni chunk_interval secondi.
+    """
+    def __init__(self, chunk_interval: float = 0.05, words_per_chunk: int = 3):
+        self.chunk_interval = chunk_interval
+        self._words_per_chunk = words_per_chunk
+
+    def generate(self, prompt: str, attachments: list[str]) -> Iterator[str]:
+        words = (MOCKED_RESPONSE + ' For question ' + prompt).split(' ')
+        for start in range(0, len(words), self._words_per_chunk):
+            chunk = ' '.join(words[start:start + self._words_per_chunk])
+            yield chunk if start + self._words_per_chunk >= len(words) else chunk + ' '
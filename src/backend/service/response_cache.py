@@ -0,0 +1,137 @@
+# SERVICE LAYER / RESPONSE CACHE
+# Cache delle risposte davanti al generatore. La chiave è il messaggio
+# normalizzato più i digest (SHA-256) degli allegati: la stessa domanda sugli
+# stessi PDF, anche da sessioni diverse, riceve subito la risposta già prodotta.
+# Le generazioni in corso sono condivise (single-flight): richieste identiche
+# concorrenti seguono la stessa generazione invece di avviarne un'altra.
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Limiti configurabili: byte totali delle risposte (0 disattiva la cache), voci e TTL
+CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 10000))
+CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 3600))
+
+
+def cache_key(msg: str, digests: list[str]) -> str:
+    """Chiave della cache: messaggio normalizzato (Unicode NFKC, spazi, maiuscole) e allegati."""
+    normalized = ' '.join(unicodedata.normalize('NFKC', msg).split()).casefold()
+    return hashlib.sha256('\0'.join([normalized, *digests]).encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """
+    Generazione in corso per una chiave: il leader produce i chunk, i follower
+    (task identiche arrivate nel frattempo) li ricevono sotto lo stesso lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunks: list[str] = []
+        self.followers: list = []
+        self.finished = False
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.chunks)
+
+
+class ResponseCache:
+    """
+    Cache LRU con TTL e limite in byte/voci, più la tabella delle generazioni in corso.
+    - get(key) ritorna la risposta o None (conta hit e miss),
+    - join(key) ritorna (flight, True) al primo richiedente, che diventa leader,
+      e (flight, False) agli altri, che la seguono; se nel frattempo la risposta
+      è entrata in cache il flight è già concluso (nessuna nuova generazione),
+    - finish(key, text) chiude la generazione e, se text non è None, la memorizza.
+    """
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl: float = CACHE_TTL_SECONDS):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (risposta, scadenza monotonic), dalla meno recente
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._flights: dict[str, Flight] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0 and self._max_entries > 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            text = self._fresh(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return text
+
+    def join(self, key: str) -> tuple[Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                # Generazione identica conclusa dopo il miss del chiamante
+                text = self._fresh(key)
+                if text is not None:
+                    flight = Flight()
+                    flight.chunks.append(text)
+                    flight.finished = True
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def _fresh(self, key: str) -> str | None:
+        """Risposta in cache non scaduta (sotto il lock), senza contarla nelle statistiche."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def finish(self, key: str, text: str | None):
+        with self._lock:
+            self._flights.pop(key, None)
+            size = len(text.encode('utf-8')) if text is not None else 0
+            if text is None or size > self._max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (text, time.monotonic() + self._ttl)
+            self._bytes += size
+            # Eviction LRU fino a rientrare nei limiti
+            while self._bytes > self._max_bytes or len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        text, _ = self._entries.pop(key)
+        self._bytes -= len(text.encode('utf-8'))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "inFlight": len(self._flights),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,119 @@
+# SERVICE LAYER / SCHEDULER
+# Scheduler a min-heap per i job differiti del servizio: un solo thread tiene
+# le scadenze e consegna al pool di worker solo i job già scaduti.
+# Migliaia di completamenti in attesa costano memoria, non thread.
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Executor
+
+
+class TimerScheduler:
+    """
+    Scheduler di job differiti:
+    - schedule(delay, fn, *args) registra il job nel min-heap delle scadenze,
+    - un thread dedicato dorme fino alla prossima scadenza,
+    - i job scaduti vengono eseguiti sull'executor passato nel costruttore.
+    Il thread viene avviato al primo schedule (sicuro con fork/preload).
+    key e priority (client e classe del job) vengono passati all'executor se
+    questo espone submit_for, come FairExecutor.
+    """
+    def __init__(self, executor: Executor, name: str = "task-scheduler"):
+        self._executor = executor
+        self._name = name
+        self._heap: list[tuple[float, int, object, tuple, object, int | None]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        # Metriche: job consegnati all'executor ma non ancora avviati e ritardo
+        # tra scadenza e avvio effettivo (media mobile esponenziale e massimo)
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._executed = 0
+        self._lag_avg = 0.0
+        self._lag_max = 0.0
+
+    def schedule(self, delay: float, fn, *args, key=None, priority: int | None = None) -> None:
+        deadline = time.monotonic() + max(0.0, delay)
+        with self._cond:
+            entry = (deadline, next(self._seq), fn, args, key, priority)
+            heapq.heappush(self._heap, entry)
+            self._ensure_started()
+            # Sveglia il thread solo se la nuova scadenza è la più vicina
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def schedule_many(self, jobs, key=None, priority: int | None = None) -> None:
+        """Registra più job (delay, fn, *args) con una sola acquisizione del lock."""
+        now = time.monotonic()
+        with self._cond:
+            head = self._heap[0] if self._heap else None
+            for delay, fn, *args in jobs:
+                heapq.heappush(self._heap, (now + max(0.0, delay), next(self._seq), fn, tuple(args), key, priority))
+            if not self._heap:
+                return
+            self._ensure_started()
+            if self._heap[0] is not head:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self) -> dict:
+        pending = self.pending()
+        with self._stats_lock:
+            return {
+                "pending": pending,
+                "queued": self._queued,
+                "executed": self._executed,
+                "lagAvgSeconds": round(self._lag_avg, 4),
+                "lagMaxSeconds": round(self._lag_max, 4),
+            }
+
+    def lag(self) -> float:
+        """Ritardo medio recente tra scadenza e avvio dei job (secondi)."""
+        return self._lag_avg
+
+    def _execute(self, deadline: float, fn, args: tuple):
+        lag = time.monotonic() - deadline
+        with self._stats_lock:
+            self._queued -= 1
+            self._executed += 1
+            self._lag_avg += (lag - self._lag_avg) * 0.05
+            self._lag_max = max(self._lag_max, lag)
+        fn(*args)
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    timeout = self._heap[0][0] - now
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+            with self._stats_lock:
+                self._queued += len(due)
+            submit_for = getattr(self._executor, 'submit_for', None)
+            for deadline, _, fn, args, key, priority in due:
+                try:
+                    if submit_for is not None and priority is not None:
+                        submit_for(key, priority, self._execute, deadline, fn, args)
+                    else:
+                        self._executor.submit(self._execute, deadline, fn, args)
+                except RuntimeError:
+                    # Executor già chiuso (shutdown del processo)
+                    return
@@ -2,16 +2,50 @@
 # Contiene la logica di business.
 # Non sa nulla dell'implementazione del database, interagisce solo con l'interfaccia del repository.
 import random
-import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 
 
+from src.backend.infrastructure.blobstore import BlobRef
+from src.backend.infrastructure.metrics import METRICS
 from src.backend.infrastructure.repository import TaskRepository
+from src.backend.service.admission import AdmissionControl
+from src.backend.service.fair_executor import PRIORITY_BATCH, PRIORITY_INTERACTIVE, FairExecutor
+from src.backend.service.generator import MockResponseGenerator, ResponseGenerator
+from src.backend.service.response_cache import ResponseCache, cache_key
+from src.backend.service.scheduler import TimerScheduler
 
-# Esecutore thread-pool fisso per i job asincroni dell'app
+# Esecutore thread-pool fisso per i job asincroni dell'app.
+# I job non restano in attesa nei worker: è lo scheduler a consegnarli
+# all'executor solo quando sono scaduti, quindi bastano pochi thread.
 
-EXECUTOR = ThreadPoolExecutor(max_workers=100)
+# Tra scheduler ed executor c'è il dispatcher equo: i job scaduti vengono
+# serviti a turno tra i client, con priorità ai messaggi interattivi.
+
+EXECUTOR_WORKERS = 8
+EXECUTOR = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+FAIR_EXECUTOR = FairExecutor(EXECUTOR, max_in_flight=EXECUTOR_WORKERS)
+SCHEDULER = TimerScheduler(FAIR_EXECUTOR)
+# Backpressure: i completamenti in sospeso sono limitati in totale e per client.
+# Chi viene respinto riprova dopo circa il ritardo medio attuale della coda.
+ADMISSION = AdmissionControl(retry_after=lambda: 1.0 + SCHEDULER.lag())
+# Backend di generazione delle risposte (per ora il generatore simulato)
+GENERATOR: ResponseGenerator = MockResponseGenerator()
+# Cache delle risposte (condivisa tra le sessioni) e generazioni in corso
+RESPONSE_CACHE = ResponseCache()
+# Tempo dalla creazione al completamento delle task create in questo processo
+TIME_TO_DONE = METRICS.histogram(
+    'chatbot_task_time_to_done_seconds', 'Tempo dalla creazione della task a done=True',
+    (0.01, 0.1, 0.5, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 8.0, 10.0, 15.0, 30.0, 60.0, 120.0))
+# (client_id, uuid) -> istante di creazione (monotonic) delle task in generazione
+_CREATED_AT: dict[tuple, float] = {}
+# (client_id, uuid) -> quota di ADMISSION occupata dalla task (True = batch),
+# liberata una sola volta: a generazione conclusa o alla cancellazione
+_SEATS: dict[tuple, bool] = {}
+# Il worker che ha creato la task la prende in carico se due_at è ancora la
+# scadenza pianificata (più questo margine): una presa di recover_overdue l'ha
+# già spostata ad almeno scadenza + grace, e la task non viene generata due volte
+CLAIM_WINDOW = 1.0
 
 
 class TaskServiceSession:
@@ -19,47 +53,287 @@ class TaskServiceSession:
     Servizio con scope di sessione:
     - prende client_id nel costruttore,
     - usa il repository per creare il task,
-    - avvia un job asincrono che dopo X secondi imposta done=True.
+    - pianifica sullo scheduler un job che dopo X secondi avvia la generazione
+      della risposta: i chunk vengono aggiunti alla task uno per job, poi done=True.
+    Con client_id le nuove task passano dal controllo di ammissione (ADMISSION),
+    le interattive e quelle batch su quote separate, e Overloaded viene
+    propagata al chiamante.
+    Le risposte già in RESPONSE_CACHE completano la task subito, senza passare
+    dallo scheduler; le generazioni identiche concorrenti vengono condivise.
     """
-    def __init__(self, repository: TaskRepository):
+    def __init__(self, repository: TaskRepository, client_id: str | None = None,
+                 generator: ResponseGenerator | None = None, cache: ResponseCache | None = None):
         self._repo = repository
+        self._client_id = client_id
+        self._generator = generator or GENERATOR
+        self._cache = cache or RESPONSE_CACHE
 
-    def createTask(self, uuid: str, msg: str, file_structures: list | None = None, blobs: list | None = None) -> dict:
-        created = self._repo.create({
-            "msg": msg,
-            "uuid": uuid,
-            "fileStructures": file_structures or [],
-            "blobs": blobs or []
-        })
+    def createTask(self, uuid: str, msg: str, file_structures: list | None = None,
+                   blobs: list | None = None) -> tuple[dict, bool]:
+        """
+        Crea la task e ne pianifica il completamento; ritorna (task, created).
+        Una create ripetuta con lo stesso uuid e contenuto ritorna la task
+        esistente (created False) senza ripianificare nulla.
+        """
+        created_at = time.monotonic()
+        delay = random.uniform(1.0, 5.5)
+        due_at = time.time() + delay
+        self._admit(1, False)
+        try:
+            created, is_new = self._repo.create_many([{
+                "msg": msg,
+                "uuid": uuid,
+                "fileStructures": file_structures or [],
+                "blobs": blobs or [],
+                # Scadenza persistita dai repository condivisi: se il processo che
+                # ha creato la task muore, un altro worker la completa (recover_overdue)
+                "dueAt": due_at
+            }])[0]
+        except Exception:
+            self._release(1, False)
+            raise
+        if not is_new:
+            self._release(1, False)
+            return created, False
         task_id = created["uuid"]
-        EXECUTOR.submit(self._complete_later, task_id)
-        return created
+        _CREATED_AT[(self._client_id, task_id)] = created_at
+        _SEATS[(self._client_id, task_id)] = False
+        key = self._cache_keys([{"uuid": task_id, "msg": msg, "blobs": blobs}]).get(task_id)
+        missed_key, cached = self._complete_from_cache(task_id, key, due_at + CLAIM_WINDOW)
+        if cached is not None:
+            return cached, True
+        SCHEDULER.schedule(delay, self._complete_later, task_id, PRIORITY_INTERACTIVE,
+                           due_at + CLAIM_WINDOW, missed_key, key=self._client_id, priority=PRIORITY_INTERACTIVE)
+        return created, True
+
+    def createTasks(self, items: list[dict]) -> list[tuple[dict, bool]]:
+        """
+        Variante batch di createTask: items sono dict {uuid, msg, fileStructures?, blobs?};
+        una sola chiamata al repository e una sola allo scheduler per tutto il batch.
+        """
+        created_at = time.monotonic()
+        delays = [random.uniform(1.0, 5.5) for _ in items]
+        now = time.time()
+        # Il batch viene ammesso o respinto per intero, sulla quota batch del client
+        self._admit(len(items), True)
+        try:
+            results = self._repo.create_many([{
+                "msg": item["msg"],
+                "uuid": item["uuid"],
+                "fileStructures": item.get("fileStructures") or [],
+                "blobs": item.get("blobs") or [],
+                "dueAt": now + delay
+            } for item, delay in zip(items, delays)])
+        except Exception:
+            self._release(len(items), True)
+            raise
+        # Le ripetizioni non occupano posti né generano lavoro
+        self._release(sum(1 for _, is_new in results if not is_new), True)
+        keys = self._cache_keys([item for item, (_, is_new) in zip(items, results) if is_new])
+        jobs = []
+        for index, ((task, is_new), delay) in enumerate(zip(results, delays)):
+            if not is_new:
+                continue
+            _CREATED_AT[(self._client_id, task["uuid"])] = created_at
+            _SEATS[(self._client_id, task["uuid"])] = True
+            missed_key, cached = self._complete_from_cache(task["uuid"], keys.get(task["uuid"]),
+                                                           now + delay + CLAIM_WINDOW)
+            if cached is not None:
+                results[index] = (cached, True)
+            else:
+                jobs.append((delay, self._complete_later, task["uuid"], PRIORITY_BATCH,
+                             now + delay + CLAIM_WINDOW, missed_key))
+        # Replay e import sono lavoro batch: non rallentano i messaggi interattivi
+        SCHEDULER.schedule_many(jobs, key=self._client_id, priority=PRIORITY_BATCH)
+        return results
+
+    def _cache_keys(self, items: list[dict]) -> dict:
+        """
+        Chiavi di cache {uuid: chiave} delle task appena create, dal msg e dai
+        digest degli allegati già caricati in streaming (BlobRef). Solo per gli
+        allegati arrivati in base64 i digest si leggono dal repository, con una
+        sola chiamata (get_prompts) per tutte le task.
+        """
+        if not self._cache.enabled:
+            return {}
+        keys, pending = {}, []
+        for item in items:
+            blobs = item.get("blobs") or []
+            if all(isinstance(blob, BlobRef) for blob in blobs):
+                keys[item["uuid"]] = cache_key(item["msg"], [blob.digest for blob in blobs])
+            else:
+                pending.append(item["uuid"])
+        if pending:
+            for task_id, prompt in self._repo.get_prompts(pending).items():
+                if prompt is not None:
+                    keys[task_id] = cache_key(prompt["msg"], prompt["digests"])
+        return keys
+
+    def _complete_from_cache(self, task_id: str, key: str | None,
+                             stale_before: float | None = None) -> tuple[str | None, dict | None]:
+        """
+        Completa subito una task appena creata se la risposta per key è in cache;
+        ritorna (chiave cercata senza esito, task completata). La task viene presa
+        in carico (begin_response) solo in caso di hit; con un miss la chiave passa
+        a _complete_later, che non ripete la ricerca.
+        """
+        if key is None:
+            return None, None
+        answer = self._cache.get(key)
+        if answer is None:
+            return key, None
+        if self._repo.begin_response(task_id, stale_before) is None:
+            return None, None
+        task = self._repo.append_response(task_id, answer, done=True)
+        if task is not None:
+            self._record_done(task_id)
+        self._finish(task_id)
+        return None, task
+
+    def _admit(self, count: int, batch: bool):
+        if self._client_id is not None:
+            ADMISSION.admit(self._client_id, count, batch)
+
+    def _release(self, count: int, batch: bool):
+        if self._client_id is not None and count:
+            ADMISSION.release(self._client_id, count, batch)
 
-    def _complete_later(self, task_id: str):
+    def deleteTasks(self, task_ids: list) -> dict:
+        """
+        Cancella le task (repository.delete_many) e libera subito i loro posti in
+        ADMISSION: il job di completamento, quando arriva, non trova più la task.
+        """
+        deleted = self._repo.delete_many(task_ids)
+        for task_id, ok in deleted.items():
+            if ok:
+                self._finish(task_id)
+        return deleted
+
+    def resumeTask(self, task_id: str):
+        """Ripianifica il completamento di una task già esistente (es. dopo una recovery)."""
         delay = random.uniform(1.0, 5.5)
-        time.sleep(delay)
-        #convert delay to string
-        delaystr = str(delay)
+        SCHEDULER.schedule(delay, self._complete_later, task_id, key=self._client_id, priority=PRIORITY_BATCH)
+
+    def _complete_later(self, task_id: str, priority: int = PRIORITY_BATCH,
+                        stale_before: float | None = None, missed_key: str | None = None):
+        """
+        Avvia la generazione della risposta se la presa in carico riesce
+        (begin_response con stale_before). A generazione conclusa _finish
+        libera l'eventuale posto della task in ADMISSION.
+        Con la cache attiva la task può essere servita dalla cache o accodata
+        come follower di una generazione identica già in corso; missed_key è la
+        chiave già cercata senza esito alla creazione (la ricerca non si ripete).
+        """
         try:
-            self._repo.update(task_id, {"done": True, "msgresponse": "Delay: "+delaystr})
+            prompt = self._repo.begin_response(task_id, stale_before)
         except Exception:
             # Evita crash silenziosi del thread di background
-            pass
-            # Nuovo: recupero asincrono con ritardo opzionale e callback
+            prompt = None
+        if prompt is None:
+            self._finish(task_id)
+            return
+        key, flight = missed_key, None
+        if self._cache.enabled:
+            if key is None:
+                key = cache_key(prompt["msg"], prompt["digests"])
+                answer = self._cache.get(key)
+                if answer is not None:
+                    self._append(task_id, answer, done=True)
+                    self._finish(task_id)
+                    return
+            flight, leader = self._cache.join(key)
+            if not leader:
+                self._follow(flight, task_id)
+                return
+        try:
+            chunks = iter(self._generator.generate(prompt["msg"], prompt["digests"]))
+        except Exception:
+            chunks = iter(())
+        self._stream_step(task_id, chunks, priority, key, flight)
 
+    def _follow(self, flight, task_id: str):
+        """Aggancia la task alla generazione in corso: riceve il testo già prodotto e i chunk successivi."""
+        with flight.lock:
+            if not flight.finished:
+                if flight.chunks:
+                    self._append(task_id, flight.text)
+                flight.followers.append((self, task_id))
+                return
+        # Generazione conclusa nel frattempo: si prende il risultato così com'è
+        self._append(task_id, flight.text, done=True)
+        self._finish(task_id)
+
+    def _stream_step(self, task_id: str, chunks, priority: int, key=None, flight=None):
+        """Aggiunge il prossimo chunk alla task (e ai follower) e ripianifica se stesso fino alla fine."""
+        failed = False
+        try:
+            chunk = next(chunks, None)
+        except Exception:
+            # Generatore in errore: le task si chiudono con la risposta parziale
+            chunk, failed = None, True
+        done = chunk is None
+        if flight is None:
+            alive = self._append(task_id, chunk or '', done=done)
+        else:
+            with flight.lock:
+                self._append(task_id, chunk or '', done=done)
+                # I follower ancora esistenti ricevono lo stesso chunk
+                for follower in list(flight.followers):
+                    session, follower_id = follower
+                    exists = session._append(follower_id, chunk or '', done=done)
+                    if done or not exists:
+                        flight.followers.remove(follower)
+                        session._finish(follower_id)
+                if done:
+                    flight.finished = True
+                else:
+                    flight.chunks.append(chunk)
+            # Una generazione condivisa arriva sempre in fondo, anche se la task
+            # del leader è stata cancellata: il risultato serve ai follower e alla cache
+            alive = True
+            if done:
+                self._cache.finish(key, None if failed else flight.text)
+        if done or not alive:
+            self._finish(task_id)
+            return
+        # Un job per chunk: tra un chunk e l'altro il worker torna al dispatcher equo
+        SCHEDULER.schedule(self._generator.chunk_interval, self._stream_step, task_id, chunks, priority,
+                           key, flight, key=self._client_id, priority=priority)
+
+    def _append(self, task_id: str, chunk: str, done: bool = False) -> bool:
+        """append_response protetto: False se la task non esiste più o lo store è in errore."""
+        try:
+            appended = self._repo.append_response(task_id, chunk, done=done) is not None
+        except Exception:
+            return False
+        if appended and done:
+            self._record_done(task_id)
+        return appended
+
+    def _finish(self, task_id: str):
+        """Fine della generazione, completata o no (task cancellata): libera il posto in ADMISSION."""
+        _CREATED_AT.pop((self._client_id, task_id), None)
+        batch = _SEATS.pop((self._client_id, task_id), None)
+        if batch is not None:
+            self._release(1, batch)
+
+    def _record_done(self, task_id: str):
+        created_at = _CREATED_AT.pop((self._client_id, task_id), None)
+        if created_at is not None:
+            TIME_TO_DONE.observe(time.monotonic() - created_at)
 
     def getTask(self, task_id: int, callback=None, delay_seconds: float | None = None) -> None:
         """
-        Avvia un job nel thread pool che, dopo un ritardo opzionale,
+        Pianifica un job che, dopo un ritardo opzionale,
         richiama repository.get_by_id(task_id). Se viene fornito un callback,
         lo invoca con il risultato (anche None se non trovato).
         """
-        EXECUTOR.submit(self._get_later, task_id, callback, delay_seconds)
+        delay = delay_seconds if delay_seconds is not None else random.uniform(1.0, 4.0)
+        SCHEDULER.schedule(delay, self._get_later, task_id, callback,
+                           key=self._client_id, priority=PRIORITY_INTERACTIVE)
 
 
-    def _get_later(self, task_id: int, callback, delay_seconds: float | None):
-        delay = delay_seconds if delay_seconds is not None else random.uniform(1.0, 4.0)
-        time.sleep(delay)
+    def _get_later(self, task_id: int, callback):
         try:
             result = self._repo.get_by_id(task_id)
             if callable(callback):
@@ -72,6 +346,52 @@ class TaskServiceSession:
             # Non propagare eccezioni del fetch asincrono
             pass
 
+def recover_overdue(store, repository_factory, interval: float = 15.0, grace: float = 10.0):
+    """
+    Job periodico per gli store condivisi tra processi: completa le task la cui
+    scadenza è passata da più di grace secondi (es. il worker che le aveva
+    pianificate è terminato). store deve esporre overdue(before). La presa in
+    carico usa la stessa soglia: se un altro worker l'ha già rinnovata la task
+    viene saltata.
+    """
+    try:
+        before = time.time() - grace
+        for client_id, task_id in store.overdue(before):
+            TaskServiceSession(repository_factory(client_id))._complete_later(task_id, stale_before=before)
+    except Exception:
+        # Il job deve sopravvivere a errori transitori (es. database occupato)
+        pass
+    SCHEDULER.schedule(interval, recover_overdue, store, repository_factory, interval, grace)
+
+
+def snapshot_periodically(store, interval: float = 60.0, min_records: int = 10000):
+    """
+    Job periodico per lo store in memoria con journal: scrive uno snapshot
+    quando dal precedente sono state registrate almeno min_records operazioni,
+    così il log da rileggere all'avvio resta corto.
+    """
+    try:
+        if store.journal_records() >= min_records:
+            store.snapshot()
+    except Exception:
+        # Uno snapshot fallito non deve fermare i successivi
+        pass
+    SCHEDULER.schedule(interval, snapshot_periodically, store, interval, min_records)
+
+
+def sweep_sessions(store, interval: float = 30.0):
+    """
+    Job periodico a bassa priorità: rimuove a piccoli lotti le sessioni scadute
+    o in eccesso rispetto al budget anche nelle stripe senza traffico.
+    """
+    try:
+        store.sweep()
+    except Exception:
+        # Lo sweep deve continuare anche dopo un errore
+        pass
+    SCHEDULER.schedule(interval, sweep_sessions, store, interval)
+
+
 class TaskService:
     def __init__(self, repository: TaskRepository):
         self.repository = repository
@@ -0,0 +1,104 @@
+# Test delle create idempotenti: stessa richiesta ripetuta con lo stesso uuid
+# (200, nessuna nuova task) contro uuid riusato con un contenuto diverso (409),
+# anche nei batch, che vengono accettati o respinti per intero.
+# Uso: python -m pytest -q src/backend/tests
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.backend.app import app
+from src.backend.infrastructure.blobstore import InMemoryBlobStore
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore, TaskConflict
+from src.backend.infrastructure.sqlite_repository import SqliteTaskRepository, SqliteTaskStore
+
+
+class IdempotentCreateApiTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.client.post('/api/newchat')
+
+    def _uuids(self) -> list[str]:
+        return sorted(task['uuid'] for task in self.client.get('/api/tasks').get_json())
+
+    def test_replay_returns_existing_task(self):
+        first = self.client.post('/api/tasks', json={'uuid': 'u1', 'msg': 'ciao'})
+        self.assertEqual(first.status_code, 201)
+        again = self.client.post('/api/tasks', json={'uuid': 'u1', 'msg': 'ciao'})
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.get_json()['task']['uuid'], 'u1')
+        self.assertEqual(self._uuids(), ['u1'])
+
+    def test_conflicting_content_is_rejected(self):
+        self.client.post('/api/tasks', json={'uuid': 'u1', 'msg': 'ciao'})
+        conflict = self.client.post('/api/tasks', json={'uuid': 'u1', 'msg': 'altro'})
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.get_json()['uuid'], 'u1')
+        self.assertEqual(self.client.get('/api/tasks/u1').get_json()['msg'], 'ciao')
+
+    def test_batch_replay(self):
+        items = [{'uuid': 'b1', 'msg': 'uno'}, {'uuid': 'b2', 'msg': 'due'}]
+        self.assertEqual(self.client.post('/api/tasks:batch', json={'tasks': items}).status_code, 201)
+        again = self.client.post('/api/tasks:batch', json={'tasks': items})
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual([task['uuid'] for task in again.get_json()['tasks']], ['b1', 'b2'])
+
+    def test_batch_conflict_creates_nothing(self):
+        self.client.post('/api/tasks', json={'uuid': 'b1', 'msg': 'uno'})
+        response = self.client.post('/api/tasks:batch', json={'tasks': [
+            {'uuid': 'b2', 'msg': 'nuovo'}, {'uuid': 'b1', 'msg': 'diverso'}, {'uuid': 'b3', 'msg': 'nuovo'}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['uuid'], 'b1')
+        self.assertEqual(self._uuids(), ['b1'])
+
+    def test_conflict_inside_the_same_batch(self):
+        response = self.client.post('/api/tasks:batch', json={'tasks': [
+            {'uuid': 'c1', 'msg': 'uno'}, {'uuid': 'c1', 'msg': 'due'}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self._uuids(), [])
+
+
+class IdempotentCreateRepositoryMixin:
+    """Stesse regole per ogni implementazione di TaskRepository (create_many)."""
+    def make_repository(self):
+        raise NotImplementedError
+
+    def test_replay_and_conflict(self):
+        repo = self.make_repository()
+        (task, created), = repo.create_many([{'uuid': 'r1', 'msg': 'ciao'}])
+        self.assertTrue(created)
+        (task, created), = repo.create_many([{'uuid': 'r1', 'msg': 'ciao'}])
+        self.assertFalse(created)
+        self.assertEqual(task['uuid'], 'r1')
+        with self.assertRaises(TaskConflict) as ctx:
+            repo.create_many([{'uuid': 'r1', 'msg': 'altro'}])
+        self.assertEqual(ctx.exception.task_id, 'r1')
+
+    def test_batch_is_all_or_nothing(self):
+        repo = self.make_repository()
+        repo.create_many([{'uuid': 'r1', 'msg': 'ciao'}])
+        with self.assertRaises(TaskConflict):
+            repo.create_many([{'uuid': 'r2', 'msg': 'nuovo'}, {'uuid': 'r1', 'msg': 'altro'}])
+        self.assertEqual([task['uuid'] for task in repo.get_all()], ['r1'])
+        # Le ripetizioni dentro il batch puntano alla prima creazione
+        results = repo.create_many([{'uuid': 'r2', 'msg': 'nuovo'}, {'uuid': 'r2', 'msg': 'nuovo'},
+                                    {'uuid': 'r1', 'msg': 'ciao'}])
+        self.assertEqual([created for _, created in results], [True, False, False])
+        self.assertEqual(sorted(task['uuid'] for task in repo.get_all()), ['r1', 'r2'])
+
+
+class InMemoryIdempotentCreateTest(IdempotentCreateRepositoryMixin, unittest.TestCase):
+    def make_repository(self):
+        return InMemoryTaskRepository('client', InMemoryTaskStore(), InMemoryBlobStore())
+
+
+class SqliteIdempotentCreateTest(IdempotentCreateRepositoryMixin, unittest.TestCase):
+    def make_repository(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        store = SqliteTaskStore(os.path.join(directory, 'tasks.db'))
+        return SqliteTaskRepository('client', store, InMemoryBlobStore())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# Test della persistenza dello store in memoria: recovery da snapshot più coda
+# del log, compresi i record di cancellazione (del) e di rimozione sessione (evict).
+# Uso: python -m pytest -q src/backend/tests
+import base64
+import shutil
+import tempfile
+import time
+import unittest
+
+from src.backend.infrastructure.blobstore import InMemoryBlobStore
+from src.backend.infrastructure.journal import TaskJournal
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore
+
+PDF = 'data:application/pdf;base64,' + base64.b64encode(b'%PDF-1.4 test').decode('ascii')
+
+
+class JournalRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    def _open(self, session_ttl=None):
+        journal = TaskJournal(self.dir)
+        blobs = InMemoryBlobStore()
+        # Una sola stripe: l'ordine di accesso alle sessioni è deterministico
+        store = InMemoryTaskStore(stripes=1, journal=journal, session_ttl=session_ttl, blob_store=blobs)
+        return journal, store, blobs
+
+    def test_snapshot_plus_log_tail(self):
+        journal, store, blobs = self._open(session_ttl=0.2)
+        alice = InMemoryTaskRepository('alice', store, blobs)
+        bob = InMemoryTaskRepository('bob', store, blobs)
+        alice.create_many([{'uuid': 'a1', 'msg': 'primo', 'blobs': [PDF]},
+                           {'uuid': 'a2', 'msg': 'secondo'}])
+        bob.create_many([{'uuid': 'b1', 'msg': 'di bob'}])
+        store.snapshot()
+
+        # Coda del log dopo lo snapshot: bob scade e viene rimosso al prossimo accesso
+        # di alice (evict), alice cancella a2 (del), aggiorna a1 e crea a3 (put)
+        time.sleep(0.3)
+        self.assertEqual(alice.delete_many(['a2']), {'a2': True})
+        self.assertIsNotNone(alice.begin_response('a1'))
+        alice.append_response('a1', 'risposta', done=True)
+        alice.create_many([{'uuid': 'a3', 'msg': 'terzo'}])
+        self.assertEqual(store.stats()['sessions'], 1)
+        journal.close()
+
+        journal, store, blobs = self._open()
+        pending = store.recover(blobs)
+        self.addCleanup(journal.close)
+
+        alice = InMemoryTaskRepository('alice', store, blobs)
+        tasks = {task['uuid']: task for task in alice.get_all()}
+        self.assertEqual(sorted(tasks), ['a1', 'a3'])
+        self.assertTrue(tasks['a1']['done'])
+        self.assertEqual(tasks['a1']['msgresponse'], 'risposta')
+        self.assertEqual(pending, [('alice', 'a3')])
+        # L'allegato di a1 è tornato nel blob store
+        self.assertEqual(alice.get_attachment('a1', 0, encoded=True)['source'], PDF)
+        self.assertEqual(InMemoryTaskRepository('bob', store, blobs).get_all(), [])
+
+    def test_log_only_replay_is_idempotent(self):
+        journal, store, blobs = self._open()
+        repo = InMemoryTaskRepository('alice', store, blobs)
+        repo.create_many([{'uuid': 'a1', 'msg': 'uno'}, {'uuid': 'a2', 'msg': 'due'}])
+        repo.delete_many(['a1'])
+        # Stessa operazione ripetuta: la replay del log deve dare lo stesso stato
+        repo.create_many([{'uuid': 'a2', 'msg': 'due'}])
+        journal.close()
+
+        journal, store, blobs = self._open()
+        store.recover(blobs)
+        self.addCleanup(journal.close)
+        repo = InMemoryTaskRepository('alice', store, blobs)
+        self.assertEqual([task['uuid'] for task in repo.get_all()], ['a2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
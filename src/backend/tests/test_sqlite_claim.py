@@ -0,0 +1,66 @@
+# Test della presa in carico delle task scadute con lo store SQLite condiviso:
+# due worker (due SqliteTaskStore sullo stesso file, come due processi gunicorn)
+# non possono generare la stessa task.
+# Uso: python -m pytest -q src/backend/tests
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from src.backend.infrastructure.blobstore import InMemoryBlobStore
+from src.backend.infrastructure.sqlite_repository import SqliteTaskRepository, SqliteTaskStore
+
+
+class SqliteClaimTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'tasks.db')
+        blobs = InMemoryBlobStore()
+        self.workers = [SqliteTaskRepository('client', SqliteTaskStore(path), blobs) for _ in range(2)]
+
+    def _create_overdue(self, task_ids):
+        due_at = time.time() - 10
+        self.workers[0].create_many([{'uuid': task_id, 'msg': task_id, 'dueAt': due_at} for task_id in task_ids])
+
+    def test_overdue_task_is_claimed_once(self):
+        self._create_overdue(['t1'])
+        before = time.time()
+        self.assertIsNotNone(self.workers[0].begin_response('t1', stale_before=before))
+        # La presa rinnova due_at: per l'altro worker la task non è più scaduta
+        self.assertIsNone(self.workers[1].begin_response('t1', stale_before=before))
+
+    def test_concurrent_claims(self):
+        task_ids = [f't{i}' for i in range(50)]
+        self._create_overdue(task_ids)
+        before = time.time()
+        barrier = threading.Barrier(2)
+        claimed = [[], []]
+
+        def run(index):
+            barrier.wait()
+            for task_id in task_ids:
+                if self.workers[index].begin_response(task_id, stale_before=before) is not None:
+                    claimed[index].append(task_id)
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(set(claimed[0]) & set(claimed[1]), set())
+        self.assertEqual(sorted(claimed[0] + claimed[1]), sorted(task_ids))
+
+    def test_done_task_is_never_claimed(self):
+        self._create_overdue(['t1'])
+        self.assertIsNotNone(self.workers[0].begin_response('t1'))
+        self.workers[0].append_response('t1', 'risposta', done=True)
+        self.assertIsNone(self.workers[1].begin_response('t1', stale_before=time.time() + 60))
+        self.assertIsNone(self.workers[1].begin_response('t1'))
+        self.assertEqual(self.workers[1].get_by_id('t1')['msgresponse'], 'risposta')
+
+
+if __name__ == '__main__':
+    unittest.main()
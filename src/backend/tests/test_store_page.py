@@ -0,0 +1,59 @@
+# Test della paginazione dello store in memoria: pagine e flag has_older /
+# has_newer confrontati con una scansione completa dopo create e cancellazioni casuali.
+# Uso: python -m pytest -q src/backend/tests
+import random
+import unittest
+
+from src.backend.infrastructure.blobstore import InMemoryBlobStore
+from src.backend.infrastructure.repository import InMemoryTaskRepository, InMemoryTaskStore
+
+
+class StorePageTest(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryTaskStore(stripes=1, blob_store=InMemoryBlobStore())
+        self.repo = InMemoryTaskRepository('client', self.store, InMemoryBlobStore())
+
+    def _page(self, limit, after=None, before=None):
+        with self.store.with_lock('client'):
+            return self.store.page('client', limit, after=after, before=before)
+
+    @staticmethod
+    def _expected(live, limit, after=None, before=None):
+        if after is not None:
+            rest = live[live.index(after) + 1:]
+            return rest[:limit], True, len(rest) > limit
+        end = live.index(before) if before is not None else len(live)
+        start = max(0, end - limit)
+        return live[start:end], start > 0, before is not None
+
+    def test_matches_full_scan(self):
+        rng = random.Random(13)
+        live = []
+        counter = 0
+        for _ in range(600):
+            if live and rng.random() < 0.45:
+                # Cancellazioni concentrate agli estremi, dove stanno i buchi da saltare
+                task_id = rng.choice([live[0], live[-1], rng.choice(live)])
+                self.repo.delete_many([task_id])
+                live.remove(task_id)
+            else:
+                counter += 1
+                self.repo.create_many([{'uuid': f't{counter}', 'msg': 'm'}])
+                live.append(f't{counter}')
+            limit = rng.randint(1, 5)
+            self.assertEqual(self._page(limit), self._expected(live, limit))
+            if live:
+                cursor = rng.choice(live)
+                self.assertEqual(self._page(limit, after=cursor), self._expected(live, limit, after=cursor))
+                self.assertEqual(self._page(limit, before=cursor), self._expected(live, limit, before=cursor))
+
+    def test_empty_after_deleting_everything(self):
+        self.repo.create_many([{'uuid': f't{i}', 'msg': 'm'} for i in range(100)])
+        self.repo.delete_many([f't{i}' for i in range(100)])
+        self.assertEqual(self._page(10), ([], False, False))
+        self.repo.create_many([{'uuid': 'n1', 'msg': 'm'}])
+        self.assertEqual(self._page(10), (['n1'], False, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
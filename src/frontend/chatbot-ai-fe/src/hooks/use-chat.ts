@@ -71,7 +71,10 @@ export function useChat(): UseChatReturn {
 
             try {
                 const {taskId, botMessageId} = currentTaskRef.current
-                const taskStatus: TaskStatusResponse = await apiService.getTaskStatus(taskId)
+                // Stream: the partial reply is shown while it is being generated
+                const taskStatus: TaskStatusResponse = await apiService.streamTask(taskId, (text) =>
+                    updateMessage(botMessageId, {content: text, isLoading: false}),
+                )
 
                 if (taskStatus.done && taskStatus.msgresponse) {
                     // Task completed successfully
@@ -112,7 +115,7 @@ export function useChat(): UseChatReturn {
             }
         },
         {
-            interval: 2000,
+            interval: 100,
             immediate: true,
             enabled: isLoading,
         },
@@ -20,7 +20,7 @@ export function usePolling(
 ): UsePollingReturn {
   const { interval = 2000, immediate = false, enabled = true } = options
 
-  const intervalRef = useRef<number | null>(null)
+  const timeoutRef = useRef<number | null>(null)
   const isPollingRef = useRef(false)
   const callbackRef = useRef(callback)
 
@@ -30,9 +30,9 @@ export function usePolling(
   }, [callback])
 
   const stop = useCallback(() => {
-    if (intervalRef.current) {
-      clearInterval(intervalRef.current)
-      intervalRef.current = null
+    if (timeoutRef.current) {
+      clearTimeout(timeoutRef.current)
+      timeoutRef.current = null
     }
     isPollingRef.current = false
   }, [])
@@ -42,7 +42,10 @@ export function usePolling(
 
     isPollingRef.current = true
 
+    // Each poll is scheduled only after the previous one settles, so a slow
+    // (long-poll) callback never overlaps with the next one
     const poll = async () => {
+      timeoutRef.current = null
       try {
         const shouldContinue = await callbackRef.current()
         if (!shouldContinue) {
@@ -52,15 +55,16 @@ export function usePolling(
         console.error("Polling error:", error)
         stop()
       }
+      if (isPollingRef.current) {
+        timeoutRef.current = setTimeout(poll, interval)
+      }
     }
 
-    // Execute immediately if requested
     if (immediate) {
       poll()
+    } else {
+      timeoutRef.current = setTimeout(poll, interval)
     }
-
-    // Set up interval
-    intervalRef.current = setInterval(poll, interval)
   }, [enabled, immediate, interval, stop])
 
   // Cleanup on unmount
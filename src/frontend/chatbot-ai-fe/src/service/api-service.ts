@@ -33,14 +33,6 @@ export interface TaskStatusResponse {
     message: string
 }
 
-const toBase64 = (blob: Blob) =>
-    new Promise<string>((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onloadend = () => resolve(String(reader.result));
-        reader.onerror = reject;
-        reader.readAsDataURL(blob);
-    });
-
 // API Service class with CRUD operations
 class ApiService {
     private baseURL: string
@@ -54,35 +46,24 @@ class ApiService {
         })
     }
 
-    // Create a new task
+    // Create a new task.
+    // Files are sent as multipart/form-data so the backend can stream them to storage
+    // (metadata fields first, then the file parts) instead of parsing base64 JSON.
     async createTask(data: CreateTaskRequest): Promise<CreateTaskResponse> {
-        /*const formData = new FormData()
+        const files = data.files ?? []
+        data.fileStructures = files.map((file) => ({
+            filename: file.name,
+            contentType: file.type
+        }))
+
+        const formData = new FormData()
+        formData.append("uuid", data.uuid)
         formData.append("msg", data.msg)
-        const fileObj = {}*/
-
-        if (data.files && data.files.length > 0) {
-            data.fileStructures = data.files.map((file) => ({
-                filename: file.name,
-                contentType: file.type
-            }))
-            const base64Promises = data.files.map((file) => {
-                return toBase64(file)
-            })
-            data.blobs = await Promise.all(base64Promises)
-
-        }
-        else{
-            data.fileStructures = []
-            data.blobs = []
-        }
-
-        const response: AxiosResponse<CreateTaskResponse> = await this.http.post(`tasks`, data, {
-            headers: {
-                "Content-Type": "application/json"
-            },
-        })
-
+        formData.append("fileStructures", JSON.stringify(data.fileStructures))
+        files.forEach((file) => formData.append("files", file, file.name))
 
+        // Let the browser set the multipart boundary in the Content-Type header
+        const response: AxiosResponse<CreateTaskResponse> = await this.http.post(`tasks`, formData)
 
         return response.data
     }
@@ -94,6 +75,55 @@ class ApiService {
         return response.data
     }
 
+    // Long-poll: resolves as soon as the task is done (or when the server-side timeout expires)
+    async waitTask(taskId: string, timeoutSeconds = 25): Promise<TaskStatusResponse> {
+        const response: AxiosResponse<TaskStatusResponse> = await this.http.get(`tasks/${taskId}/wait`, {
+            params: {timeout: timeoutSeconds},
+        })
+
+        return response.data
+    }
+
+    // Stream the reply as it is generated (Server-Sent Events).
+    // onPartial receives the accumulated text; resolves with the final task when done,
+    // or with done=false when the server closes the connection so the caller can reconnect.
+    // Without EventSource, or when the stream cannot be opened (e.g. a buffering proxy),
+    // falls back to the long-poll: no partial text, same result for the caller.
+    streamTask(taskId: string, onPartial: (text: string) => void): Promise<TaskStatusResponse> {
+        if (typeof EventSource === "undefined") {
+            return this.waitTask(taskId)
+        }
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`${this.baseURL}/tasks/${taskId}/stream`, {withCredentials: true})
+            let opened = false
+            let text = ""
+
+            source.onopen = () => {
+                opened = true
+            }
+            source.onmessage = (event: MessageEvent) => {
+                text += JSON.parse(event.data).delta
+                onPartial(text)
+            }
+            source.addEventListener("done", (event) => {
+                source.close()
+                resolve(JSON.parse((event as MessageEvent).data))
+            })
+            source.addEventListener("gone", () => {
+                source.close()
+                reject(new Error("Task not found"))
+            })
+            source.onerror = () => {
+                source.close()
+                if (opened) {
+                    resolve({uuid: taskId, done: false, msgresponse: text, message: ""})
+                } else {
+                    this.waitTask(taskId).then(resolve, reject)
+                }
+            }
+        })
+    }
+
     // Update task (if needed for future functionality)
     async updateTask(taskId: string, data: Partial<CreateTaskRequest>): Promise<TaskStatusResponse> {
         const response: AxiosResponse<TaskStatusResponse> = await this.http.put(`tasks/${taskId}`, data)